@@ -1,30 +1,61 @@
 import os
 import time
+import asyncio
+import argparse
+import hmac
 import sqlite3
 import shutil
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Callable, Iterator
 
 import pandas as pd
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
-from pydantic import BaseModel
+from passlib.context import CryptContext
+from pydantic import BaseModel, ConfigDict, Field
 from rapidfuzz import process, fuzz
 
 # RBAC bits (we use only the Permission enum from your rbac.py)
 from rbac import Permission
+import compact
+import dates
+import excel_reader
+import fact_table
+import header_cache
+import header_match
+from auth_cache import TokenCache
+from db_pool import ConnectionPool
+import incremental
+import instrumentation
+from job_queue import JobQueue
+import reports
+import rollups
+import run_registry
+import output_writer
+import out_of_core
+import parallel
+from kpis import AMOUNT_COLUMNS, KPI_DEFINITIONS, calculate_kpis, frame_basis
+from logger import get_logger
+import sheet_cache
+import sqlite_loader
+import watcher
 
 # =========================
 # App & Security setup
 # =========================
 app = FastAPI(title="ETL Processing System with JWT + RBAC")
 security = HTTPBearer()
+logger = get_logger()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_DIR = os.path.join(BASE_DIR, "input")
 OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 ARCHIVE_DIR = os.path.join(BASE_DIR, "archive")
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
 DB_PATH = os.path.join(BASE_DIR, "etl_kpis.db")
 
 for folder in [INPUT_DIR, OUTPUT_DIR, ARCHIVE_DIR]:
@@ -35,6 +66,109 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "CHANGE_ME_TO_A_LONG_RANDOM_SECRET")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Auth hot path: one bcrypt context, a capped executor for password checks,
+# a pool of SQLite connections for the endpoints and a cache of verified tokens.
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+AUTH_WORKERS = int(os.environ.get("ETL_AUTH_WORKERS", "4"))
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="bcrypt")
+db_pool = ConnectionPool(DB_PATH, size=int(os.environ.get("ETL_DB_POOL_SIZE", "8")))
+token_cache = TokenCache(
+    max_size=int(os.environ.get("ETL_TOKEN_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("ETL_TOKEN_CACHE_TTL", "300")),
+)
+
+# Workbook reader: "pandas" parses each sheet in one go via pd.ExcelFile,
+# "stream" walks it with a read-only row iterator in ETL_READ_CHUNK_ROWS chunks.
+READER_ENGINE = os.environ.get("ETL_READER", "pandas").lower()
+READ_CHUNK_ROWS = int(os.environ.get("ETL_READ_CHUNK_ROWS", "50000"))
+
+# Projection: resolve each sheet's header row first and parse only the columns the
+# pipeline uses (mapping targets, KPI and rollup inputs) plus ETL_EXTRA_COLUMNS, a
+# comma-separated list of raw or mapped header names (case-insensitive).
+PROJECTION = os.environ.get("ETL_PROJECTION", "0") == "1"
+EXTRA_COLUMNS = {c.strip().casefold() for c in os.environ.get("ETL_EXTRA_COLUMNS", "").split(",") if c.strip()}
+
+# Cache header resolutions per (sheet type, raw header, mapping version) (see header_cache.py).
+HEADER_CACHE_ENABLED = os.environ.get("ETL_HEADER_CACHE", "1") == "1"
+
+# Remember the date formats that parsed each (sheet type, column) (see dates.py).
+REMEMBER_DATE_FORMATS = os.environ.get("ETL_REMEMBER_DATE_FORMATS", "1") == "1"
+
+# Compact dtypes (categoricals, downcast numbers, Arrow strings) for every parsed
+# sheet (see compact.py).
+COMPACT_DTYPES = os.environ.get("ETL_COMPACT_DTYPES", "1") == "1"
+# When set, every stage records the deep size of the frames it produced and a
+# stage going over this many MB is logged as a warning (0 = off; measuring costs time).
+MEMORY_BUDGET_BYTES = int(os.environ.get("ETL_MEMORY_BUDGET_MB", "0")) * 1024 * 1024
+
+# Parsed-sheet cache keyed by workbook content hash (see sheet_cache.py).
+SHEET_CACHE_ENABLED = os.environ.get("ETL_SHEET_CACHE", "1") == "1"
+SHEET_CACHE_MAX_BYTES = int(os.environ.get("ETL_SHEET_CACHE_MAX_MB", "2048")) * 1024 * 1024
+SHEET_CACHE_MAX_AGE_DAYS = float(os.environ.get("ETL_SHEET_CACHE_MAX_AGE_DAYS", "30"))
+
+# Number of worker processes used to ingest INPUT_DIR (1 = sequential).
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", "1"))
+# Worker processes used to parse the sheets of one workbook. Ignored inside an
+# ETL_WORKERS pool so the two levels don't oversubscribe the machine.
+SHEET_WORKERS = int(os.environ.get("ETL_SHEET_WORKERS", "1"))
+
+# How sheets are joined: "line" left-joins the raw transaction lines (a claim with
+# 5 charge lines and 4 payments becomes 20 rows), "claim" first collapses every
+# sheet to one row per claim and joins one-to-one.
+JOIN_MODE = os.environ.get("ETL_JOIN_MODE", "line").lower()
+
+# Out-of-core mode (see out_of_core.py): stream the sheets into a scratch SQLite
+# database under ETL_SCRATCH_DIR and join, score and write them from there, so
+# memory stays flat however large the workbook. Not combined with ETL_INCREMENTAL,
+# which fingerprints the sheets in memory.
+OUT_OF_CORE = os.environ.get("ETL_OUT_OF_CORE", "0") == "1"
+SCRATCH_DIR = os.environ.get("ETL_SCRATCH_DIR", os.path.join(BASE_DIR, "scratch"))
+
+# Output files per workbook: any of "csv", "parquet", "feather", comma-separated.
+# ETL_OUTPUT_PARTITIONED=1 writes Parquet/Feather as run_id=/service_month= datasets.
+OUTPUT_FORMATS = [f.strip() for f in os.environ.get("ETL_OUTPUT_FORMAT", "csv").lower().split(",") if f.strip()]
+OUTPUT_COMPRESSION = os.environ.get("ETL_OUTPUT_COMPRESSION", "zstd")
+OUTPUT_PARTITIONED = os.environ.get("ETL_OUTPUT_PARTITIONED", "0") == "1"
+
+# Incremental mode (see incremental.py): skip workbooks already in the manifest,
+# recompute only new/changed claims and upsert them into one claims_kpis table.
+INCREMENTAL = os.environ.get("ETL_INCREMENTAL", "0") == "1"
+
+# KPI rows of every run go to the claims_fact table (see fact_table.py);
+# ETL_RUN_TABLES=1 also writes the per-run claims_with_kpis_<run_id> tables.
+RUN_TABLES = os.environ.get("ETL_RUN_TABLES", "0") == "1"
+# Retention for claims_fact and the per-run tables, applied after every run:
+# keep the newest ETL_RETENTION_RUNS runs and/or the files loaded in the last
+# ETL_RETENTION_DAYS days (0 = no limit).
+RETENTION_RUNS = int(os.environ.get("ETL_RETENTION_RUNS", "0"))
+RETENTION_DAYS = float(os.environ.get("ETL_RETENTION_DAYS", "0"))
+
+# Build the kpi_rollups summary table after calculate_kpis (see rollups.py).
+BUILD_ROLLUPS = os.environ.get("ETL_ROLLUPS", "1") == "1"
+
+# Background jobs started by /api/process-files that may run at the same time.
+JOB_WORKERS = int(os.environ.get("ETL_JOB_WORKERS", "1"))
+
+# Seconds a job or input file stays claimed without a heartbeat before another API
+# process may take it over (see job_queue.py).
+JOB_LEASE_SECONDS = float(os.environ.get("ETL_JOB_LEASE", "60"))
+
+# Times a job may lose its worker (lease expired mid-run) before it is marked
+# failed instead of being queued again.
+JOB_MAX_ATTEMPTS = int(os.environ.get("ETL_JOB_MAX_ATTEMPTS", "3"))
+
+# Watch mode (see watcher.py): `ETL.py --watch`, or ETL_WATCH=1 to run it inside
+# the API. A landed file is processed once its size has been stable this long.
+WATCH_ENABLED = os.environ.get("ETL_WATCH", "0") == "1"
+WATCH_POLL_SECONDS = float(os.environ.get("ETL_WATCH_POLL_SECONDS", "1"))
+WATCH_SETTLE_SECONDS = float(os.environ.get("ETL_WATCH_SETTLE_SECONDS", "1"))
+# A file that failed, or that another process had claimed, is tried again this much later.
+WATCH_RETRY_SECONDS = float(os.environ.get("ETL_WATCH_RETRY_SECONDS", "30"))
+
+# /metrics is scraped by Prometheus rather than a logged-in user; when set, the
+# scraper must send this value as its bearer token.
+METRICS_TOKEN = os.environ.get("ETL_METRICS_TOKEN")
+
 
 # =========================
 # JWT helpers (Step 3)
@@ -62,31 +196,35 @@ class LoginRequest(BaseModel):
     password: str
 
 
-@app.post("/auth/login")
-def login(req: LoginRequest):
-    """
-    Validate credentials from SQLite users table and issue a JWT.
-    """
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute(
+def verify_credentials(username: str, password: str) -> tuple | None:
+    """Look the user up and check the bcrypt hash; returns (id, username, role) or None."""
+    with db_pool.connection() as conn:
+        row = conn.execute(
             "SELECT id, username, password_hash, role FROM users WHERE username=?",
-            (req.username,),
-        )
-        row = cur.fetchone()
-
+            (username,),
+        ).fetchone()
     if not row:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+        return None
 
     user_id, username, password_hash, role = row
+    if not pwd_ctx.verify(password, password_hash):
+        return None
+    return user_id, username, role
 
-    # verify password using passlib[bcrypt]
-    from passlib.context import CryptContext
 
-    pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    if not pwd_ctx.verify(req.password, password_hash):
+@app.post("/auth/login")
+async def login(req: LoginRequest):
+    """
+    Validate credentials from SQLite users table and issue a JWT.
+    bcrypt is deliberately slow, so it runs on the capped auth executor
+    rather than the shared threadpool.
+    """
+    loop = asyncio.get_running_loop()
+    user = await loop.run_in_executor(auth_executor, verify_credentials, req.username, req.password)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    user_id, username, role = user
     token = create_access_token(str(user_id), username, role)
     return {"access_token": token, "token_type": "bearer"}
 
@@ -94,11 +232,15 @@ def login(req: LoginRequest):
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
     """
     Extract current user from JWT and (optionally) confirm they still exist.
+    Recently verified tokens come from token_cache without a new decode.
     """
     token = credentials.credentials
-    payload = decode_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode_token(token)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        token_cache.put(token, payload)
 
     # You can re-check the user/role from DB here if you want it authoritative.
     # For performance we’ll trust the token by default:
@@ -200,26 +342,360 @@ sheet_mappings = {
 }
 
 
-def fuzzy_match_header(col_name, mapping_keys, score_cutoff=85):
+# Mapped column names something downstream reads; the rest only pass through to the outputs
+PIPELINE_COLUMNS = {
+    *(col for mapping in sheet_mappings.values() for col in mapping.values()),
+    *AMOUNT_COLUMNS,
+    *(col for kpi in KPI_DEFINITIONS for col in kpi.inputs),
+    *(col for col in rollups.DIMENSIONS.values() if col),
+    *rollups.MEASURES.values(),
+    "Claim No",
+    "DOS",
+    "Financial Status",
+}
+
+
+HEADER_SCORE_CUTOFF = 85
+# Describes how headers are matched; part of the header-cache and sheet-cache keys,
+# so changing the matcher invalidates what was resolved or parsed with the old one
+HEADER_MATCHER = f"one-to-one casefold token_sort_ratio>={HEADER_SCORE_CUTOFF}"
+
+
+def fuzzy_match_header(col_name, mapping_keys, score_cutoff=HEADER_SCORE_CUTOFF):
     match, score, _ = process.extractOne(col_name, mapping_keys, scorer=fuzz.token_sort_ratio)
     if score >= score_cutoff:
         return match
     return None
 
 
-def normalize_headers(df, mapping):
-    new_cols = {}
-    for col in df.columns:
-        match_key = fuzzy_match_header(col, mapping.keys()) or col
-        new_cols[col] = mapping.get(match_key, col)
-    return df.rename(columns=new_cols)
+_header_caches: Dict[str, header_cache.HeaderCache] = {}
+
+
+def get_header_cache() -> header_cache.HeaderCache | None:
+    if not HEADER_CACHE_ENABLED:
+        return None
+    if DB_PATH not in _header_caches:
+        _header_caches[DB_PATH] = header_cache.HeaderCache(DB_PATH, HEADER_MATCHER)
+    return _header_caches[DB_PATH]
+
+
+def assign_headers(columns, mapping, claimed=frozenset()) -> tuple[Dict[str, str], set]:
+    """
+    New name for each of `columns`, matched one-to-one against the mapping keys
+    whose target is not in `claimed` (see header_match.py); unmatched columns
+    keep their name. Also returns the columns whose answer is safe to cache.
+    """
+    columns = list(columns)
+    taken = [k for k, target in mapping.items() if target in claimed]
+    assigned, settled = header_match.assign(columns, list(mapping), HEADER_SCORE_CUTOFF, taken)
+    return {col: mapping[assigned[col]] if col in assigned else col for col in columns}, settled
+
+
+def resolve_headers(columns, mapping, sheet_key: str | None = None) -> Dict[str, str]:
+    """New name for every column; `sheet_key` enables the header-resolution cache."""
+    cache = get_header_cache() if sheet_key else None
+    if cache is not None:
+        return cache.resolve(
+            columns, mapping, sheet_key, lambda cols, claimed: assign_headers(cols, mapping, claimed)
+        )
+    return assign_headers(columns, mapping)[0]
+
+
+def normalize_headers(df, mapping, sheet_key: str | None = None):
+    with instrumentation.timed("headers"):
+        renames = resolve_headers(df.columns, mapping, sheet_key)
+    return df.rename(columns=renames)
+
+
+def project_headers(columns, mapping, sheet_key: str | None = None) -> tuple[List[int], Dict[str, str]]:
+    """Positions of the columns a projected read keeps, and the renames for every column."""
+    renames = resolve_headers(columns, mapping, sheet_key)
+    keep = [
+        i for i, col in enumerate(columns)
+        if renames[col] in PIPELINE_COLUMNS
+        or str(col).casefold() in EXTRA_COLUMNS
+        or str(renames[col]).casefold() in EXTRA_COLUMNS
+    ]
+    return keep, renames
+
+
+def projection_key() -> List[str] | None:
+    """What a projected sheet holds, for the sheet cache key (None when reading everything)."""
+    return sorted(PIPELINE_COLUMNS | EXTRA_COLUMNS) if PROJECTION else None
+
+
+_date_format_stores: Dict[str, dates.FormatStore] = {}
+
+
+def date_format_store() -> dates.FormatStore | None:
+    if not REMEMBER_DATE_FORMATS:
+        return None
+    if DB_PATH not in _date_format_stores:
+        _date_format_stores[DB_PATH] = dates.FormatStore(DB_PATH)
+    return _date_format_stores[DB_PATH]
+
+
+def coerce_dates(
+    df: pd.DataFrame, sheet_key: str | None = None, chunk_reports: Dict[str, Any] | None = None
+) -> pd.DataFrame:
+    """
+    Parse the date columns in place; `sheet_key` enables the remembered formats.
+    For a chunk, the reports are folded into `chunk_reports` instead of being
+    stored, and the caller stores them once for the whole sheet.
+    """
+    store = date_format_store() if sheet_key else None
+    with instrumentation.timed("dates", rows_in=len(df)):
+        reports = dates.coerce_frame(df, sheet_key, store, persist=chunk_reports is None)
+    if chunk_reports is not None:
+        dates.merge_reports(chunk_reports, reports)
+    return df
+
+
+def compact_sheet(df: pd.DataFrame) -> pd.DataFrame:
+    """Compact dtypes for a parsed sheet; the claim key and the amounts keep theirs."""
+    if not COMPACT_DTYPES:
+        return df
+    with instrumentation.timed("dtypes", rows_in=len(df)):
+        return compact.optimize_frame(df, keep=["Claim No", *AMOUNT_COLUMNS])
+
+
+def measure_frames(rec: instrumentation.StageRecord, *frames: pd.DataFrame) -> None:
+    """With a memory budget set, record the stage's frame footprint and warn when it is over."""
+    if not MEMORY_BUDGET_BYTES:
+        return
+    rec.frame_bytes = compact.frame_bytes(*frames)
+    if rec.frame_bytes > MEMORY_BUDGET_BYTES:
+        logger.warning(
+            f"Stage {rec.stage} holds {rec.frame_bytes / 2**20:,.1f} MB of frames, "
+            f"over the {MEMORY_BUDGET_BYTES / 2**20:,.0f} MB budget"
+        )
+
+
+def match_sheet(sheet: str) -> str | None:
+    for key in sheet_mappings:
+        if key.lower() in sheet.lower():
+            return key
+    return None
+
+
+def iter_sheet_streaming(wb, sheet: str, mapping: dict, sheet_key: str | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield one sheet chunk by chunk. Headers are resolved once from the first chunk,
+    then every chunk is renamed and date-coerced before the next one is read, so
+    only one raw chunk is alive at a time.
+    """
+    renames = None
+
+    def pick_columns(columns: List[str]) -> List[int]:
+        nonlocal renames
+        with instrumentation.timed("headers"):
+            keep, renames = project_headers(columns, mapping, sheet_key)
+        return keep
+
+    usecols = pick_columns if PROJECTION else None
+    reader = excel_reader.iter_sheet_chunks(wb, sheet, READ_CHUNK_ROWS, usecols)
+    date_reports: Dict[str, Any] = {}
+    while True:
+        with instrumentation.timed("read") as rec:
+            chunk = next(reader, None)
+            rec.rows_out = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        if renames is None:
+            with instrumentation.timed("headers"):
+                renames = resolve_headers(chunk.columns, mapping, sheet_key)
+        yield coerce_dates(chunk.rename(columns=renames), sheet_key, date_reports)
+    store = date_format_store() if sheet_key else None
+    if store is not None:
+        store.record(sheet_key, date_reports)
+
+
+def read_sheet_streaming(wb, sheet: str, mapping: dict, sheet_key: str | None = None) -> pd.DataFrame:
+    """Read one sheet with iter_sheet_streaming and compact it."""
+    chunks = list(iter_sheet_streaming(wb, sheet, mapping, sheet_key))
+    if not chunks:
+        return pd.DataFrame()
+    # compacted only once all chunks are in, so every chunk's categoricals share the same categories
+    return compact_sheet(chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True))
+
+
+def read_sheet(xl: pd.ExcelFile, sheet: str, key: str) -> pd.DataFrame:
+    """
+    Parse one sheet with pandas, then normalize, date-coerce and compact it. With
+    PROJECTION the header row is read on its own first and only the kept columns
+    are parsed.
+    """
+    mapping = sheet_mappings[key]
+    if not PROJECTION:
+        with instrumentation.timed("read") as rec:
+            df = xl.parse(sheet)
+            rec.rows_out = len(df)
+        return compact_sheet(coerce_dates(normalize_headers(df, mapping, key), key))
+
+    with instrumentation.timed("headers"):
+        columns = list(xl.parse(sheet, nrows=0).columns)
+        keep, renames = project_headers(columns, mapping, key)
+    with instrumentation.timed("read") as rec:
+        df = xl.parse(sheet, usecols=keep) if keep else pd.DataFrame()
+        rec.rows_out = len(df)
+    # by position: pandas would number repeated headers among the kept columns only
+    df.columns = [renames[columns[i]] for i in keep]
+    return compact_sheet(coerce_dates(df, key))
+
+
+def parse_sheet(job: tuple[str, str], file_path: str, engine: str) -> pd.DataFrame:
+    """Parse, normalize, date-coerce and compact a single (sheet, mapping key) of a workbook."""
+    sheet, key = job
+    if engine == "stream":
+        with excel_reader.open_workbook(file_path) as wb:
+            return read_sheet_streaming(wb, sheet, sheet_mappings[key], key)
+    with pd.ExcelFile(file_path) as xl:
+        return read_sheet(xl, sheet, key)
+
+
+def _parse_sheet_recorded(job: tuple[str, str], file_path: str, engine: str):
+    """parse_sheet for a pool worker: returns the frame and the sub-stages and counters it recorded."""
+    recorder = instrumentation.StageRecorder(os.path.basename(file_path))
+    with recorder.activate():
+        df = parse_sheet(job, file_path, engine)
+    return df, recorder.as_dict(), recorder.counters
+
+
+def _parse_sheets_parallel(file_path: str, workers: int) -> tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    jobs = [(sheet, match_sheet(sheet)) for sheet in excel_reader.sheet_names(file_path)]
+    jobs = [job for job in jobs if job[1]]
+
+    frames = {}
+    recorder = instrumentation.StageRecorder.active()
+    for job, res, error in parallel.run_in_pool(_parse_sheet_recorded, jobs, workers, file_path, READER_ENGINE):
+        if error is not None:
+            raise ValueError(f"Failed to parse sheet {job[0]!r}: {error}")
+        frames[job], stages, counters = res
+        if recorder is not None:
+            recorder.merge(stages, counters)
+
+    # keep workbook order so a later sheet matching the same key still wins
+    processed, sources = {}, {}
+    for sheet, key in jobs:
+        processed[key] = frames[(sheet, key)]
+        sources[key] = sheet
+    return processed, sources
+
+
+def parse_sheets(file_path: str, workers: int = SHEET_WORKERS) -> tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """
+    Parse, normalize, date-coerce and compact every sheet that matches a sheet_mappings key.
+    Returns the frames by mapping key and the workbook sheet each one came from.
+    With workers > 1 each sheet is parsed in its own process.
+    """
+    if workers > 1 and not parallel.in_worker():
+        return _parse_sheets_parallel(file_path, workers)
+
+    processed, sources = {}, {}
+    if READER_ENGINE == "stream":
+        with excel_reader.open_workbook(file_path) as wb:
+            for sheet in wb.sheetnames:
+                key = match_sheet(sheet)
+                if key:
+                    processed[key] = read_sheet_streaming(wb, sheet, sheet_mappings[key], key)
+                    sources[key] = sheet
+        return processed, sources
+
+    with pd.ExcelFile(file_path) as xl:
+        for sheet in xl.sheet_names:
+            key = match_sheet(sheet)
+            if key:
+                processed[key] = read_sheet(xl, sheet, key)
+                sources[key] = sheet
+    return processed, sources
+
+
+def _load_cached_sheets(digest: str) -> Dict[str, pd.DataFrame] | None:
+    names = sheet_cache.load_sheet_names(CACHE_DIR, digest)
+    if names is None:
+        return None
+    processed = {}
+    for sheet in names:
+        key = match_sheet(sheet)
+        if key:
+            df = sheet_cache.load(CACHE_DIR, digest, sheet, sheet_mappings[key], projection_key(), HEADER_MATCHER)
+            if df is None:
+                return None
+            processed[key] = df
+    return processed
+
+
+def extract_sheets(file_path: str, digest: str | None = None) -> Dict[str, pd.DataFrame]:
+    """
+    Return the normalized sheets of a workbook, from the sheet cache when this
+    exact file content has been parsed before. `digest` is the file's SHA-256,
+    when the caller already has it.
+    """
+    if not SHEET_CACHE_ENABLED:
+        return parse_sheets(file_path)[0]
+
+    digest = digest or sheet_cache.file_digest(file_path)
+    with instrumentation.timed("cache_load"):
+        cached = _load_cached_sheets(digest)
+    if cached is not None:
+        return cached
+
+    processed, sources = parse_sheets(file_path)
+    with instrumentation.timed("cache_store"):
+        stored = all(
+            sheet_cache.store(
+                CACHE_DIR, digest, sheet, sheet_mappings[key], processed[key], projection_key(), HEADER_MATCHER
+            )
+            for key, sheet in sources.items()
+        )
+        if stored:
+            sheet_cache.store_sheet_names(CACHE_DIR, digest, list(sources.values()))
+        sheet_cache.evict(CACHE_DIR, SHEET_CACHE_MAX_BYTES, SHEET_CACHE_MAX_AGE_DAYS)
+    return processed
 
 
-def safe_merge(left_df, right_df, on_col):
+def safe_merge(left_df, right_df, on_col, validate=None):
     dup_cols = [c for c in right_df.columns if c in left_df.columns and c != on_col]
     if dup_cols:
         right_df = right_df.drop(columns=dup_cols)
-    return left_df.merge(right_df, on=on_col, how="left")
+    return left_df.merge(right_df, on=on_col, how="left", validate=validate)
+
+
+def merge_sheets(sheets: Dict[str, pd.DataFrame], validate=None) -> pd.DataFrame:
+    """Left-join Payment, Adjustment and Pending AR onto Charges by Claim No."""
+    merged = sheets["Charges"]
+    for key in ("Payment", "Adjustment", "Pending AR"):
+        merged = safe_merge(merged, sheets[key], "Claim No", validate)
+    return merged
+
+
+# Amount summed and entry date spanned per claim when JOIN_MODE == "claim"
+claim_rollups = {
+    "Charges": ("Billed Amount", "Charge Entry Date"),
+    "Payment": ("Paid Amount", "Payment Entry Date"),
+    "Adjustment": ("Adjustment Amount", "Adjustment Entry Date"),
+    "Pending AR": ("AR Balance", "Charge Entry Date"),
+}
+
+
+def aggregate_by_claim(df: pd.DataFrame, sheet_key: str, on_col: str = "Claim No") -> pd.DataFrame:
+    """
+    Collapse a sheet to one row per claim: the amount is summed, the entry date
+    becomes the first entry plus a "Last ..." column, "<sheet> Count" holds the
+    number of lines and every other column keeps its first non-null value.
+    """
+    amount_col, date_col = claim_rollups[sheet_key]
+    grouped = df.groupby(on_col, sort=False, dropna=False)
+
+    out = grouped.first()
+    if amount_col in df.columns:
+        amounts = pd.to_numeric(df[amount_col], errors="coerce")
+        out[amount_col] = amounts.groupby(df[on_col], sort=False, dropna=False).sum()
+    if date_col in df.columns:
+        out[date_col] = grouped[date_col].min()
+        out[f"Last {date_col}"] = grouped[date_col].max()
+    out[f"{sheet_key} Count"] = grouped.size()
+    return out.reset_index()
 
 
 def make_unique_columns(columns):
@@ -235,93 +711,436 @@ def make_unique_columns(columns):
     return out
 
 
-def calculate_kpis(df: pd.DataFrame) -> pd.DataFrame:
-    for col in ["Paid Amount", "Billed Amount", "Adjustment Amount", "AR Balance"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
-
-    if "DOS" in df.columns and "Charge Entry Date" in df.columns:
-        df["Charge Lag (days)"] = (df["Charge Entry Date"] - df["DOS"]).dt.days
-
-    if "Charge Entry Date" in df.columns and "Payment Entry Date" in df.columns:
-        df["Billing Lag (days)"] = (df["Payment Entry Date"] - df["Charge Entry Date"]).dt.days
-
-    if "Paid Amount" in df.columns and "Billed Amount" in df.columns:
-        billed = pd.to_numeric(df["Billed Amount"], errors="coerce").fillna(0)
-        paid = pd.to_numeric(df["Paid Amount"], errors="coerce").fillna(0)
-        df["GCR (%)"] = ((paid / billed.replace(0, pd.NA)) * 100).fillna(0).round(2)
-
-    if {"Paid Amount", "Billed Amount", "Adjustment Amount"}.issubset(df.columns):
-        billed = pd.to_numeric(df["Billed Amount"], errors="coerce").fillna(0)
-        adj = pd.to_numeric(df["Adjustment Amount"], errors="coerce").fillna(0)
-        paid = pd.to_numeric(df["Paid Amount"], errors="coerce").fillna(0)
-        collectible = (billed - adj).replace(0, pd.NA)
-        df["NCR (%)"] = ((paid / collectible) * 100).fillna(0).round(2)
-        df["CCR (%)"] = ((paid / collectible) * 100).fillna(0).round(2)
+def _archive(file_path: str) -> None:
+    shutil.move(file_path, os.path.join(ARCHIVE_DIR, os.path.basename(file_path)))
 
-    if {"AR Balance", "Billed Amount"}.issubset(df.columns):
-        billed_sum = df["Billed Amount"].sum()
-        avg_daily_charges = billed_sum / 30 if billed_sum else None
-        df["AR Days"] = (df["AR Balance"] / avg_daily_charges).round(1) if avg_daily_charges else None
 
-    if "Aging Range" in df.columns and "AR Balance" in df.columns:
-        df["90+ AR Days (%)"] = df.apply(
-            lambda x: x["AR Balance"] if "90" in str(x["Aging Range"]) else 0,
-            axis=1,
-        )
-
-    if "Financial Status" in df.columns:
-        total_claims = len(df)
-        denied_claims = df["Financial Status"].astype(str).str.contains("denied", case=False, na=False).sum()
-        df["Denial Rate (%)"] = (denied_claims / total_claims * 100).round(2) if total_claims else None
+def process_single_file(file_path: str, run_id: str, progress: Callable[[str, str], None] | None = None) -> dict:
+    """
+    Run the whole pipeline for one workbook and record the outcome in the run
+    registry. `progress(file_name, stage)` is called as each stage starts.
+    """
+    start = time.time()
+    name = os.path.basename(file_path)
+    recorder = instrumentation.StageRecorder(name)
+
+    def stage(label: str, rows_in: int | None = None) -> instrumentation.StageRecord:
+        if progress:
+            progress(name, label)
+        return recorder.mark(label, rows_in)
+
+    bytes_in = os.path.getsize(file_path) if os.path.exists(file_path) else None
+    with recorder.activate():
+        result = _run_stages(file_path, run_id, name, stage)
+    failed_stage = recorder.current_stage
+    recorder.mark(None)
+    result.update(
+        stages=recorder.as_dict(),
+        counters=recorder.counters,
+        bytes_in=bytes_in,
+        elapsed=round(time.time() - start, 2),
+    )
+    if not result["success"]:
+        result["failed_stage"] = failed_stage
 
-    return df
+    try:
+        with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+            run_registry.record_file(conn, run_id, name, result)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not record {name} in the run registry: {e}")
+    return result
 
 
-def process_single_file(file_path: str, run_id: str) -> dict:
-    start = time.time()
+def _run_stages(
+    file_path: str, run_id: str, name: str, stage: Callable[..., instrumentation.StageRecord]
+) -> dict:
+    """The pipeline stages of process_single_file; returns its result dict without timings."""
     try:
-        with pd.ExcelFile(file_path) as xl:
-            processed = {}
-            for sheet in xl.sheet_names:
-                for key, mapping in sheet_mappings.items():
-                    if key.lower() in sheet.lower():
-                        df = xl.parse(sheet)
-                        df = normalize_headers(df, mapping)
-                        for col in df.columns:
-                            if "date" in col.lower():
-                                df[col] = pd.to_datetime(df[col], errors="coerce")
-                        processed[key] = df
-                        break
+        if OUT_OF_CORE and not INCREMENTAL:
+            return _run_stages_out_of_core(file_path, run_id, name, stage)
+
+        stage("hashing")
+        digest = sheet_cache.file_digest(file_path) if SHEET_CACHE_ENABLED or INCREMENTAL else None
+        if INCREMENTAL:
+            with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+                already_done = incremental.is_processed(conn, digest)
+            if already_done:
+                _archive(file_path)
+                return {"success": True, "skipped": True, "rows": 0}
+
+        extract = stage("extract")
+        processed = extract_sheets(file_path, digest)
+        extract.rows_out = sum(len(df) for df in processed.values())
+        measure_frames(extract, *processed.values())
 
         required = {"Charges", "Payment", "Adjustment", "Pending AR"}
         if not required.issubset(processed):
             missing = required - set(processed)
             raise ValueError(f"Missing required sheets: {', '.join(missing)}")
 
-        merged = processed["Charges"]
-        merged = safe_merge(merged, processed["Payment"], "Claim No")
-        merged = safe_merge(merged, processed["Adjustment"], "Claim No")
-        merged = safe_merge(merged, processed["Pending AR"], "Claim No")
+        if INCREMENTAL:
+            processed = {key: processed[key] for key in required}
+            fingerprint = stage("fingerprint", rows_in=sum(len(df) for df in processed.values()))
+            hashes = incremental.sheet_hashes(processed)
+            fingerprints = incremental.claim_fingerprints(processed)
+            total_claims = len(fingerprints)
+            with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+                changed, removed = incremental.changed_claims(conn, name, fingerprints)
+            fingerprint.rows_out = len(changed)
+
+        merge = stage("merge", rows_in=sum(len(processed[key]) for key in required))
+        by_claim = None
+        if JOIN_MODE == "claim" or BUILD_ROLLUPS:
+            with instrumentation.timed("aggregate"):
+                by_claim = {key: aggregate_by_claim(processed[key], key) for key in required}
+        if JOIN_MODE == "claim":
+            merged = merge_sheets(by_claim, "one_to_one")
+        else:
+            merged = merge_sheets(processed)
+        merge.rows_out = len(merged)
+        measure_frames(merge, merged)
 
+        kpis = stage("kpis", rows_in=len(merged))
         merged = calculate_kpis(merged)
+        kpis.rows_out = len(merged)
+        # frame-wide KPIs are always computed over the whole workbook, incremental or not
+        basis = frame_basis(merged) if INCREMENTAL else None
+        measure_frames(kpis, merged)
+        rollup_frame = None
+        if BUILD_ROLLUPS:
+            # the line join repeats every sheet's amounts once per matching line of the
+            # other sheets, so the rollups are always summed over one row per claim
+            claims = merged if JOIN_MODE == "claim" else calculate_kpis(merge_sheets(by_claim, "one_to_one"))
+            with instrumentation.timed("rollups", rows_in=len(claims)) as rec:
+                rollup_frame = rollups.build_rollups(claims, run_id, name)
+                rec.rows_out = len(rollup_frame)
         merged.columns = [c.lower().strip() for c in merged.columns]
         merged.columns = make_unique_columns(merged.columns)
 
-        out_csv = os.path.join(
-            OUTPUT_DIR, f"{os.path.splitext(os.path.basename(file_path))[0]}_with_kpis.csv"
+        write = stage("write_outputs", rows_in=len(merged))
+        outputs = output_writer.write_outputs(
+            merged,
+            OUTPUT_DIR,
+            f"{os.path.splitext(os.path.basename(file_path))[0]}_with_kpis",
+            run_id,
+            OUTPUT_FORMATS,
+            compression=OUTPUT_COMPRESSION,
+            partitioned=OUTPUT_PARTITIONED,
         )
-        merged.to_csv(out_csv, index=False)
+        bytes_out = run_registry.path_bytes(outputs)
+        write.bytes_written = bytes_out
+
+        load_stage = stage("load", rows_in=len(merged))
+        with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+            if INCREMENTAL:
+                if incremental.stored_basis(conn, name) != incremental.encode_basis(basis):
+                    # the stored rows of unchanged claims were computed on another basis
+                    changed = set(fingerprints.index)
+                delta = incremental.select_claims(merged, changed)
+                load = incremental.upsert_claims(
+                    conn, delta, delta["claim no"].drop_duplicates(),
+                    fingerprints[fingerprints.index.isin(list(changed))], removed, digest,
+                    name, hashes, total_claims, run_id, basis=basis,
+                )
+            else:
+                load = fact_table.load_frame(conn, merged, run_id, name)
+                if RUN_TABLES:
+                    sqlite_loader.bulk_load(conn, merged, f"claims_with_kpis_{run_id}", indexes=["claim no"])
+            load_stage.rows_out = load["rows"]
+            if rollup_frame is not None:
+                with instrumentation.timed("rollups", rows_in=len(rollup_frame)):
+                    rollups.store_rollups(conn, rollup_frame, run_id, name)
+        fact_table.refresh_statistics(DB_PATH, incremental.KPI_TABLE if INCREMENTAL else fact_table.FACT_TABLE)
+
+        stage("archive")
+        _archive(file_path)
+
+        result = {
+            "success": True,
+            "rows": len(merged),
+            "output": outputs[0] if outputs else None,
+            "outputs": outputs,
+            "bytes_out": bytes_out,
+            "load_rows_per_sec": load["rows_per_sec"],
+        }
+        if INCREMENTAL:
+            result["changed_claims"] = len(changed)
+            result["removed_claims"] = len(removed)
+            result["total_claims"] = total_claims
+        return result
+    except Exception as e:
+        return {"success": False, "error": str(e)}
 
-        with sqlite3.connect(DB_PATH) as conn:
-            merged.to_sql(f"claims_with_kpis_{run_id}", conn, if_exists="replace", index=False)
 
-        time.sleep(0.2)
-        shutil.move(file_path, os.path.join(ARCHIVE_DIR, os.path.basename(file_path)))
+def _output_columns(columns: List[str]) -> List[str]:
+    return make_unique_columns([c.lower().strip() for c in columns])
 
-        return {"success": True, "rows": len(merged), "output": out_csv, "elapsed": round(time.time() - start, 2)}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+
+def _run_stages_out_of_core(
+    file_path: str, run_id: str, name: str, stage: Callable[..., instrumentation.StageRecord]
+) -> dict:
+    """
+    _run_stages with OUT_OF_CORE: every sheet is streamed into a scratch database
+    and the merge, KPIs, rollups, outputs and load run from there, never holding
+    more than one chunk of rows in memory. Raises on failure.
+    """
+    order = ["Charges", "Payment", "Adjustment", "Pending AR"]
+    with out_of_core.scratch_db(SCRATCH_DIR) as conn:
+        extract = stage("extract")
+        staged = {}
+        with excel_reader.open_workbook(file_path) as wb:
+            for sheet in wb.sheetnames:
+                key = match_sheet(sheet)
+                if key:
+                    table = f"stage_{key}"
+                    chunks = (
+                        chunk.set_axis(make_unique_columns(chunk.columns), axis=1)
+                        for chunk in iter_sheet_streaming(wb, sheet, sheet_mappings[key], key)
+                    )
+                    staged[key] = (table, *out_of_core.stage_sheet(conn, table, chunks, "Claim No"))
+        extract.rows_out = sum(rows for *_, rows in staged.values())
+
+        if not set(order).issubset(staged):
+            missing = set(order) - set(staged)
+            raise ValueError(f"Missing required sheets: {', '.join(missing)}")
+
+        merge = stage("merge", rows_in=sum(staged[key][3] for key in order))
+        by_claim = []
+        if JOIN_MODE == "claim" or BUILD_ROLLUPS:
+            with instrumentation.timed("aggregate"):
+                for key in order:
+                    table, columns, kinds, _ = staged[key]
+                    amount_col, date_col = claim_rollups[key]
+                    columns, kinds = out_of_core.aggregate_claims(
+                        conn, table, f"claims_{key}", columns, kinds,
+                        "Claim No", amount_col, date_col, f"{key} Count",
+                    )
+                    by_claim.append((f"claims_{key}", columns, kinds))
+        if JOIN_MODE == "claim":
+            tables = by_claim
+        else:
+            tables = [(table, columns, kinds) for table, columns, kinds, _ in (staged[key] for key in order)]
+        columns, kinds = out_of_core.join_tables(conn, tables, "Claim No", "merged")
+        rows = conn.execute("SELECT COUNT(*) FROM merged").fetchone()[0]
+        merge.rows_out = rows
+
+        kpis = stage("kpis", rows_in=rows)
+        columns, kinds, names = out_of_core.kpi_view(conn, "merged", "result", columns, kinds, _output_columns)
+        kpis.rows_out = rows
+        rollup_frame = None
+        if BUILD_ROLLUPS:
+            # summed over one row per claim, as in _run_stages
+            source, claim_kinds, claim_names = "result", kinds, names
+            if JOIN_MODE != "claim":
+                claim_columns, claim_kinds = out_of_core.join_tables(conn, by_claim, "Claim No", "claims_merged")
+                _, claim_kinds, claim_names = out_of_core.kpi_view(
+                    conn, "claims_merged", "claims_result", claim_columns, claim_kinds, _output_columns
+                )
+                source = "claims_result"
+            with instrumentation.timed("rollups", rows_in=rows) as rec:
+                dos_is_date = claim_kinds.get(claim_names.get("DOS")) == "datetime"
+                rollup_frame = rollups.build_rollups_sql(
+                    conn, f"{source}_unordered", claim_names, dos_is_date, run_id, name
+                )
+                rec.rows_out = len(rollup_frame)
+
+        write = stage("write_outputs", rows_in=rows)
+        outputs = output_writer.write_output_chunks(
+            lambda: out_of_core.iter_frames(conn, "result", columns, kinds, READ_CHUNK_ROWS),
+            out_of_core.arrow_schema(columns, kinds) if set(OUTPUT_FORMATS) - {"csv"} else None,
+            OUTPUT_DIR,
+            f"{os.path.splitext(os.path.basename(file_path))[0]}_with_kpis",
+            run_id,
+            OUTPUT_FORMATS,
+            compression=OUTPUT_COMPRESSION,
+            partitioned=OUTPUT_PARTITIONED,
+        )
+        bytes_out = run_registry.path_bytes(outputs)
+        write.bytes_written = bytes_out
+
+        load_stage = stage("load", rows_in=rows)
+        with parallel.db_write_lock(), out_of_core.attached(conn, DB_PATH) as dest:
+            start = time.time()
+            types = out_of_core.sql_types(columns, kinds)
+            loaded = fact_table.load_select(conn, "result", types, run_id, name, schema=dest)
+            load = sqlite_loader.load_stats(fact_table.FACT_TABLE, loaded, time.time() - start)
+            load_stage.rows_out = loaded
+            if RUN_TABLES:
+                out_of_core.load_into(
+                    conn, dest, "result", f"claims_with_kpis_{run_id}", columns, kinds, indexes=["claim no"]
+                )
+            if rollup_frame is not None:
+                with instrumentation.timed("rollups", rows_in=len(rollup_frame)):
+                    with sqlite3.connect(DB_PATH, timeout=60) as db:
+                        rollups.store_rollups(db, rollup_frame, run_id, name)
+        fact_table.refresh_statistics(DB_PATH)
+
+    stage("archive")
+    _archive(file_path)
+    return {
+        "success": True,
+        "rows": rows,
+        "output": outputs[0] if outputs else None,
+        "outputs": outputs,
+        "bytes_out": bytes_out,
+        "load_rows_per_sec": load["rows_per_sec"],
+    }
+
+
+def list_input_files() -> List[str]:
+    return [os.path.join(INPUT_DIR, f) for f in sorted(os.listdir(INPUT_DIR)) if f.lower().endswith(".xlsx")]
+
+
+def run_files(
+    file_paths: List[str],
+    run_id: str,
+    workers: int = ETL_WORKERS,
+    progress: Callable[[str, str], None] | None = None,
+    source: str | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run process_single_file over `file_paths`, in a process pool when workers > 1.
+    Every file gets a result dict (tagged with its file name), failures included.
+    `progress(file_name, stage)` sees every stage in sequential runs; from a pool
+    it only sees the final "done"/"failed" of each file. The run is opened and
+    closed in the run registry around the batch.
+    """
+    start = time.time()
+    with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+        run_registry.start_run(conn, run_id, len(file_paths), source)
+
+    stage_cb = progress if workers <= 1 else None
+    results = []
+    try:
+        for path, res, error in parallel.run_in_pool(process_single_file, file_paths, workers, run_id, stage_cb):
+            if error is not None:
+                # the worker died before process_single_file could record the file
+                res = {"success": False, "error": error}
+                with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+                    run_registry.record_file(conn, run_id, os.path.basename(path), res)
+            res["file"] = os.path.basename(path)
+            instrumentation.METRICS.observe_result(res)
+            results.append(res)
+            if progress:
+                progress(res["file"], "done" if res.get("success") else "failed")
+    finally:
+        with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+            run_registry.finish_run(conn, run_id, time.time() - start)
+    apply_retention()
+    return results
+
+
+def apply_retention() -> Dict[str, Any]:
+    """Drop the runs and file loads outside ETL_RETENTION_RUNS / ETL_RETENTION_DAYS; failures are only logged."""
+    try:
+        return fact_table.apply_retention(DB_PATH, RETENTION_RUNS, RETENTION_DAYS)
+    except sqlite3.Error as e:
+        logger.warning(f"Retention pass failed: {e}")
+        return {"runs": [], "files": [], "rows": 0, "pages_released": 0, "error": str(e)}
+
+
+def run_etl(progress: Callable[[Dict[str, Any]], None] | None = None) -> "ProcessingStatus":
+    """Process every unclaimed workbook in INPUT_DIR as one run."""
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    start = time.time()
+
+    # claimed in etl_file_claims, so concurrent jobs (in any API process) never pick the same file
+    files = job_queue.claim_files(list_input_files())
+
+    state = {
+        "run_id": run_id,
+        "total_files": len(files),
+        "completed_files": 0,
+        "files": {os.path.basename(f): "queued" for f in files},
+    }
+
+    def on_stage(file_name: str, label: str) -> None:
+        state["files"][file_name] = label
+        if label in ("done", "failed"):
+            state["completed_files"] += 1
+        if progress:
+            progress(state)
+
+    if progress:
+        progress(state)
+    try:
+        results = run_files(files, run_id, progress=on_stage, source="api")
+    finally:
+        job_queue.release_files(files)
+
+    files_processed = sum(1 for r in results if r.get("success"))
+    files_failed = len(results) - files_processed
+
+    message = f"Processed {files_processed} file(s)"
+    if files_failed:
+        message += f", {files_failed} failed"
+
+    return ProcessingStatus(
+        success=files_failed == 0,
+        message=message,
+        files_processed=files_processed,
+        run_id=run_id,
+        processing_time=round(time.time() - start, 2),
+        files_failed=files_failed,
+        results=results,
+    )
+
+
+def run_etl_job(job_id: str, params: Dict[str, Any], report: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    return run_etl(progress=report).model_dump()
+
+
+job_queue = JobQueue(
+    DB_PATH, run_etl_job, workers=JOB_WORKERS, lease=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS
+)
+
+
+def watch_input(workers: int = ETL_WORKERS, stop_event: threading.Event | None = None) -> None:
+    """
+    Process workbooks as they land in INPUT_DIR until interrupted or `stop_event`
+    is set. The whole watch session is one run in the run registry.
+    """
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    def claim(path: str) -> bool:
+        if not job_queue.claim_files([path]):
+            return False
+        with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+            run_registry.start_run(conn, run_id, 1, "watch")
+        return True
+
+    def finished(path: str, res: Dict[str, Any] | None, error: str | None) -> None:
+        name = os.path.basename(path)
+        try:
+            with parallel.db_write_lock(), sqlite3.connect(DB_PATH, timeout=60) as conn:
+                if error is not None:
+                    res = {"success": False, "error": error}
+                    run_registry.record_file(conn, run_id, name, res)
+                run_registry.finish_run(conn, run_id, res.get("elapsed") or 0)
+            instrumentation.METRICS.observe_result(res)
+            apply_retention()
+        finally:
+            job_queue.release_files([path])
+        if res.get("success"):
+            logger.info(f"Processed {name}: {res['rows']} rows in {res.get('elapsed')}s")
+        else:
+            logger.error(f"Failed {name}: {res['error']}")
+
+    watcher.watch(
+        INPUT_DIR,
+        process_single_file,
+        workers,
+        run_id,
+        on_submit=claim,
+        on_result=finished,
+        poll_interval=WATCH_POLL_SECONDS,
+        settle_seconds=WATCH_SETTLE_SECONDS,
+        retry_seconds=WATCH_RETRY_SECONDS,
+        stop_event=stop_event,
+    )
+
+
+_watch_stop = threading.Event()
 
 
 # =========================
@@ -333,6 +1152,26 @@ class ProcessingStatus(BaseModel):
     files_processed: int
     run_id: str
     processing_time: float
+    files_failed: int = 0
+    results: List[Dict[str, Any]] = []
+
+
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    submitted_by: str | None = None
+    created_at: str
+    started_at: str | None = None
+    finished_at: str | None = None
+    progress: Dict[str, Any] | None = None
+    result: Dict[str, Any] | None = None
+    error: str | None = None
 
 
 class ETLStats(BaseModel):
@@ -343,6 +1182,29 @@ class ETLStats(BaseModel):
     available_files: List[str]
 
 
+class ReportAggregate(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    fn: str = Field(pattern="^(count|count_distinct|sum|avg|min|max)$")
+    column: str | None = None
+    alias: str | None = Field(None, alias="as")
+
+
+class ReportQuery(BaseModel):
+    run_id: List[str] = []
+    date_from: date | None = None
+    date_to: date | None = None
+    payer: List[str] = []
+    provider: List[str] = []
+    facility: List[str] = []
+    status: List[str] = []
+    group_by: List[str] = []
+    aggregates: List[ReportAggregate] = []
+    columns: List[str] = []
+    after: str | None = None
+    limit: int = Field(1000, ge=1, le=10_000)
+
+
 # =========================
 # Endpoints (Step 5)
 # =========================
@@ -356,27 +1218,46 @@ def user_info(user=Depends(get_current_user)):
     return user
 
 
-@app.post("/api/process-files", response_model=ProcessingStatus)
-def process_files(user=Depends(require_permissions(Permission.PROCESS_FILES))):
-    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    start = time.time()
-    files_processed = 0
+@app.on_event("startup")
+def start_job_queue():
+    job_queue.start()
+    if WATCH_ENABLED:
+        _watch_stop.clear()
+        threading.Thread(target=watch_input, kwargs={"stop_event": _watch_stop}, name="etl-watch", daemon=True).start()
 
-    for f in os.listdir(INPUT_DIR):
-        if f.lower().endswith(".xlsx"):
-            res = process_single_file(os.path.join(INPUT_DIR, f), run_id)
-            if res.get("success"):
-                files_processed += 1
-            else:
-                # You could collect & return errors per file; keeping simple here.
-                pass
 
-    return ProcessingStatus(
-        success=True,
-        message=f"Processed {files_processed} file(s)",
-        files_processed=files_processed,
-        run_id=run_id,
-        processing_time=round(time.time() - start, 2),
+@app.on_event("shutdown")
+def stop_job_queue():
+    _watch_stop.set()
+    job_queue.stop(timeout=5)
+    db_pool.close()
+
+
+@app.post("/api/process-files", response_model=JobSubmitted, status_code=202)
+def process_files(user=Depends(require_permissions(Permission.PROCESS_FILES))):
+    """
+    Queue an ETL run over INPUT_DIR and return immediately; poll
+    /api/jobs/{job_id} for progress and the per-file results.
+    """
+    job_id = job_queue.submit({"input_dir": INPUT_DIR}, submitted_by=user.get("username"))
+    return JobSubmitted(job_id=job_id, status="queued", status_url=f"/api/jobs/{job_id}")
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str, user=Depends(require_permissions(Permission.READ))):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatus(
+        job_id=job["id"],
+        status=job["status"],
+        submitted_by=job["submitted_by"],
+        created_at=job["created_at"],
+        started_at=job["started_at"],
+        finished_at=job["finished_at"],
+        progress=job["progress"],
+        result=job["result"],
+        error=job["error"],
     )
 
 
@@ -384,53 +1265,185 @@ def process_files(user=Depends(require_permissions(Permission.PROCESS_FILES))):
 def get_etl_stats(user=Depends(require_permissions(Permission.READ))):
     try:
         input_files = [f for f in os.listdir(INPUT_DIR) if f.lower().endswith(".xlsx")]
-        output_files = [f for f in os.listdir(OUTPUT_DIR) if f.lower().endswith(".csv")]
-        with sqlite3.connect(DB_PATH) as conn:
-            tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'", conn)
-
-        last_run_id = "No runs yet"
-        if not tables.empty:
-            names = tables["name"].tolist()
-            run_ids = [n.split("_")[-1] for n in names if n.startswith("claims_with_kpis_")]
-            if run_ids:
-                last_run_id = sorted(run_ids)[-1]
+        with db_pool.connection() as conn:
+            totals = run_registry.file_totals(conn)
 
         return ETLStats(
             total_files=len(input_files),
-            processed_files=len(output_files),
-            failed_files=0,
-            last_run_id=last_run_id,
+            processed_files=totals["processed_files"],
+            failed_files=totals["failed_files"],
+            last_run_id=totals["last_run_id"] or "No runs yet",
             available_files=input_files,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to gather stats: {e}")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(credentials: HTTPAuthorizationCredentials | None = Depends(HTTPBearer(auto_error=False))):
+    """Per-stage histograms and counters in the Prometheus text format."""
+    if METRICS_TOKEN and (credentials is None or not hmac.compare_digest(credentials.credentials, METRICS_TOKEN)):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(instrumentation.METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/etl-runs")
+def list_etl_runs(
+    limit: int = Query(50, ge=1, le=1000),
+    before: str | None = Query(None, description="run_id of the last run on the previous page"),
+    user=Depends(require_permissions(Permission.READ)),
+):
+    with db_pool.connection() as conn:
+        runs = run_registry.list_runs(conn, limit, before)
+    return {"runs": runs, "next_before": runs[-1]["run_id"] if len(runs) == limit else None}
+
+
+@app.get("/api/etl-runs/{run_id}")
+def get_etl_run(run_id: str, user=Depends(require_permissions(Permission.READ))):
+    with db_pool.connection() as conn:
+        run = run_registry.get_run(conn, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+
 @app.get("/api/reports")
 def get_reports(user=Depends(require_permissions(Permission.VIEW_REPORTS))):
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'", conn)
-        return {"available_reports": tables["name"].tolist() if not tables.empty else []}
+        with db_pool.connection() as conn:
+            return {"available_reports": reports.list_report_tables(conn), "fact_runs": fact_table.list_runs(conn)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list reports: {e}")
 
 
 @app.get("/api/reports/{table_name}")
-def get_report_data(table_name: str, user=Depends(require_permissions(Permission.VIEW_REPORTS))):
+def get_report_data(
+    table_name: str,
+    limit: int = Query(1000, ge=0, le=100_000, description="rows per page; 0 = all (ndjson/csv only)"),
+    after: str | None = Query(None, description="next_cursor of the previous page"),
+    columns: str | None = Query(None, description="comma-separated projection"),
+    order: str = Query("rowid", pattern="^(rowid|claim)$"),
+    format: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    user=Depends(require_permissions(Permission.VIEW_REPORTS)),
+):
+    """
+    Keyset-paginated report rows. "json" returns one page plus next_cursor;
+    "ndjson" and "csv" stream rows straight from the SQLite cursor, so with
+    limit=0 a whole run can be exported in constant memory.
+    """
+    try:
+        with db_pool.connection() as conn:
+            available = reports.table_columns(conn, table_name)
+        selected = reports.resolve_columns(available, columns)
+        if order == "claim" and reports.CLAIM_KEY not in available:
+            raise ValueError(f"Table has no {reports.CLAIM_KEY!r} column to order by")
+        if format == "json" and not limit:
+            raise ValueError("limit=0 is only allowed for ndjson/csv exports")
+        sql, params, key_width = reports.page_query(table_name, selected, order, after, limit)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            df = pd.read_sql(f"SELECT * FROM {table_name} LIMIT 1000", conn)
+        rows = reports.iter_rows(DB_PATH, sql, params)
+        if format == "ndjson":
+            return StreamingResponse(reports.ndjson_lines(selected, rows, key_width), media_type="application/x-ndjson")
+        if format == "csv":
+            return StreamingResponse(
+                reports.csv_lines(selected, rows, key_width),
+                media_type="text/csv",
+                headers={"Content-Disposition": f'attachment; filename="{table_name}.csv"'},
+            )
+
+        page = list(rows)
+        next_cursor = reports.encode_cursor(page[-1][:key_width]) if len(page) == limit else None
         return {
             "table_name": table_name,
-            "row_count": len(df),
-            "columns": df.columns.tolist(),
-            "data": df.to_dict(orient="records"),
+            "row_count": len(page),
+            "columns": selected,
+            "data": [dict(zip(selected, row[key_width:])) for row in page],
+            "next_cursor": next_cursor,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get report data: {e}")
 
 
+@app.post("/api/reports/{table_name}/query")
+def query_report(table_name: str, query: ReportQuery, user=Depends(require_permissions(Permission.VIEW_REPORTS))):
+    """
+    Filtered rows or grouped aggregates of a report table, computed in SQLite.
+    Filters on the same field match any of its values; different fields must
+    all match. The filter columns are indexed at load time (fact_table.INDEXES).
+    """
+    filters = {
+        "run_id": query.run_id,
+        "payer": query.payer,
+        "provider": query.provider,
+        "facility": query.facility,
+        "status": query.status,
+    }
+    aggregates = [(a.fn, a.column, a.alias) for a in query.aggregates]
+    try:
+        with db_pool.connection() as conn:
+            available = reports.table_columns(conn, table_name)
+        sql, params, names, key_width = reports.compile_query(
+            table_name, available, filters, query.date_from, query.date_to,
+            query.group_by, aggregates, query.columns, query.after, query.limit,
+        )
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        start = time.time()
+        with db_pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        elapsed_ms = round((time.time() - start) * 1000, 1)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to query report: {e}")
+
+    if key_width:
+        next_cursor = reports.encode_cursor(rows[-1][:key_width]) if len(rows) == query.limit else None
+        extra = {"next_cursor": next_cursor}
+    else:
+        extra = {"truncated": len(rows) > query.limit}
+        rows = rows[:query.limit]
+    return {
+        "table_name": table_name,
+        "row_count": len(rows),
+        "columns": names,
+        "data": [dict(zip(names, row[key_width:])) for row in rows],
+        **extra,
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+@app.get("/api/kpis/summary")
+def get_kpi_summary(
+    dimension: str = Query("payer", pattern="^(payer|provider|facility|financial_class|all)$"),
+    run_id: str | None = Query(None, description="defaults to the latest run"),
+    value: str | None = Query(None, description="exact payer/provider/... to filter on"),
+    month_from: str | None = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    month_to: str | None = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    by_month: bool = True,
+    user=Depends(require_permissions(Permission.VIEW_REPORTS)),
+):
+    """GCR, NCR, denial rate, AR balance and 90+ AR from the pre-aggregated kpi_rollups table."""
+    try:
+        with db_pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            run_id = run_id or rollups.latest_run_id(conn)
+            if run_id is None:
+                return {"dimension": dimension, "run_id": None, "rows": []}
+            sql, params = rollups.summary_query(dimension, run_id, value, month_from, month_to, by_month)
+            rows = [dict(r) for r in conn.execute(sql, params)]
+        return {"dimension": dimension, "run_id": run_id, "rows": rows}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to build KPI summary: {e}")
+
+
 @app.delete("/api/files/{filename}")
 def delete_input_file(filename: str, user=Depends(require_permissions(Permission.DELETE))):
     try:
@@ -447,26 +1460,43 @@ def delete_input_file(filename: str, user=Depends(require_permissions(Permission
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Process every .xlsx in INPUT_DIR")
+    parser.add_argument("--workers", type=int, default=ETL_WORKERS, help="worker processes (default: %(default)s)")
+    parser.add_argument("--watch", action="store_true", help="keep running and process workbooks as they land")
+    parser.add_argument("--retention", action="store_true", help="only apply the retention policy to the database")
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="one-time maintenance: switch the database to auto_vacuum=INCREMENTAL (a full VACUUM; run it idle)",
+    )
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum or args.retention:
+        if args.enable_incremental_vacuum:
+            print({"switched": fact_table.enable_incremental_vacuum(DB_PATH)})
+        if args.retention:
+            print(apply_retention())
+        raise SystemExit(0)
+
+    if args.watch:
+        watch_input(args.workers)
+        raise SystemExit(0)
+
     run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     start = time.time()
 
     files_processed = 0
 
-    for f in os.listdir(INPUT_DIR):
-
-        if f.lower().endswith(".xlsx"):
-
-            res = process_single_file(os.path.join(INPUT_DIR, f), run_id)
+    for res in run_files(list_input_files(), run_id, args.workers, source="cli"):
 
-            if res.get("success"):
+        if res.get("success"):
 
-                print(f"✅ Processed {f}: {res['rows']} rows in {res['elapsed']}s")
+            print(f"✅ Processed {res['file']}: {res['rows']} rows in {res['elapsed']}s")
 
-                files_processed += 1
-            else:
+            files_processed += 1
+        else:
 
-                print(f"❌ Failed {f}: {res['error']}")
+            print(f"❌ Failed {res['file']}: {res['error']}")
 
     print(f"\nFinished run {run_id} — {files_processed} file(s) processed in {round(time.time() - start, 2)}s")
-
@@ -0,0 +1,48 @@
+# auth_cache.py
+"""
+TTL/LRU cache of verified JWT payloads.
+
+get_current_user runs on every authenticated request; caching the decoded
+payload skips the signature check for tokens seen recently. An entry never
+outlives the token's own "exp" claim, nor `ttl` seconds after it was cached.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+
+class TokenCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Dict[str, Any] | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if now >= expires_at:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return payload
+
+    def put(self, token: str, payload: Dict[str, Any]) -> None:
+        expires_at = time.time() + self.ttl
+        exp = payload.get("exp")
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        with self._lock:
+            self._entries[token] = (payload, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,340 @@
+# benchmark.py
+"""
+Benchmarks for the ETL hot paths.
+
+    python benchmark.py kpis --rows 200000
+    python benchmark.py load --rows 200000
+    python benchmark.py pipeline --rows 100000 --history benchmarks.jsonl
+
+`pipeline` runs process_single_file on a synthetic workbook (synth_workbook.py)
+and reports every instrumented stage, plus normalize_headers, safe_merge and
+calculate_kpis timed on their own. With --history each result is appended as
+one JSON line tagged with the git commit and compared with the previous result
+for the same workload, so a regression shows up as soon as it is committed.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+from kpis import calculate_kpis
+from sqlite_loader import bulk_load
+
+
+def synthetic_claims(rows: int, seed: int = 0) -> pd.DataFrame:
+    """A merged-frame lookalike with the columns calculate_kpis reads."""
+    rng = np.random.default_rng(seed)
+    dos = pd.Timestamp("2025-07-01") + pd.to_timedelta(rng.integers(0, 31, rows), unit="D")
+    charge_entry = dos + pd.to_timedelta(rng.integers(0, 10, rows), unit="D")
+    return pd.DataFrame({
+        "Claim No": rng.integers(1, max(rows // 4, 2), rows),
+        "DOS": dos,
+        "Charge Entry Date": charge_entry,
+        "Payment Entry Date": charge_entry + pd.to_timedelta(rng.integers(5, 90, rows), unit="D"),
+        "Billed Amount": rng.gamma(2.0, 150.0, rows).round(2).astype(object),
+        "Paid Amount": rng.gamma(2.0, 80.0, rows).round(2),
+        "Adjustment Amount": np.where(rng.random(rows) < 0.1, np.nan, rng.gamma(1.0, 20.0, rows).round(2)),
+        "AR Balance": rng.gamma(1.5, 60.0, rows).round(2),
+        "Aging Range": rng.choice(["0-30", "31-60", "61-90", "91-120", "120+", None], rows),
+        "Financial Status": rng.choice(["Open", "Denied", "Paid", "Pending - Denied", None], rows),
+    })
+
+
+def legacy_calculate_kpis(df: pd.DataFrame) -> pd.DataFrame:
+    """The row-wise implementation kpis.calculate_kpis replaced, kept as the baseline."""
+    for col in ["Paid Amount", "Billed Amount", "Adjustment Amount", "AR Balance"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+
+    if "DOS" in df.columns and "Charge Entry Date" in df.columns:
+        df["Charge Lag (days)"] = (df["Charge Entry Date"] - df["DOS"]).dt.days
+
+    if "Charge Entry Date" in df.columns and "Payment Entry Date" in df.columns:
+        df["Billing Lag (days)"] = (df["Payment Entry Date"] - df["Charge Entry Date"]).dt.days
+
+    if "Paid Amount" in df.columns and "Billed Amount" in df.columns:
+        billed = pd.to_numeric(df["Billed Amount"], errors="coerce").fillna(0)
+        paid = pd.to_numeric(df["Paid Amount"], errors="coerce").fillna(0)
+        df["GCR (%)"] = ((paid / billed.replace(0, pd.NA)) * 100).fillna(0).round(2)
+
+    if {"Paid Amount", "Billed Amount", "Adjustment Amount"}.issubset(df.columns):
+        billed = pd.to_numeric(df["Billed Amount"], errors="coerce").fillna(0)
+        adj = pd.to_numeric(df["Adjustment Amount"], errors="coerce").fillna(0)
+        paid = pd.to_numeric(df["Paid Amount"], errors="coerce").fillna(0)
+        collectible = (billed - adj).replace(0, pd.NA)
+        df["NCR (%)"] = ((paid / collectible) * 100).fillna(0).round(2)
+        df["CCR (%)"] = ((paid / collectible) * 100).fillna(0).round(2)
+
+    if {"AR Balance", "Billed Amount"}.issubset(df.columns):
+        billed_sum = df["Billed Amount"].sum()
+        avg_daily_charges = billed_sum / 30 if billed_sum else None
+        df["AR Days"] = (df["AR Balance"] / avg_daily_charges).round(1) if avg_daily_charges else None
+
+    if "Aging Range" in df.columns and "AR Balance" in df.columns:
+        df["90+ AR Days (%)"] = df.apply(
+            lambda x: x["AR Balance"] if "90" in str(x["Aging Range"]) else 0,
+            axis=1,
+        )
+
+    if "Financial Status" in df.columns:
+        total_claims = len(df)
+        denied_claims = df["Financial Status"].astype(str).str.contains("denied", case=False, na=False).sum()
+        df["Denial Rate (%)"] = (denied_claims / total_claims * 100).round(2) if total_claims else None
+
+    return df
+
+
+def _best_of(fn, df: pd.DataFrame, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        frame = df.copy()
+        start = time.perf_counter()
+        fn(frame)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_kpis(rows: int, repeat: int) -> None:
+    df = synthetic_claims(rows)
+
+    expected = legacy_calculate_kpis(df.copy())
+    actual = calculate_kpis(df.copy())
+    # the legacy ratios are object columns rounded per element; allow the 0.01
+    # difference numpy's vectorised rounding can make on exact .xx5 ties
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, atol=0.01)
+
+    legacy = _best_of(legacy_calculate_kpis, df, repeat)
+    engine = _best_of(calculate_kpis, df, repeat)
+    print(f"calculate_kpis on {rows:,} rows (best of {repeat})")
+    print(f"  legacy row-wise : {legacy * 1000:9.1f} ms")
+    print(f"  columnar engine : {engine * 1000:9.1f} ms")
+    print(f"  speedup         : {legacy / engine:9.1f}x")
+
+
+def wide_claims(rows: int, extra_text_cols: int = 30, seed: int = 0) -> pd.DataFrame:
+    """synthetic_claims plus KPIs and filler text columns, ~48 columns like a real merged run."""
+    rng = np.random.default_rng(seed)
+    df = calculate_kpis(synthetic_claims(rows, seed))
+    for i in range(extra_text_cols):
+        df[f"Text {i}"] = rng.choice([f"value {j}" for j in range(20)] + [None], rows)
+    df.columns = [c.lower() for c in df.columns]
+    return df
+
+
+def bench_load(rows: int) -> None:
+    df = wide_claims(rows)
+    print(f"SQLite load of {rows:,} rows x {len(df.columns)} columns")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "to_sql.db")
+        with sqlite3.connect(path) as conn:
+            start = time.perf_counter()
+            df.to_sql("claims", conn, if_exists="replace", index=False)
+            conn.commit()
+            legacy = time.perf_counter() - start
+        path = os.path.join(tmp, "bulk.db")
+        with sqlite3.connect(path) as conn:
+            start = time.perf_counter()
+            bulk_load(conn, df, "claims", indexes=["claim no"])
+            loader = time.perf_counter() - start
+            assert conn.execute("SELECT COUNT(*) FROM claims").fetchone()[0] == rows
+    print(f"  DataFrame.to_sql : {legacy:7.2f} s  ({rows / legacy:,.0f} rows/s)")
+    print(f"  bulk_load        : {loader:7.2f} s  ({rows / loader:,.0f} rows/s, incl. index)")
+    print(f"  speedup          : {legacy / loader:7.1f}x")
+
+
+# Slowdowns smaller than this are never reported as regressions
+NOISE_FLOOR_SECONDS = 0.025
+
+
+def _workbook(rows: int, seed: int) -> str:
+    """A synthetic workbook for (rows, seed), generated once and reused from the temp dir."""
+    import synth_workbook
+
+    path = os.path.join(tempfile.gettempdir(), "etl_bench", f"synthetic_{rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        print(f"Generating {path} ...")
+        tmp = path + ".tmp.xlsx"
+        synth_workbook.generate(tmp, rows, seed)
+        os.replace(tmp, path)
+    return path
+
+
+def _isolate(etl, root: str) -> None:
+    """Point the pipeline's folders and database at a scratch directory."""
+    for attr in ("INPUT_DIR", "OUTPUT_DIR", "ARCHIVE_DIR", "CACHE_DIR"):
+        path = os.path.join(root, attr.split("_")[0].lower())
+        os.makedirs(path, exist_ok=True)
+        setattr(etl, attr, path)
+    etl.DB_PATH = os.path.join(root, "bench.db")
+
+
+def _stage_times(etl, workbook: str, repeat: int, sheet_cache: bool) -> Dict[str, float]:
+    """Per-stage seconds of the fastest of `repeat` full runs."""
+    etl.SHEET_CACHE_ENABLED = sheet_cache
+    best, best_stages = float("inf"), {}
+    for i in range(repeat):
+        path = os.path.join(etl.INPUT_DIR, os.path.basename(workbook))
+        shutil.copy(workbook, path)
+        start = time.perf_counter()
+        res = etl.process_single_file(path, f"bench{i}")
+        elapsed = time.perf_counter() - start
+        if not res["success"]:
+            raise RuntimeError(f"Pipeline failed: {res['error']}")
+        if elapsed < best:
+            best = elapsed
+            best_stages = {name: values["seconds"] for name, values in res["stages"].items()}
+            best_stages["total"] = elapsed
+    return best_stages
+
+
+def _hot_paths(etl, workbook: str, repeat: int) -> Dict[str, float]:
+    """normalize_headers, safe_merge and calculate_kpis timed on the workbook's own sheets."""
+    raw = {}
+    with pd.ExcelFile(workbook) as xl:
+        for sheet in xl.sheet_names:
+            key = etl.match_sheet(sheet)
+            if key:
+                raw[key] = xl.parse(sheet)
+
+    def timed(fn) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    sheets = {key: etl.coerce_dates(etl.normalize_headers(df, etl.sheet_mappings[key])) for key, df in raw.items()}
+
+    def merge():
+        merged = sheets["Charges"]
+        for key in ("Payment", "Adjustment", "Pending AR"):
+            merged = etl.safe_merge(merged, sheets[key], "Claim No")
+        return merged
+
+    merged = merge()
+    return {
+        "normalize_headers": timed(lambda: [etl.normalize_headers(df, etl.sheet_mappings[k]) for k, df in raw.items()]),
+        "safe_merge": timed(merge),
+        "calculate_kpis": _best_of(calculate_kpis, merged, repeat),
+    }
+
+
+def git_revision() -> Dict[str, Any]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def compare_history(history: str, record: Dict[str, Any], threshold: float) -> list:
+    """Print the change against the previous matching record; returns the regressed metrics."""
+    previous = None
+    if os.path.exists(history):
+        with open(history) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("bench") == record["bench"] and entry.get("params") == record["params"]:
+                    previous = entry
+    if previous is None:
+        print("\n  (no earlier result for this workload)")
+        return []
+
+    print(f"\n  vs {previous['commit']}{'+dirty' if previous.get('dirty') else ''} ({previous['timestamp']})")
+    regressed = []
+    for name, seconds in record["results"].items():
+        before = previous["results"].get(name)
+        if not before:
+            continue
+        change = (seconds - before) / before
+        flag = ""
+        # a few ms of timer noise on a short stage is not a regression
+        if change > threshold and seconds - before > NOISE_FLOOR_SECONDS:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        print(f"  {name:<28} {before:9.3f} -> {seconds:9.3f} s  {change:+7.1%}{flag}")
+    return regressed
+
+
+def bench_pipeline(
+    rows: int, seed: int, repeat: int, sheet_cache: bool, history: str | None, threshold: float
+) -> bool:
+    import ETL
+
+    workbook = _workbook(rows, seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        _isolate(ETL, tmp)
+        results = _stage_times(ETL, workbook, repeat, sheet_cache)
+    results.update(_hot_paths(ETL, workbook, repeat))
+
+    print(f"Pipeline on {os.path.basename(workbook)} (best of {repeat}, sheet cache {'on' if sheet_cache else 'off'})")
+    for name, seconds in results.items():
+        print(f"  {name:<28} {seconds:9.3f} s")
+
+    if not history:
+        return True
+    record = {
+        "bench": "pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        **git_revision(),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "params": {"rows": rows, "seed": seed, "repeat": repeat, "sheet_cache": sheet_cache},
+        "results": {name: round(seconds, 4) for name, seconds in results.items()},
+    }
+    regressed = compare_history(history, record, threshold)
+    with open(history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("kpis", help="calculate_kpis: columnar engine vs the legacy row-wise version")
+    p.add_argument("--rows", type=int, default=200_000)
+    p.add_argument("--repeat", type=int, default=3)
+
+    p = sub.add_parser("load", help="SQLite load: bulk_load vs DataFrame.to_sql")
+    p.add_argument("--rows", type=int, default=200_000)
+
+    p = sub.add_parser("pipeline", help="every pipeline stage on a synthetic workbook")
+    p.add_argument("--rows", type=int, default=100_000, help="workbook data rows over the four sheets")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--sheet-cache", action="store_true", help="leave the parsed-sheet cache on (warm runs)")
+    p.add_argument("--history", help="JSONL file to compare against and append to")
+    p.add_argument("--threshold", type=float, default=0.15, help="slowdown flagged as a regression")
+    p.add_argument("--fail-on-regression", action="store_true", help="exit 1 when a stage regressed")
+
+    args = parser.parse_args()
+    if args.bench == "kpis":
+        bench_kpis(args.rows, args.repeat)
+    elif args.bench == "load":
+        bench_load(args.rows)
+    elif args.bench == "pipeline":
+        ok = bench_pipeline(args.rows, args.seed, args.repeat, args.sheet_cache, args.history, args.threshold)
+        if not ok and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
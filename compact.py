@@ -0,0 +1,107 @@
+# compact.py
+"""
+Memory-lean dtypes for parsed sheets.
+
+A parsed sheet is mostly repeated text (payer, provider, facility, financial
+class, aging range, status, ...) and every merge copies it again. optimize_frame()
+runs once per sheet, right after parsing, and without changing any value:
+
+  * text columns with few distinct values become categoricals (one small array
+    of codes plus each distinct string once);
+  * integers are downcast to the smallest integer type that holds them, and
+    floats to float32 where every value survives the round trip exactly;
+  * the remaining text moves to pyarrow-backed strings (pandas' NaN-missing
+    "str" dtype) when pyarrow is installed.
+
+Columns passed as `keep` (the claim key, the KPI amounts) are left as they are,
+so joins and KPI arithmetic see the same dtypes as before.
+"""
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# A text column becomes categorical when it has at most this many distinct
+# values per non-null value
+CATEGORY_MAX_RATIO = 0.5
+
+
+def _string_dtype():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:  # pandas < 2.3 only has the pd.NA flavour, which changes comparisons
+        return None
+
+
+def _is_text(col: pd.Series) -> bool:
+    if pd.api.types.is_string_dtype(col.dtype) and col.dtype != object:
+        return True
+    # object columns mixing numbers and text stay object: Parquet and the sheet cache handle them as such
+    return col.dtype == object and pd.api.types.infer_dtype(col, skipna=True) == "string"
+
+
+def _downcast_number(col: pd.Series) -> pd.Series:
+    if pd.api.types.is_bool_dtype(col.dtype):
+        return col
+    if pd.api.types.is_integer_dtype(col.dtype) and not pd.api.types.is_extension_array_dtype(col.dtype):
+        return pd.to_numeric(col, downcast="integer")
+    if col.dtype == np.float64:
+        narrow = col.to_numpy().astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), col.to_numpy(), equal_nan=True):
+            return pd.Series(narrow, index=col.index, name=col.name)
+    return col
+
+
+def optimize_frame(df: pd.DataFrame, keep: Iterable[str] = ()) -> pd.DataFrame:
+    """Return `df` with compact dtypes (columns are replaced, values are unchanged)."""
+    keep = set(keep)
+    string_dtype = _string_dtype()
+    for i, name in enumerate(df.columns):
+        if name in keep:
+            continue
+        col = df.iloc[:, i]
+        if pd.api.types.is_numeric_dtype(col.dtype):
+            new = _downcast_number(col)
+        elif _is_text(col):
+            non_null = int(col.notna().sum())
+            if non_null and col.nunique(dropna=True) <= CATEGORY_MAX_RATIO * non_null:
+                new = col.astype("category")
+            elif string_dtype is not None and col.dtype != string_dtype:
+                new = col.astype(string_dtype)
+            else:
+                continue
+        else:
+            continue
+        if new is not col:
+            df.isetitem(i, new)
+    return df
+
+
+def widen(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    `df` with downcast numbers back at int64/float64, for code whose results
+    depend on the dtype (row hashes). Categoricals and strings hash like the
+    plain values already.
+    """
+    cols: List[int] = [
+        i for i, dtype in enumerate(df.dtypes)
+        if dtype == np.float32
+        or (pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype)
+            and dtype.itemsize < 8)
+    ]
+    if not cols:
+        return df
+    out = df.copy(deep=False)
+    for i in cols:
+        wide = np.int64 if pd.api.types.is_integer_dtype(out.dtypes.iloc[i]) else np.float64
+        out.isetitem(i, out.iloc[:, i].astype(wide))
+    return out
+
+
+def frame_bytes(*frames: pd.DataFrame) -> int:
+    """Deep memory footprint of the given frames, in bytes."""
+    return int(sum(df.memory_usage(deep=True, index=True).sum() for df in frames))
@@ -0,0 +1,309 @@
+# dates.py
+"""
+Date coercion for the "... Date" columns of a parsed sheet.
+
+pd.to_datetime(col, errors="coerce") guesses a format from the first value and
+applies it to the whole column: values in any other format silently become NaT,
+and Excel serial numbers are read as nanoseconds since 1970. Falling back to
+format="mixed" is correct but runs dateutil on every element.
+
+coerce_column() instead
+  * keeps datetime64 columns as they are and turns numbers into dates as Excel
+    serials (days since 1899-12-30), vectorised;
+  * for text, infers an explicit format from a sample of distinct values, parses
+    the column with it, then infers another format from whatever failed, up to
+    MAX_FORMATS; only a small remainder goes through format="mixed";
+  * reports how many non-empty values could not be parsed.
+
+The format chain that worked is remembered per (sheet type, column) in the
+etl_date_formats table and tried first next time, so the sampling is skipped
+while a source keeps its layout.
+"""
+import json
+import sqlite3
+from datetime import date, datetime
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import parallel
+from logger import get_logger
+
+logger = get_logger()
+
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+# Serials accepted as dates: 1950-01-01 .. 2099-12-31
+SERIAL_MIN, SERIAL_MAX = 18264, 73050
+SERIAL = "excel-serial"
+MIXED = "mixed"
+
+# Tried in this order; US month-first formats win ties with day-first ones
+CANDIDATE_FORMATS = [
+    "%m/%d/%Y",
+    "%Y-%m-%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %I:%M %p",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%m/%d/%y",
+    "%m-%d-%Y",
+    "%d-%b-%Y",
+    "%d-%b-%y",
+    "%b %d, %Y",
+    "%d/%m/%Y",
+    "%Y%m%d",
+    "%Y/%m/%d",
+]
+
+SAMPLE_SIZE = 200
+MIN_MATCH = 0.9  # share of a sample a format must parse to be chosen
+MAX_FORMATS = 3
+# Leftovers up to this many distinct values are retried with format="mixed"
+MIXED_FALLBACK_MAX = 2000
+FAILURE_WARN_RATE = 0.05
+
+
+def from_serial(values: pd.Series) -> pd.Series:
+    nums = pd.to_numeric(values, errors="coerce")
+    nums = nums.where((nums >= SERIAL_MIN) & (nums <= SERIAL_MAX))
+    return EXCEL_EPOCH + pd.to_timedelta(nums, unit="D")
+
+
+def _parse(values: pd.Series, fmt: str) -> pd.Series:
+    if fmt == SERIAL:
+        return from_serial(values)
+    if fmt == MIXED:
+        return pd.to_datetime(values, errors="coerce", format=MIXED)
+    return pd.to_datetime(values, errors="coerce", format=fmt)
+
+
+def _match_rate(sample: pd.Series, fmt: str) -> float:
+    return _parse(sample, fmt).notna().mean() if len(sample) else 0.0
+
+
+def infer_format(values: pd.Series, rng: np.random.Generator | None = None) -> str | None:
+    """The first candidate (or Excel serial) that parses MIN_MATCH of a sample of `values`."""
+    if not len(values):
+        return None
+    if len(values) > SAMPLE_SIZE:
+        rng = rng or np.random.default_rng(0)
+        values = values.iloc[rng.choice(len(values), SAMPLE_SIZE, replace=False)]
+    best, best_rate = None, 0.0
+    for fmt in [SERIAL, *CANDIDATE_FORMATS]:
+        rate = _match_rate(values, fmt)
+        if rate >= MIN_MATCH:
+            return fmt
+        if rate > best_rate:
+            best, best_rate = fmt, rate
+    # no single format dominates the sample: take the best one and let the chain handle the rest
+    return best
+
+
+def _parse_strings(uniq: pd.Series, hint: List[str]) -> Tuple[pd.Series, List[str]]:
+    """Parse distinct strings with the hinted chain, extending it while values remain."""
+    parsed = pd.Series(pd.NaT, index=uniq.index, dtype="datetime64[ns]")
+    pending = uniq
+    used: List[str] = []
+    rng = np.random.default_rng(0)
+    chain = list(hint)
+    while len(pending) and len(used) < MAX_FORMATS:
+        if chain:
+            fmt = chain.pop(0)
+            if fmt == MIXED:
+                continue
+            if _match_rate(pending.head(SAMPLE_SIZE), fmt) == 0:
+                continue  # the remembered format no longer applies
+        else:
+            fmt = infer_format(pending, rng)
+            if fmt is None:
+                break
+        result = _parse(pending, fmt)
+        ok = result.notna()
+        if not ok.any():
+            if not chain:
+                break
+            continue
+        parsed[ok[ok].index] = result[ok]
+        pending = pending[~ok]
+        used.append(fmt)
+
+    if len(pending) and len(pending) <= MIXED_FALLBACK_MAX:
+        result = _parse(pending, MIXED)
+        ok = result.notna()
+        if ok.any():
+            parsed[ok[ok].index] = result[ok]
+            used.append(MIXED)
+    return parsed, used
+
+
+def coerce_column(series: pd.Series, hint: List[str] | None = None) -> Tuple[pd.Series, Dict[str, Any]]:
+    """
+    Parse one column to datetime64. Returns the parsed column and a report:
+    formats used, non-empty values and how many of them failed to parse.
+    """
+    report: Dict[str, Any] = {"formats": [], "values": 0, "failed": 0}
+    if pd.api.types.is_datetime64_any_dtype(series):
+        report["formats"] = ["datetime"]
+        report["values"] = int(series.notna().sum())
+        return series, report
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        parsed = from_serial(series)
+        report.update(formats=[SERIAL], values=int(series.notna().sum()))
+        report["failed"] = report["values"] - int(parsed.notna().sum())
+        return parsed, report
+
+    values = series.to_numpy(dtype=object)
+    out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[ns]")
+    considered = series.notna().to_numpy(copy=True)
+    text_mask = considered.copy()
+    if series.dtype == object:
+        # openpyxl hands back datetime cells, numbers and text in the same column
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred == "datetime":
+            parsed = pd.to_datetime(series, errors="coerce")
+            report.update(formats=["datetime"], values=int(considered.sum()))
+            report["failed"] = report["values"] - int(parsed.notna().sum())
+            return parsed, report
+        if inferred == "string":
+            kinds = np.zeros(len(values), dtype=int)
+        elif inferred == "date":
+            kinds = np.ones(len(values), dtype=int)
+        else:
+            kinds = np.array([0 if isinstance(v, str) else 1 if isinstance(v, (datetime, date)) else 2 for v in values])
+        native = considered & (kinds == 1)
+        numbers = considered & (kinds == 2)
+        if native.any():
+            out[native] = pd.to_datetime(pd.Series(values[native]), errors="coerce").to_numpy("datetime64[ns]")
+            report["formats"].append("datetime")
+        if numbers.any():
+            out[numbers] = from_serial(pd.Series(values[numbers])).to_numpy("datetime64[ns]")
+            report["formats"].append(SERIAL)
+        text_mask &= kinds == 0
+
+    text = pd.Series(values[text_mask], dtype=str).str.strip()
+    blank = (text == "").to_numpy()
+    if blank.any():
+        # empty cells that came through as "" are missing values, not failures
+        considered[np.flatnonzero(text_mask)[blank]] = False
+        text_mask[np.flatnonzero(text_mask)[blank]] = False
+        text = text[~blank]
+    if len(text):
+        codes, uniq = pd.factorize(text)
+        parsed_uniq, used = _parse_strings(pd.Series(uniq), hint or [])
+        out[text_mask] = parsed_uniq.to_numpy("datetime64[ns]")[codes]
+        report["formats"] += [f for f in used if f not in report["formats"]]
+
+    n_values = int(considered.sum())
+    report.update(values=n_values, failed=n_values - int((~np.isnat(out) & considered).sum()))
+    return pd.Series(out, index=series.index, name=series.name), report
+
+
+def is_date_column(name: Any) -> bool:
+    return "date" in str(name).lower()
+
+
+class FormatStore:
+    """
+    Remembered format chains per (sheet type, column) in etl_date_formats, with
+    the outcome of the latest coercion. Rows are read once per process.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._formats: Dict[Tuple[str, str], List[str]] | None = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS etl_date_formats (
+                sheet_key TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                formats TEXT NOT NULL,
+                last_values INTEGER NOT NULL,
+                last_failed INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (sheet_key, column_name)
+            )
+        """)
+        return conn
+
+    def get(self, sheet_key: str, column: str) -> List[str]:
+        if self._formats is None:
+            try:
+                with parallel.db_write_lock(), self._connect() as conn:
+                    rows = conn.execute("SELECT sheet_key, column_name, formats FROM etl_date_formats").fetchall()
+                self._formats = {(k, c): json.loads(f) for k, c, f in rows}
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read remembered date formats: {e}")
+                self._formats = {}
+        return self._formats.get((sheet_key, column), [])
+
+    def remember(self, sheet_key: str, reports: Dict[str, Dict[str, Any]]) -> None:
+        """Use the chains in `reports` as hints for the rest of this process without storing them."""
+        if self._formats is not None:
+            for col, r in reports.items():
+                self._formats[(sheet_key, col)] = r["formats"]
+
+    def record(self, sheet_key: str, reports: Dict[str, Dict[str, Any]]) -> None:
+        """Store the reports of a whole sheet; called once per sheet."""
+        if not reports:
+            return
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (sheet_key, col, json.dumps(r["formats"]), r["values"], r["failed"], now)
+            for col, r in reports.items()
+        ]
+        try:
+            with parallel.db_write_lock(), self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO etl_date_formats VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not store date formats for {sheet_key}: {e}")
+            return
+        self.remember(sheet_key, reports)
+
+
+def merge_reports(total: Dict[str, Dict[str, Any]], reports: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Fold the per-column reports of one chunk into the running reports of its sheet."""
+    for col, r in reports.items():
+        t = total.setdefault(col, {"formats": [], "values": 0, "failed": 0})
+        t["formats"] += [f for f in r["formats"] if f not in t["formats"]]
+        t["values"] += r["values"]
+        t["failed"] += r["failed"]
+        t["failure_rate"] = round(t["failed"] / t["values"], 4) if t["values"] else 0.0
+    return total
+
+
+def coerce_frame(
+    df: pd.DataFrame, sheet_key: str | None = None, store: FormatStore | None = None, persist: bool = True
+) -> Dict[str, Any]:
+    """
+    Coerce every date column of `df` in place and return the per-column reports.
+    With a store and sheet_key the remembered format chains are tried first and
+    the chains that worked are saved back. A chunk of a longer sheet passes
+    persist=False: its chains only become hints for the next chunk, and the
+    caller records the merged reports (merge_reports) once the sheet is done.
+    """
+    reports = {}
+    for i, col in enumerate(df.columns):
+        if not is_date_column(col):
+            continue
+        hint = store.get(sheet_key, col) if store is not None and sheet_key else None
+        parsed, report = coerce_column(df.iloc[:, i], hint)
+        df.isetitem(i, parsed)
+        report["failure_rate"] = round(report["failed"] / report["values"], 4) if report["values"] else 0.0
+        reports[col] = report
+        if report["failure_rate"] > FAILURE_WARN_RATE:
+            logger.warning(
+                f"{sheet_key or 'sheet'}: {report['failed']:,} of {report['values']:,} values in "
+                f"{col!r} are not dates ({report['failure_rate']:.1%})"
+            )
+
+    if store is not None and sheet_key:
+        if persist:
+            store.record(sheet_key, reports)
+        else:
+            store.remember(sheet_key, reports)
+    return reports
@@ -0,0 +1,73 @@
+# db_pool.py
+"""
+Bounded pool of SQLite connections shared by the API endpoints.
+
+Opening a connection per request costs a file open plus schema parsing on the
+first query; a small pool of long-lived connections avoids both. At most `size`
+connections exist; callers block (up to `timeout`) when all are in use.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str, size: int = 8, timeout: float = 30.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._new_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No SQLite connection free after {self.timeout}s") from None
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection. Like `with sqlite3.connect(...)`, the transaction is
+        committed on success and rolled back on error.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.row_factory = None
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,209 @@
+# excel_reader.py
+"""
+Streaming .xlsx reader.
+
+pd.ExcelFile.parse() materialises every row of a sheet as Python lists before
+building the DataFrame, so peak memory grows with the workbook. This module walks
+a sheet with openpyxl's read-only row iterator and yields DataFrames of at most
+`chunk_rows` rows, letting callers normalise each chunk while the rest of the
+sheet is still being read. A `usecols` callback can pick the columns to keep once
+the header row is known; the cells of the other columns are then skipped before
+openpyxl decodes them (shared/inline strings, number and date conversion), which
+is where most of the read time goes.
+"""
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Callable, Iterator, List
+
+import pandas as pd
+
+
+@contextmanager
+def open_workbook(file_path: str):
+    """Open a workbook in read-only mode and make sure the file handle is released."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        yield wb
+    finally:
+        wb.close()
+
+
+def sheet_names(file_path: str) -> List[str]:
+    """
+    List the sheets straight from xl/workbook.xml. Unlike load_workbook this does
+    not parse the shared-strings table, so it stays cheap for large workbooks.
+    """
+    ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    with zipfile.ZipFile(file_path) as zf:
+        root = ET.fromstring(zf.read("xl/workbook.xml"))
+    return [el.get("name") for el in root.iter(f"{ns}sheet")]
+
+
+def dedupe_headers(raw_headers) -> List[str]:
+    """
+    Build column names the same way pandas does for a header row:
+    blank cells become "Unnamed: <i>" and repeats get ".1", ".2", ... suffixes.
+    """
+    out = []
+    counts = {}
+    for i, value in enumerate(raw_headers):
+        name = f"Unnamed: {i}" if value is None or str(value).strip() == "" else str(value)
+        if name in counts:
+            counts[name] += 1
+            candidate = f"{name}.{counts[name]}"
+            while candidate in counts:
+                counts[name] += 1
+                candidate = f"{name}.{counts[name]}"
+            counts[candidate] = 0
+            name = candidate
+        else:
+            counts[name] = 0
+        out.append(name)
+    return out
+
+
+def _frame(rows: list, columns: List[str]) -> pd.DataFrame:
+    width = len(columns)
+    rows = [r[:width] if len(r) >= width else r + (None,) * (width - len(r)) for r in rows]
+    return pd.DataFrame.from_records(rows, columns=columns).infer_objects()
+
+
+# RowReader relies on the internals of these openpyxl releases (see requirements.txt)
+SUPPORTED_OPENPYXL = ("3.1.",)
+
+# Stands in for the value of a non-empty cell in a dropped column, so a row with
+# data only in dropped columns is still told apart from a blank row
+_DROPPED = object()
+
+
+class RowReader:
+    """
+    Iterate a read-only worksheet like ws.iter_rows(values_only=True). Once
+    `keep_columns` (1-based column numbers) is set, cells outside it are not
+    decoded: they read as None, or _DROPPED when the cell has content. This
+    drives openpyxl's sheet parser directly and falls back to iter_rows (every
+    cell decoded) on an openpyxl release outside SUPPORTED_OPENPYXL, or if its
+    internals are not what we expect.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.keep_columns: set | None = None
+
+    def __iter__(self):
+        try:
+            import openpyxl
+            from openpyxl.utils.cell import column_index_from_string
+            from openpyxl.worksheet._reader import WorkSheetParser
+
+            if not openpyxl.__version__.startswith(SUPPORTED_OPENPYXL):
+                raise ImportError(f"openpyxl {openpyxl.__version__} is not a supported release")
+
+            ws, wb = self.ws, self.ws.parent
+            options = dict(
+                data_only=wb.data_only,
+                epoch=wb.epoch,
+                date_formats=wb._date_formats,
+                timedelta_formats=wb._timedelta_formats,
+            )
+            shared_strings, get_row, source = ws._shared_strings, ws._get_row, ws._get_source
+        except (ImportError, AttributeError):
+            yield from self.ws.iter_rows(values_only=True)
+            return
+
+        reader = self
+        column_numbers: dict = {}
+
+        class Parser(WorkSheetParser):
+            def parse_cell(self, element):
+                keep = reader.keep_columns
+                coordinate = element.get("r") if keep is not None else None
+                if coordinate:
+                    letters = coordinate.rstrip("0123456789")
+                    column = column_numbers.get(letters)
+                    if column is None:
+                        column = column_numbers[letters] = column_index_from_string(letters)
+                    if column not in keep:
+                        self.col_counter = column
+                        value = _DROPPED if len(element) else None
+                        return {"row": self.row_counter, "column": column, "value": value}
+                return super().parse_cell(element)
+
+        # rows missing from the XML come out empty, as with iter_rows
+        counter = 1
+        with source() as src:
+            for idx, cells in Parser(src, shared_strings, **options).parse():
+                while counter < idx:
+                    counter += 1
+                    yield ()
+                if counter <= idx:
+                    counter += 1
+                    yield get_row(cells, values_only=True)
+
+
+def column_picker(positions: List[int]) -> Callable[[tuple], tuple]:
+    """A function returning the cells at `positions` of a row, padding short rows with None."""
+    if not positions:
+        return lambda row: ()
+    get = itemgetter(*positions)
+    width = max(positions) + 1
+
+    def pick(row: tuple) -> tuple:
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        cells = get(row)
+        return cells if len(positions) > 1 else (cells,)
+
+    return pick
+
+
+def iter_sheet_chunks(
+    wb,
+    sheet_name: str,
+    chunk_rows: int = 50_000,
+    usecols: Callable[[List[str]], List[int]] | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield the sheet as DataFrames of at most `chunk_rows` rows.
+
+    The first row is the header. Fully blank rows are skipped, like pandas does.
+    A sheet that only has a header yields a single empty frame so callers still
+    see its columns. `usecols(header_names)` returns the positions of the columns
+    to keep; the others are dropped from every row as it is read.
+    """
+    ws = wb[sheet_name]
+    ws.reset_dimensions()  # some writers store a wrong <dimension>; read everything
+    reader = RowReader(ws) if usecols is not None else None
+    rows = iter(reader) if reader is not None else ws.iter_rows(values_only=True)
+
+    header = next(rows, None)
+    if header is None:
+        return
+    header = list(header)
+    while header and header[-1] is None:
+        header.pop()
+    columns = dedupe_headers(header)
+    pick = None
+    if usecols is not None:
+        positions = usecols(columns)
+        columns = [columns[i] for i in positions]
+        pick = column_picker(positions)
+        reader.keep_columns = {i + 1 for i in positions}
+
+    buf = []
+    emitted = False
+    for row in rows:
+        if all(v is None for v in row):
+            continue
+        buf.append(row if pick is None else pick(row))
+        if len(buf) >= chunk_rows:
+            yield _frame(buf, columns)
+            emitted = True
+            buf = []
+
+    if buf or not emitted:
+        yield _frame(buf, columns)
@@ -0,0 +1,383 @@
+# fact_table.py
+"""
+Consolidated claims fact table.
+
+Every processed file appends its KPI rows to claims_fact, tagged with run_id and
+file, instead of creating a claims_with_kpis_<run_id> table per run. The table
+is indexed on (run_id, "claim no") and on the report filters (DOS, payer,
+provider, facility, status), so a cross-run query is one indexed scan, and
+refresh_statistics() keeps the planner statistics current enough to pick the
+most selective of them (see reports.compile_query). Reloading a file
+within a run replaces its rows. etl_fact_runs catalogs what each (run, file)
+loaded, so listing runs and picking the ones to expire never scan the fact table.
+
+apply_retention() keeps the newest `keep_runs` runs and/or the files loaded in
+the last `max_age_days` days (by each file's own load time, so a long-lived
+watch run only loses its old files). Expired rows are deleted DELETE_BATCH per
+transaction, so loads and readers interleave with a long purge, the legacy
+claims_with_kpis_<run_id> tables of expired runs are dropped, and the freed
+pages are handed back with incremental VACUUM once the database uses
+auto_vacuum=INCREMENTAL. Switching it takes one full VACUUM, so that is a
+separate, one-time maintenance step (enable_incremental_vacuum, i.e.
+`ETL.py --enable-incremental-vacuum`); until then retention only deletes and
+SQLite reuses the freed pages for later loads.
+kpi_rollups and the run registry are small and keep their history.
+"""
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+import parallel
+import sqlite_loader
+from logger import get_logger
+from sqlite_loader import quote_ident
+
+logger = get_logger()
+
+FACT_TABLE = "claims_fact"
+RUNS_TABLE = "etl_fact_runs"
+LEGACY_PREFIX = "claims_with_kpis_"
+RUN_COL, FILE_COL = "run_id", "file"
+
+# Columns behind the typed filters of the report query API (reports.compile_query)
+DATE_COL = "dos"
+FILTER_COLUMNS = {
+    "payer": "payer/insurance",
+    "provider": "provider name",
+    "facility": "facility name",
+    "status": "financial status",
+}
+
+# (run_id, claim no) is the table's key. The filter indexes end in run_id, so a
+# filter within one run is answered from the index and a cross-run one still uses it.
+INDEXES: List[Tuple[str, ...]] = [
+    (RUN_COL, "claim no"),
+    *((col, RUN_COL) for col in (DATE_COL, *FILTER_COLUMNS.values())),
+]
+
+DELETE_BATCH = 50_000
+VACUUM_STEP_PAGES = 2_000
+
+# ANALYZE a table again once it has grown or shrunk by this factor since the last ANALYZE
+REANALYZE_FACTOR = 2.0
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _name(schema: str, name: str) -> str:
+    return f"{schema}.{quote_ident(name)}"
+
+
+def ensure_catalog(conn, schema: str = "main") -> None:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {_name(schema, RUNS_TABLE)} (
+            run_id TEXT NOT NULL,
+            file TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            loaded_at TEXT NOT NULL,
+            PRIMARY KEY (run_id, file)
+        )
+    """)
+
+
+def _columns(conn, schema: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({quote_ident(FACT_TABLE)})")]
+
+
+def _widen(conn, types: Dict[str, str], schema: str) -> None:
+    """Create claims_fact or add the columns it does not have yet (older rows read as NULL)."""
+    existing = _columns(conn, schema)
+    if not existing:
+        cols = [f"{quote_ident(RUN_COL)} TEXT NOT NULL", f"{quote_ident(FILE_COL)} TEXT NOT NULL"]
+        cols += [f"{quote_ident(c)} {t}" for c, t in types.items()]
+        conn.execute(f"CREATE TABLE {_name(schema, FACT_TABLE)} ({', '.join(cols)})")
+        return
+    for col, sql_type in types.items():
+        if col not in existing:
+            conn.execute(f"ALTER TABLE {_name(schema, FACT_TABLE)} ADD COLUMN {quote_ident(col)} {sql_type}")
+
+
+def create_indexes(conn, schema: str = "main") -> None:
+    """Create the INDEXES whose columns the table has and refresh the planner statistics."""
+    existing = set(_columns(conn, schema))
+    for cols in INDEXES:
+        if set(cols) <= existing:
+            name = sqlite_loader.index_name(FACT_TABLE, "_".join(cols))
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {_name(schema, name)} "
+                f"ON {quote_ident(FACT_TABLE)} ({', '.join(quote_ident(c) for c in cols)})"
+            )
+
+
+def _analyzed_rows(conn, table: str) -> int | None:
+    if not sqlite_loader.table_columns(conn, "sqlite_stat1"):
+        return None
+    row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND stat != '' LIMIT 1", (table,)).fetchone()
+    return int(row[0].split()[0]) if row else None
+
+
+def refresh_statistics(db_path: str, table: str = FACT_TABLE, force: bool = False) -> bool:
+    """
+    ANALYZE `table` when it has no planner statistics yet, or its size moved by
+    REANALYZE_FACTOR since the last ANALYZE (or always with `force`). Returns
+    whether it ran.
+
+    Without statistics an equality on run_id looks as selective as a date
+    range, and a sampled ANALYZE (analysis_limit) misjudges low-cardinality
+    columns the same way, so ANALYZE reads the whole table (about 0.6 s per
+    million rows). Re-running it only after the table doubled or halved keeps
+    that cost proportional to the rows loaded. MAX(rowid) stands in for the row
+    count, which would itself be a scan. Callers run this after their load has
+    committed and outside parallel.db_write_lock; SQLite's busy timeout orders
+    it against other writers.
+    """
+    try:
+        with sqlite3.connect(db_path, timeout=60) as conn:
+            if not sqlite_loader.table_columns(conn, table):
+                return False
+            rows = conn.execute(f"SELECT MAX(rowid) FROM {quote_ident(table)}").fetchone()[0] or 0
+            analyzed = _analyzed_rows(conn, table)
+            if not force and analyzed and analyzed / REANALYZE_FACTOR <= rows <= analyzed * REANALYZE_FACTOR:
+                return False
+            start = time.time()
+            conn.execute(f"ANALYZE {quote_ident(table)}")
+    except sqlite3.Error as e:
+        logger.warning(f"Could not refresh the planner statistics of {table}: {e}")
+        return False
+    logger.info(f"Refreshed planner statistics of {table} in {time.time() - start:.2f}s")
+    return True
+
+
+def _replace_file(conn, run_id: str, file_name: str, schema: str) -> None:
+    conn.execute(
+        f"DELETE FROM {_name(schema, FACT_TABLE)} "
+        f"WHERE {quote_ident(RUN_COL)} = ? AND {quote_ident(FILE_COL)} = ?",
+        (run_id, file_name),
+    )
+
+
+def _catalog(conn, run_id: str, file_name: str, rows: int, schema: str) -> None:
+    conn.execute(
+        f"INSERT OR REPLACE INTO {_name(schema, RUNS_TABLE)} VALUES (?, ?, ?, ?)",
+        (run_id, file_name, rows, _now()),
+    )
+
+
+def load_frame(conn, df: pd.DataFrame, run_id: str, file_name: str) -> Dict[str, Any]:
+    """Replace the rows of (run_id, file_name) with `df` in one transaction; returns load statistics."""
+    start = time.time()
+    sqlite_loader.tune_connection(conn)
+    frame = df.drop(columns=[c for c in (RUN_COL, FILE_COL) if c in df.columns])
+    frame.insert(0, FILE_COL, file_name)
+    frame.insert(0, RUN_COL, run_id)
+    with sqlite_loader.transaction(conn):
+        ensure_catalog(conn)
+        _widen(conn, {c: sqlite_loader.sqlite_type(frame[c]) for c in frame.columns[2:]}, "main")
+        _replace_file(conn, run_id, file_name, "main")
+        sqlite_loader.load_rows(conn, frame, FACT_TABLE, if_exists="append")
+        create_indexes(conn)
+        _catalog(conn, run_id, file_name, len(frame), "main")
+    return sqlite_loader.load_stats(FACT_TABLE, len(frame), time.time() - start)
+
+
+def load_select(
+    conn, source: str, types: Dict[str, str], run_id: str, file_name: str, schema: str = "main"
+) -> int:
+    """
+    load_frame for rows that live in SQLite already: one INSERT ... SELECT of the
+    `types` columns of `source` into the claims_fact of `schema` (an attached
+    database), in one transaction. Returns the row count.
+    """
+    with sqlite_loader.transaction(conn):
+        ensure_catalog(conn, schema)
+        _widen(conn, types, schema)
+        _replace_file(conn, run_id, file_name, schema)
+        cols = ", ".join(quote_ident(c) for c in types)
+        rows = conn.execute(
+            f"INSERT INTO {_name(schema, FACT_TABLE)} ({quote_ident(RUN_COL)}, {quote_ident(FILE_COL)}, {cols}) "
+            f"SELECT ?, ?, {cols} FROM {quote_ident(source)}",
+            (run_id, file_name),
+        ).rowcount
+        create_indexes(conn, schema)
+        _catalog(conn, run_id, file_name, rows, schema)
+    return rows
+
+
+def list_runs(conn) -> List[Dict[str, Any]]:
+    """The runs held in claims_fact, newest first, with their files and row counts."""
+    if not sqlite_loader.table_columns(conn, RUNS_TABLE):
+        return []
+    rows = conn.execute(f"""
+        SELECT run_id, COUNT(*), SUM(rows), MAX(loaded_at) FROM {RUNS_TABLE}
+        GROUP BY run_id ORDER BY MAX(loaded_at) DESC, run_id DESC
+    """).fetchall()
+    return [{"run_id": r, "files": f, "rows": n, "loaded_at": at} for r, f, n, at in rows]
+
+
+def _loads(conn) -> List[Tuple[str, str | None, str]]:
+    """
+    (run_id, file, loaded_at) of every file in claims_fact, plus (run_id, None,
+    last file finished) for each legacy per-run table.
+    """
+    loads = []
+    if sqlite_loader.table_columns(conn, RUNS_TABLE):
+        loads += conn.execute(f"SELECT run_id, file, loaded_at FROM {RUNS_TABLE}").fetchall()
+    legacy = [
+        name[len(LEGACY_PREFIX):] for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND substr(name, 1, ?) = ?",
+            (len(LEGACY_PREFIX), LEGACY_PREFIX),
+        )
+    ]
+    times: Dict[str, str] = {}
+    if legacy and sqlite_loader.table_columns(conn, "etl_run_files"):
+        times.update(conn.execute("SELECT run_id, MAX(finished_at) FROM etl_run_files GROUP BY run_id"))
+    if legacy and sqlite_loader.table_columns(conn, "etl_runs"):
+        for run_id, at in conn.execute("SELECT run_id, COALESCE(finished_at, started_at) FROM etl_runs"):
+            times.setdefault(run_id, at)
+    # a legacy table whose run is in neither registry has no known age and is left alone
+    loads += [(run_id, None, times[run_id]) for run_id in legacy if times.get(run_id)]
+    return loads
+
+
+def expired_loads(
+    conn, keep_runs: int = 0, max_age_days: float = 0
+) -> Tuple[List[str], List[Tuple[str, str | None]]]:
+    """
+    The runs outside the newest `keep_runs`, ranked by their latest load (runs
+    still in progress are kept), and the (run_id, file) loads older than
+    `max_age_days` by their own load time. Ages are per file because a watch
+    session is one run that keeps loading files for as long as it lasts.
+    """
+    loads = _loads(conn)
+    latest: Dict[str, str] = {}
+    for run_id, _, at in loads:
+        latest[run_id] = max(latest.get(run_id, at), at)
+
+    runs: List[str] = []
+    if keep_runs:
+        running = set()
+        if sqlite_loader.table_columns(conn, "etl_runs"):
+            running = {r for (r,) in conn.execute("SELECT run_id FROM etl_runs WHERE status = 'running'")}
+        newest_first = sorted(latest, key=lambda run_id: (latest[run_id], run_id), reverse=True)
+        runs = [run_id for run_id in newest_first[keep_runs:] if run_id not in running]
+    files: List[Tuple[str, str | None]] = []
+    if max_age_days:
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+        files = [(run_id, file) for run_id, file, at in loads if at < cutoff and run_id not in runs]
+    return runs, files
+
+
+def _incremental_vacuum_enabled(conn) -> bool:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(db_path: str) -> bool:
+    """
+    One-time maintenance: switch the database to auto_vacuum=INCREMENTAL. This
+    rewrites the whole file with a full VACUUM while holding the write lock, so
+    run it when no loads are due. Returns False when it was already switched.
+    """
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        if _incremental_vacuum_enabled(conn):
+            return False
+        start = time.time()
+        with parallel.db_write_lock():
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        logger.info(f"Switched the KPI database to auto_vacuum=INCREMENTAL in {time.time() - start:.2f}s")
+        return True
+    finally:
+        conn.close()
+
+
+def _incremental_vacuum(conn) -> int:
+    """
+    Release the free pages in VACUUM_STEP_PAGES steps; returns the number released.
+    Stops early when a step releases nothing (auto_vacuum is not INCREMENTAL, or
+    another connection is in the way).
+    """
+    released = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return released
+        with parallel.db_write_lock():
+            # execute() steps the pragma once, which frees a single page; executescript runs it to the end
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});")
+        step = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if step <= 0:
+            return released
+        released += step
+
+
+def _delete_load(conn, run_id: str, file_name: str | None, batch_rows: int) -> int:
+    """Delete the rows of one file of a run, or of the whole run and its legacy table when `file_name` is None."""
+    where, params = f"{quote_ident(RUN_COL)} = ?", [run_id]
+    if file_name is not None:
+        where, params = f"{where} AND {quote_ident(FILE_COL)} = ?", [run_id, file_name]
+    deleted = 0
+    if _columns(conn, "main"):
+        while True:
+            with parallel.db_write_lock():
+                n = conn.execute(
+                    f"""
+                    DELETE FROM {quote_ident(FACT_TABLE)} WHERE rowid IN (
+                        SELECT rowid FROM {quote_ident(FACT_TABLE)} WHERE {where} LIMIT ?
+                    )
+                    """,
+                    (*params, batch_rows),
+                ).rowcount
+                conn.commit()
+            deleted += n
+            if n < batch_rows:
+                break
+    with parallel.db_write_lock():
+        if file_name is None:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(LEGACY_PREFIX + run_id)}")
+        if sqlite_loader.table_columns(conn, RUNS_TABLE):
+            conn.execute(f"DELETE FROM {RUNS_TABLE} WHERE {where}", params)
+        conn.commit()
+    return deleted
+
+
+def apply_retention(
+    db_path: str, keep_runs: int = 0, max_age_days: float = 0, batch_rows: int = DELETE_BATCH
+) -> Dict[str, Any]:
+    """
+    Drop the runs and file loads outside the retention policy and return what
+    was removed (a no-op when both limits are 0).
+    """
+    if not keep_runs and not max_age_days:
+        return {"runs": [], "files": [], "rows": 0, "pages_released": 0}
+    start = time.time()
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        runs, files = expired_loads(conn, keep_runs, max_age_days)
+        expired = [(run_id, None) for run_id in runs] + files
+        rows = sum(_delete_load(conn, run_id, file_name, batch_rows) for run_id, file_name in expired)
+        pages = 0
+        if expired and _incremental_vacuum_enabled(conn):
+            pages = _incremental_vacuum(conn)
+        elif expired:
+            logger.info("Freed pages stay in the database file until `ETL.py --enable-incremental-vacuum` is run")
+    finally:
+        conn.close()
+    if expired:
+        refresh_statistics(db_path, force=True)
+    if expired:
+        logger.info(
+            f"Retention dropped {len(runs)} run(s) and {len(files)} file load(s), {rows:,} fact rows, "
+            f"released {pages:,} pages in {time.time() - start:.2f}s"
+        )
+    return {
+        "runs": runs,
+        "files": [{"run_id": run_id, "file": file_name} for run_id, file_name in files],
+        "rows": rows,
+        "pages_released": pages,
+    }
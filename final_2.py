@@ -3,13 +3,14 @@ import sqlite3
 import os
 import shutil
 import time
+import argparse
 from datetime import datetime
 from logger import get_logger
+from parallel import db_write_lock, run_in_pool
+from sqlite_loader import load_rows, quote_ident, table_columns
 
 # === LOGGER ===
 logger = get_logger()
-run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-logger.info(f"Starting ETL Run ID: {run_id}")
 
 # === CONFIG ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +19,12 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 ARCHIVE_DIR = os.path.join(BASE_DIR, "archive")
 DB_PATH = os.path.join(BASE_DIR, "etl_kpis.db")
 
+# Every file's rows go to one table, tagged with file_tag; reloading a file replaces its rows
+CLEAN_TABLE = "claims_clean"
+
+# Number of worker processes (1 = sequential)
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", "1"))
+
 # Create folders if missing
 for folder in [INPUT_DIR, OUTPUT_DIR, ARCHIVE_DIR]:
     os.makedirs(folder, exist_ok=True)
@@ -38,95 +45,126 @@ def parse_dates(df, date_cols):
     return df
 
 # === PROCESS FILES ===
-files_processed = 0
-for file in os.listdir(INPUT_DIR):
-    if file.lower().endswith(".xlsx"):
-        start_time = time.time()
-        file_path = os.path.join(INPUT_DIR, file)
-        logger.info(f"Processing file: {file}")
-
-        # Extract month-year from filename for table naming
-        file_tag = os.path.splitext(file)[0].replace(" ", "_").lower()
-
-        try:
-            with pd.ExcelFile(file_path) as xl:
-                sheets = xl.sheet_names
-                logger.info(f"Found sheets: {sheets}")
-
-            # Detect required sheets
-            charges_sheet = find_sheet(sheets, "charges")
-            payments_sheet = find_sheet(sheets, "payment")
-            pending_ar_sheet = find_sheet(sheets, "pending ar")
-            adjustments_sheet = find_sheet(sheets, "adjustment")
-
-            if not all([charges_sheet, payments_sheet, pending_ar_sheet, adjustments_sheet]):
-                logger.error("Missing one or more required sheets, skipping file.")
-                continue
-
-            # Load sheets
-            charges = pd.read_excel(file_path, sheet_name=charges_sheet)
-            payments = pd.read_excel(file_path, sheet_name=payments_sheet)
-            pending_ar = pd.read_excel(file_path, sheet_name=pending_ar_sheet)
-            adjustments = pd.read_excel(file_path, sheet_name=adjustments_sheet)
-
-            # Standardize column names
-            for df in [charges, payments, pending_ar, adjustments]:
-                df.columns = df.columns.str.strip().str.lower()
-
-            # Parse dates
-            charges = parse_dates(charges, ['claim date', 'service date', 'payment date'])
-            payments = parse_dates(payments, ['payment date'])
-            pending_ar = parse_dates(pending_ar, ['dis date', 'due date'])
-
-            # Rename to avoid conflicts
-            for df, tag in zip([payments, adjustments], ['payment', 'adjust']):
-                df.columns = [f"{col}_{tag}" if col != 'account num' else col for col in df.columns]
-
-            # Merge data
-            final_df = charges.merge(payments, on='account num', how='left')
-            final_df = final_df.merge(adjustments, on='account num', how='left')
-
-            if 'account num' in pending_ar.columns:
-                cols_to_keep = ['account num'] + [
-                    col for col in ['dis date', 'due date', 'denial age', 'ar_days']
-                    if col in pending_ar.columns
-                ]
-                final_df = final_df.merge(pending_ar[cols_to_keep], on='account num', how='left')
-
-            # Remove duplicate columns (safety)
-            final_df = final_df.loc[:, ~final_df.columns.duplicated()]
-
-            # Export CSV
-            output_file = os.path.join(OUTPUT_DIR, f"{file_tag}_clean.csv")
-            final_df.to_csv(output_file, index=False)
-            logger.info(f"CSV saved: {output_file}")
-
-            # Save to SQLite
-            conn = sqlite3.connect(DB_PATH)
-            table_name = f"claims_clean_{file_tag}"
-            final_df.to_sql(table_name, conn, if_exists="replace", index=False)
-            conn.close()
-            logger.info(f"Data inserted into table: {table_name} in {DB_PATH}")
-
-            # Archive original file
-            archive_path = os.path.join(ARCHIVE_DIR, file)
-            for attempt in range(3):
-                try:
-                    shutil.move(file_path, archive_path)
-                    logger.info(f"Moved processed file to archive: {file}")
-                    break
-                except PermissionError:
-                    logger.warning(f"⚠ File still in use, retrying in 1s... (Attempt {attempt + 1}/3)")
-                    time.sleep(1)
-            else:
-                logger.error(f"Failed to move file after 3 attempts: {file_path}")
-
-            # Summary for this file
-            elapsed = round(time.time() - start_time, 2)
-            logger.info(f"Processed {len(final_df):,} rows from {file} in {elapsed}s")
+def process_file(file):
+    """Clean, merge and load one workbook from INPUT_DIR. Returns True on success."""
+    start_time = time.time()
+    file_path = os.path.join(INPUT_DIR, file)
+    logger.info(f"Processing file: {file}")
+
+    # Extract month-year from filename for table naming
+    file_tag = os.path.splitext(file)[0].replace(" ", "_").lower()
+
+    try:
+        with pd.ExcelFile(file_path) as xl:
+            sheets = xl.sheet_names
+            logger.info(f"Found sheets: {sheets}")
+
+        # Detect required sheets
+        charges_sheet = find_sheet(sheets, "charges")
+        payments_sheet = find_sheet(sheets, "payment")
+        pending_ar_sheet = find_sheet(sheets, "pending ar")
+        adjustments_sheet = find_sheet(sheets, "adjustment")
+
+        if not all([charges_sheet, payments_sheet, pending_ar_sheet, adjustments_sheet]):
+            logger.error("Missing one or more required sheets, skipping file.")
+            return False
+
+        # Load sheets
+        charges = pd.read_excel(file_path, sheet_name=charges_sheet)
+        payments = pd.read_excel(file_path, sheet_name=payments_sheet)
+        pending_ar = pd.read_excel(file_path, sheet_name=pending_ar_sheet)
+        adjustments = pd.read_excel(file_path, sheet_name=adjustments_sheet)
+
+        # Standardize column names
+        for df in [charges, payments, pending_ar, adjustments]:
+            df.columns = df.columns.str.strip().str.lower()
+
+        # Parse dates
+        charges = parse_dates(charges, ['claim date', 'service date', 'payment date'])
+        payments = parse_dates(payments, ['payment date'])
+        pending_ar = parse_dates(pending_ar, ['dis date', 'due date'])
+
+        # Rename to avoid conflicts
+        for df, tag in zip([payments, adjustments], ['payment', 'adjust']):
+            df.columns = [f"{col}_{tag}" if col != 'account num' else col for col in df.columns]
+
+        # Merge data
+        final_df = charges.merge(payments, on='account num', how='left')
+        final_df = final_df.merge(adjustments, on='account num', how='left')
+
+        if 'account num' in pending_ar.columns:
+            cols_to_keep = ['account num'] + [
+                col for col in ['dis date', 'due date', 'denial age', 'ar_days']
+                if col in pending_ar.columns
+            ]
+            final_df = final_df.merge(pending_ar[cols_to_keep], on='account num', how='left')
+
+        # Remove duplicate columns (safety)
+        final_df = final_df.loc[:, ~final_df.columns.duplicated()]
+
+        # Export CSV
+        output_file = os.path.join(OUTPUT_DIR, f"{file_tag}_clean.csv")
+        final_df.to_csv(output_file, index=False)
+        logger.info(f"CSV saved: {output_file}")
+
+        # Save to SQLite (replace this file's rows in one transaction)
+        final_df.insert(0, "file_tag", file_tag)
+        with db_write_lock():
+            conn = sqlite3.connect(DB_PATH, timeout=60)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                if table_columns(conn, CLEAN_TABLE):
+                    conn.execute(f"DELETE FROM {quote_ident(CLEAN_TABLE)} WHERE file_tag = ?", (file_tag,))
+                load_rows(conn, final_df, CLEAN_TABLE, if_exists="append", indexes=["file_tag", "account num"])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        logger.info(f"Data inserted into table: {CLEAN_TABLE} ({file_tag}) in {DB_PATH}")
+
+        # Archive original file
+        archive_path = os.path.join(ARCHIVE_DIR, file)
+        for attempt in range(3):
+            try:
+                shutil.move(file_path, archive_path)
+                logger.info(f"Moved processed file to archive: {file}")
+                break
+            except PermissionError:
+                logger.warning(f"⚠ File still in use, retrying in 1s... (Attempt {attempt + 1}/3)")
+                time.sleep(1)
+        else:
+            logger.error(f"Failed to move file after 3 attempts: {file_path}")
+
+        # Summary for this file
+        elapsed = round(time.time() - start_time, 2)
+        logger.info(f"Processed {len(final_df):,} rows from {file} in {elapsed}s")
+        return True
+
+    except Exception as e:
+        logger.exception(f"Failed to process file {file}: {e}")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean and load every .xlsx in INPUT_DIR")
+    parser.add_argument("--workers", type=int, default=ETL_WORKERS, help="worker processes (default: %(default)s)")
+    args = parser.parse_args()
+
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger.info(f"Starting ETL Run ID: {run_id}")
+
+    files = [f for f in os.listdir(INPUT_DIR) if f.lower().endswith(".xlsx")]
+    files_processed = 0
+    for file, ok, error in run_in_pool(process_file, files, args.workers):
+        if error is not None:
+            logger.error(f"Worker failed on {file}: {error}")
+        elif ok:
             files_processed += 1
 
-        except Exception as e:
-            logger.exception(f"Failed to process file {file}: {e}")
+    logger.info(f"ETL Run {run_id} completed — {files_processed} file(s) processed")
+
 
-logger.info(f"ETL Run {run_id} completed — {files_processed} file(s) processed")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# header_cache.py
+"""
+Header-resolution cache.
+
+Resolving a sheet's headers scores every raw header against every mapping key
+with rapidfuzz, on every run, although the incoming headers are nearly the same
+from month to month. HeaderCache.resolve() only memoizes the matcher: a header
+resolved before for this sheet type and mapping version (kept in memory,
+persisted in etl_header_resolutions and loaded once per process) is answered
+from the cache, and only the others are passed to the matcher, whose answers are
+stored. All matching rules (case-folding included) live in the matcher, so
+turning the cache off never changes the result.
+
+Every mapping target is given to one column at most: a cached answer whose
+target an earlier one already gave away counts as a miss, and the matcher is
+told which targets are taken. An answer that depended on the other headers of
+the sheet (a column that lost its best key to another one) is not stored.
+
+The mapping version is a digest of the mapping and the matcher settings, so
+editing sheet_mappings (or the score cutoff) invalidates the old answers; rows
+of older versions are dropped when a sheet type stores new ones.
+"""
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+import instrumentation
+import parallel
+from logger import get_logger
+
+logger = get_logger()
+
+
+def mapping_version(mapping: Dict[str, str], matcher: str = "") -> str:
+    key = json.dumps([sorted(mapping.items()), matcher], ensure_ascii=False)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+class HeaderCache:
+    """Resolved headers per (sheet type, mapping version), with hit/miss counters."""
+
+    def __init__(self, db_path: str, matcher: str = ""):
+        self.db_path = db_path
+        self.matcher = matcher
+        self._resolved: Dict[Tuple[str, str], Dict[str, str]] | None = None
+        # this process's counts; per-file counts go to the active StageRecorder
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS etl_header_resolutions (
+                sheet_key TEXT NOT NULL,
+                mapping_version TEXT NOT NULL,
+                raw_header TEXT NOT NULL,
+                resolved TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (sheet_key, mapping_version, raw_header)
+            )
+        """)
+        return conn
+
+    def _load(self) -> Dict[Tuple[str, str], Dict[str, str]]:
+        if self._resolved is None:
+            self._resolved = {}
+            try:
+                with parallel.db_write_lock(), self._connect() as conn:
+                    rows = conn.execute(
+                        "SELECT sheet_key, mapping_version, raw_header, resolved FROM etl_header_resolutions"
+                    ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read cached header resolutions: {e}")
+                rows = []
+            for sheet_key, version, raw, resolved in rows:
+                self._resolved.setdefault((sheet_key, version), {})[raw] = resolved
+        return self._resolved
+
+    def _count(self, outcome: str, n: int) -> None:
+        if n:
+            self.stats[outcome] += n
+            instrumentation.count(f"header_cache_{outcome}", n)
+
+    def resolve(
+        self,
+        columns: Iterable[Any],
+        mapping: Dict[str, str],
+        sheet_key: str,
+        match: Callable[[List[Any], Set[str]], Tuple[Dict[Any, str], Set[Any]]],
+    ) -> Dict[Any, str]:
+        """
+        New name for every column. `match(columns, claimed)` resolves the columns
+        that are not cached, leaving out the targets in
+        `claimed`; it returns the new names and the columns whose answer did not
+        depend on the other headers, which are the only ones stored.
+        """
+        version = mapping_version(mapping, self.matcher)
+        known = self._load().setdefault((sheet_key, version), {})
+        targets = set(mapping.values())
+        columns = list(columns)
+
+        out: Dict[Any, str] = {}
+        claimed: Set[str] = set()
+        for col in columns:
+            if not isinstance(col, str) or col not in known:
+                continue
+            resolved = known[col]
+            if resolved in targets:
+                if resolved in claimed:
+                    continue
+                claimed.add(resolved)
+            out[col] = resolved
+        hits = len(out)
+
+        pending = [col for col in columns if col not in out]
+        new = {}
+        if pending:
+            matched, settled = match(pending, claimed)
+            out.update(matched)
+            new = {
+                col: name for col, name in matched.items()
+                if col in settled and isinstance(col, str) and isinstance(name, str)
+            }
+        self._count("hits", hits)
+        self._count("misses", len(pending))
+
+        if new:
+            known.update(new)
+            self._store(sheet_key, version, new)
+        return {col: out[col] for col in columns}
+
+    def _store(self, sheet_key: str, version: str, resolved: Dict[str, str]) -> None:
+        now = datetime.now().isoformat(timespec="seconds")
+        try:
+            with parallel.db_write_lock(), self._connect() as conn:
+                conn.execute(
+                    "DELETE FROM etl_header_resolutions WHERE sheet_key = ? AND mapping_version != ?",
+                    (sheet_key, version),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO etl_header_resolutions VALUES (?, ?, ?, ?, ?)",
+                    [(sheet_key, version, raw, new, now) for raw, new in resolved.items()],
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not store header resolutions for {sheet_key}: {e}")
@@ -0,0 +1,90 @@
+# header_match.py
+"""
+One-to-one header assignment.
+
+Matching each column on its own lets two headers ("Performing Provider" and
+"Responsible Provider") both land on "Provider Name", and make_unique_columns
+later renames one of them to "provider name_1". assign() instead scores every
+header against every mapping key in one rapidfuzz.process.cdist matrix and
+picks the assignment with the highest total score in which each key is used at
+most once: scipy's linear_sum_assignment when scipy is installed, otherwise
+greedily from the best-scoring pair down. Pairs under the score cutoff are
+never assigned, so a lone header matches exactly as extractOne would.
+
+Matching ignores case: a header equal to a key up to case gets that key
+outright (the first such header when several are), and the rest are scored
+case-folded, so "ACCOUNT NUM" finds "Account Num" with or without the header
+cache in front.
+"""
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+def _solve(scores: np.ndarray) -> List[tuple]:
+    """(row, column) pairs of a maximum-score assignment; zero scores are left out."""
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        linear_sum_assignment = None
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(scores, maximize=True)
+        return [(r, c) for r, c in zip(rows, cols) if scores[r, c] > 0]
+
+    # greedy: best score first, ties to the earlier header, then the earlier key
+    flat = np.flatnonzero(scores > 0)
+    order = flat[np.lexsort((flat, -scores.ravel()[flat]))]
+    pairs, used_rows, used_cols = [], set(), set()
+    for idx in order:
+        r, c = divmod(int(idx), scores.shape[1])
+        if r not in used_rows and c not in used_cols:
+            pairs.append((r, c))
+            used_rows.add(r)
+            used_cols.add(c)
+    return pairs
+
+
+def assign(
+    columns: Sequence[Any], keys: Sequence[str], score_cutoff: float = 85, taken: Iterable[str] = ()
+) -> Tuple[Dict[Any, str], Set[Any]]:
+    """
+    The mapping key assigned to each column that got one (keys in `taken` are
+    not handed out), and the columns whose outcome the other headers did not
+    decide: those that got their best-scoring key and those that score under the
+    cutoff against every key. Only these are safe to remember per header.
+    """
+    if not len(columns) or not len(keys):
+        return {}, set(columns)
+    queries = [str(c) for c in columns]
+    taken = set(taken)
+    used = {i for i, k in enumerate(keys) if k in taken}
+
+    folded: Dict[str, int] = {}
+    for i, key in enumerate(keys):
+        folded.setdefault(str(key).casefold(), i)
+    exact: Dict[int, int] = {}
+    for r, query in enumerate(queries):
+        c = folded.get(query.casefold())
+        if c is not None and c not in used:
+            exact[r] = c
+            used.add(c)
+
+    scores = process.cdist(
+        queries, list(keys), scorer=fuzz.token_sort_ratio, processor=str.casefold, score_cutoff=score_cutoff
+    )
+    scores = np.asarray(scores, dtype=float)
+    best = scores.argmax(axis=1)
+    unmatched = ~scores.any(axis=1)
+
+    available = scores.copy()
+    available[:, sorted(used)] = 0
+    available[sorted(exact)] = 0
+    pairs = [*exact.items(), *_solve(available)]
+    assigned = {columns[r]: keys[c] for r, c in pairs}
+    settled = {
+        col for r, col in enumerate(columns)
+        if r in exact or unmatched[r] or assigned.get(col) == keys[best[r]]
+    }
+    return assigned, settled
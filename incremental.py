@@ -0,0 +1,235 @@
+# incremental.py
+"""
+Incremental processing.
+
+etl_manifest remembers every workbook by content hash, so a re-delivered,
+byte-identical file is skipped outright. For a changed file every claim gets a
+fingerprint built from the hashes of its rows in each sheet; only the rows of
+claims whose fingerprint is new or different replace the previous ones in the
+persistent claims_kpis table. Claims are keyed by (workbook file name, claim
+number), so two workbooks that reuse a claim number never overwrite each other,
+and claims missing from a re-delivered workbook are deleted.
+
+The KPIs, rollups and output files are still computed over the whole workbook,
+so the frame-wide KPIs ("AR Days", "Denial Rate (%)") keep their whole-workbook
+basis. The manifest stores that basis (kpis.frame_basis); when a re-delivery
+moves it, every claim of the workbook is rewritten so its rows stay on one basis.
+"""
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Tuple
+
+import pandas as pd
+
+import compact
+import fact_table
+import sqlite_loader
+from sqlite_loader import quote_ident
+
+KPI_TABLE = "claims_kpis"
+CLAIM_COL = "Claim No"
+FILE_COL = fact_table.FILE_COL
+
+
+def ensure_tables(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_manifest (
+            file_hash TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            sheet_hashes TEXT NOT NULL,
+            claims INTEGER NOT NULL,
+            changed_claims INTEGER NOT NULL,
+            run_id TEXT NOT NULL,
+            processed_at TEXT NOT NULL,
+            frame_basis TEXT
+        )
+    """)
+    if "frame_basis" not in sqlite_loader.table_columns(conn, "etl_manifest"):
+        conn.execute("ALTER TABLE etl_manifest ADD COLUMN frame_basis TEXT")
+    columns = sqlite_loader.table_columns(conn, "etl_claim_fingerprints")
+    if columns and "file_name" not in columns:
+        # fingerprints keyed by claim number alone can't be told apart per workbook;
+        # dropping them makes the next delivery of each changed workbook load in full
+        conn.execute("DROP TABLE etl_claim_fingerprints")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_claim_fingerprints (
+            file_name TEXT NOT NULL,
+            claim_no TEXT NOT NULL,
+            fingerprint INTEGER NOT NULL,
+            run_id TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (file_name, claim_no)
+        )
+    """)
+
+
+def is_processed(conn, file_hash: str) -> bool:
+    ensure_tables(conn)
+    row = conn.execute("SELECT 1 FROM etl_manifest WHERE file_hash=?", (file_hash,)).fetchone()
+    return row is not None
+
+
+def _row_hashes(df: pd.DataFrame) -> pd.Series:
+    # hashes depend on the numeric width, and compact.py picks it per sheet
+    return pd.util.hash_pandas_object(compact.widen(df), index=False)
+
+
+def sheet_hashes(sheets: Dict[str, pd.DataFrame]) -> Dict[str, str]:
+    """Order-independent hash of each sheet: wrapping sum of its row hashes plus the row count."""
+    return {
+        key: f"{int(_row_hashes(df).sum()):016x}:{len(df)}"
+        for key, df in sorted(sheets.items())
+    }
+
+
+def claim_fingerprints(sheets: Dict[str, pd.DataFrame]) -> pd.Series:
+    """
+    One signed 64-bit fingerprint per claim (indexed by the claim number as text),
+    combining the row hashes of that claim in every sheet. Any added, removed or
+    edited line of a claim changes its fingerprint; row order does not.
+    """
+    per_sheet = {}
+    for key, df in sorted(sheets.items()):
+        if CLAIM_COL not in df.columns:
+            raise ValueError(f"Sheet {key} has no {CLAIM_COL!r} column")
+        claims = df[CLAIM_COL].astype(str).to_numpy()
+        per_sheet[f"{key} hash"] = _row_hashes(df).groupby(claims, sort=False).sum()
+        per_sheet[f"{key} rows"] = pd.Series(1, index=df.index, dtype="uint64").groupby(claims, sort=False).sum()
+
+    # reindex with an integer fill so the uint64 sums never round-trip through float
+    index = pd.Index([])
+    for s in per_sheet.values():
+        index = index.union(s.index)
+    combined = pd.DataFrame({name: s.reindex(index, fill_value=0) for name, s in per_sheet.items()})
+    hashed = pd.util.hash_pandas_object(combined, index=True)
+    return pd.Series(hashed.to_numpy().view("int64"), index=index)
+
+
+def changed_claims(conn, file_name: str, fingerprints: pd.Series) -> Tuple[set, set]:
+    """
+    Compare a delivery of `file_name` with the fingerprints stored for it. Returns
+    the claim numbers (as text) that are new or changed, and those stored for the
+    workbook that it no longer contains.
+    """
+    ensure_tables(conn)
+    with sqlite_loader.transaction(conn):
+        conn.execute("DROP TABLE IF EXISTS temp.incoming_fingerprints")
+        conn.execute("CREATE TEMP TABLE incoming_fingerprints (claim_no TEXT PRIMARY KEY, fingerprint INTEGER)")
+        conn.executemany(
+            "INSERT INTO incoming_fingerprints VALUES (?, ?)",
+            zip(fingerprints.index.tolist(), fingerprints.tolist()),
+        )
+        changed = conn.execute("""
+            SELECT i.claim_no FROM incoming_fingerprints i
+            LEFT JOIN etl_claim_fingerprints f ON f.file_name = ? AND f.claim_no = i.claim_no
+            WHERE f.fingerprint IS NULL OR f.fingerprint != i.fingerprint
+        """, (file_name,)).fetchall()
+        removed = conn.execute("""
+            SELECT f.claim_no FROM etl_claim_fingerprints f
+            LEFT JOIN incoming_fingerprints i ON i.claim_no = f.claim_no
+            WHERE f.file_name = ? AND i.claim_no IS NULL
+        """, (file_name,)).fetchall()
+        conn.execute("DROP TABLE temp.incoming_fingerprints")
+    return {r[0] for r in changed}, {r[0] for r in removed}
+
+
+def encode_basis(basis: Dict[str, Any]) -> str:
+    return json.dumps(basis, sort_keys=True, default=float)
+
+
+def stored_basis(conn, file_name: str) -> str | None:
+    """The frame-wide KPI basis of the last recorded delivery of `file_name` (None if unknown)."""
+    ensure_tables(conn)
+    row = conn.execute(
+        "SELECT frame_basis FROM etl_manifest WHERE file_name=? ORDER BY processed_at DESC, rowid DESC LIMIT 1",
+        (file_name,),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def select_claims(frame: pd.DataFrame, claims: Iterable[str], claim_col: str = "claim no") -> pd.DataFrame:
+    """The rows of `frame` whose claim number (as text) is in `claims`."""
+    return frame[frame[claim_col].astype(str).isin(pd.Index(list(claims)))]
+
+
+def upsert_claims(
+    conn,
+    merged: pd.DataFrame,
+    claims: pd.Series,
+    fingerprints: pd.Series,
+    removed: Iterable[str],
+    file_hash: str,
+    file_name: str,
+    hashes: Dict[str, str],
+    total_claims: int,
+    run_id: str,
+    claim_col: str = "claim no",
+    basis: Dict[str, Any] | None = None,
+) -> Dict[str, Any]:
+    """
+    In one transaction: delete the rows of `claims` (the changed claim numbers,
+    with their original types) and of `removed` (claim numbers as text that the
+    workbook no longer contains) that `file_name` loaded into claims_kpis, insert
+    `merged`, store the new fingerprints and record the file, with the frame-wide
+    KPI `basis` of the whole workbook, in the manifest.
+    Rows loaded before claims were keyed by workbook (no file name) are replaced
+    by any workbook that delivers the same claim.
+    """
+    start = time.time()
+    now = datetime.now().isoformat(timespec="seconds")
+    sqlite_loader.tune_connection(conn)
+    ensure_tables(conn)
+    removed = set(removed)
+    table, claim, file_col = quote_ident(KPI_TABLE), quote_ident(claim_col), quote_ident(FILE_COL)
+    with sqlite_loader.transaction(conn):
+        columns = sqlite_loader.table_columns(conn, KPI_TABLE)
+        if columns and FILE_COL not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {file_col} TEXT")
+        if len(claims) and columns:
+            conn.executemany(
+                f"DELETE FROM {table} WHERE {claim} = ? AND ({file_col} = ? OR {file_col} IS NULL)",
+                ((c, file_name) for c in sqlite_loader.column_values(claims)),
+            )
+        if removed and columns:
+            # the stored claim numbers keep their types, so match them by the same text form
+            rows = conn.execute(f"SELECT DISTINCT {claim} FROM {table} WHERE {file_col} = ?", (file_name,))
+            stored = pd.Series([r[0] for r in rows], dtype=object)
+            gone = stored[stored.astype(str).isin(list(removed))]
+            conn.executemany(
+                f"DELETE FROM {table} WHERE {claim} = ? AND {file_col} = ?",
+                ((c, file_name) for c in sqlite_loader.column_values(gone)),
+            )
+            conn.executemany(
+                "DELETE FROM etl_claim_fingerprints WHERE file_name = ? AND claim_no = ?",
+                ((file_name, c) for c in removed),
+            )
+        if merged is not None and len(merged):
+            frame = merged.assign(run_id=run_id)
+            frame.insert(0, FILE_COL, file_name)
+            indexes = [claim_col, FILE_COL, fact_table.DATE_COL, *fact_table.FILTER_COLUMNS.values()]
+            sqlite_loader.load_rows(conn, frame, KPI_TABLE, if_exists="append", indexes=indexes)
+        conn.executemany(
+            """
+            INSERT INTO etl_claim_fingerprints (file_name, claim_no, fingerprint, run_id, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(file_name, claim_no) DO UPDATE SET
+                fingerprint=excluded.fingerprint, run_id=excluded.run_id, updated_at=excluded.updated_at
+            """,
+            (
+                (file_name, c, fp, run_id, now)
+                for c, fp in zip(fingerprints.index.tolist(), fingerprints.tolist())
+            ),
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO etl_manifest
+                (file_hash, file_name, sheet_hashes, claims, changed_claims, run_id, processed_at, frame_basis)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                file_hash, file_name, json.dumps(hashes), total_claims, len(fingerprints), run_id, now,
+                None if basis is None else encode_basis(basis),
+            ),
+        )
+    return sqlite_loader.load_stats(KPI_TABLE, 0 if merged is None else len(merged), time.time() - start)
@@ -0,0 +1,353 @@
+# instrumentation.py
+"""
+Per-stage pipeline instrumentation.
+
+A StageRecorder follows one workbook through the pipeline. Every stage records
+wall time, rows in/out, how far the process's RSS peaked above its level at the
+start of the stage, and bytes written
+(plus, when a memory budget is configured, the footprint of the frames it
+produced), and is logged as one structured (JSON) record. Sub-stages such as header
+mapping or date coercion are timed with `timed()`; they land in whichever
+recorder is active in the current thread and are named "<stage>.<sub-stage>".
+Event counts (e.g. header cache hits) go to the active recorder via `count()`.
+
+The finished stages travel back in the process_single_file result dict, so the
+parent process (not the pool worker that did the work) feeds them into the
+in-memory Prometheus-style histograms served by /metrics.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Tuple
+
+from logger import get_logger
+
+logger = get_logger()
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** p for p in range(20, 35, 2))  # 1 MiB .. 16 GiB
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def current_rss() -> int | None:
+    """
+    This process's resident memory right now, in bytes (None if unknown). Sampled
+    rather than read from ru_maxrss: a lifetime high-water mark stops moving once
+    a long-running API process has handled its largest workbook.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:  # last resort: the high-water mark
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def _high_water_mark() -> int | None:
+    """The kernel's resident-memory high-water mark (VmHWM) since its last reset, in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class PeakTracker:
+    """
+    Peak resident memory of every open stage in this process. On Linux each stage
+    start resets the kernel's high-water mark (writing 5 to /proc/self/clear_refs),
+    after folding the mark reached so far into the stages already open, so nested
+    and overlapping stages each see the true peak of their own span. Elsewhere the
+    peak is the largest RSS sampled at any stage boundary inside the span.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open: Dict[int, int] = {}  # token -> peak so far
+        self._next = 0
+        self._resettable = os.path.exists("/proc/self/clear_refs")
+
+    def _observe(self) -> int | None:
+        now = current_rss()
+        peak = max(filter(None, (now, _high_water_mark() if self._resettable else None)), default=None)
+        if peak is not None:
+            for token, seen in self._open.items():
+                self._open[token] = max(seen, peak)
+        return now
+
+    def _reset(self) -> None:
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            self._resettable = False
+
+    def start(self) -> Tuple[int, int | None]:
+        """Open a span; returns its token and the RSS at its start."""
+        with self._lock:
+            now = self._observe()
+            if self._resettable:
+                self._reset()
+            token, self._next = self._next, self._next + 1
+            self._open[token] = now or 0
+            return token, now
+
+    def finish(self, token: int) -> int | None:
+        """Close a span; returns the peak RSS reached during it."""
+        with self._lock:
+            self._observe()
+            return self._open.pop(token) or None
+
+
+PEAKS = PeakTracker()
+
+
+@dataclass
+class StageRecord:
+    stage: str
+    seconds: float = 0.0
+    rows_in: int | None = None
+    rows_out: int | None = None
+    peak_rss_delta_bytes: int | None = None
+    bytes_written: int | None = None
+    frame_bytes: int | None = None
+
+
+class StageRecorder:
+    """Collects the stages of one workbook; `mark()` runs top-level stages back to back."""
+
+    _active = threading.local()
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.stages: Dict[str, StageRecord] = {}
+        self.counters: Dict[str, int] = {}
+        self._current: StageRecord | None = None
+        self._since = 0.0
+        self._span: Tuple[int, int | None] = (0, None)
+
+    # ---- sequential top-level stages ----
+    def mark(self, stage: str | None, rows_in: int | None = None) -> StageRecord | None:
+        """Close the running stage and start `stage` (None just closes it)."""
+        if self._current is not None:
+            self._finish(self._current, self._since, self._span)
+        self._current = None
+        if stage is None:
+            return None
+        self.stages.setdefault(stage, StageRecord(stage))
+        self._current = StageRecord(stage, rows_in=rows_in)
+        self._since, self._span = time.perf_counter(), PEAKS.start()
+        return self._current
+
+    @property
+    def current_stage(self) -> str | None:
+        return self._current.stage if self._current else None
+
+    # ---- nested stages ----
+    @contextmanager
+    def stage(self, stage: str, rows_in: int | None = None) -> Iterator[StageRecord]:
+        rec = StageRecord(self._name(stage), rows_in=rows_in)
+        since, span = time.perf_counter(), PEAKS.start()
+        try:
+            yield rec
+        finally:
+            self._finish(rec, since, span)
+
+    @contextmanager
+    def activate(self) -> Iterator["StageRecorder"]:
+        """Make this the recorder that `timed()` reports to in the current thread."""
+        previous = getattr(self._active, "recorder", None)
+        self._active.recorder = self
+        try:
+            yield self
+        finally:
+            self._active.recorder = previous
+
+    @classmethod
+    def active(cls) -> "StageRecorder | None":
+        return getattr(cls._active, "recorder", None)
+
+    def merge(self, stages: Dict[str, Dict[str, Any]], counters: Dict[str, int] | None = None) -> None:
+        """Fold in stages and counters recorded elsewhere (e.g. in a sheet-parsing worker)."""
+        for name, values in stages.items():
+            name = self._name(name)
+            _accumulate(self.stages.setdefault(name, StageRecord(name)), StageRecord(name, **values))
+        for name, n in (counters or {}).items():
+            self.count(name, n)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {k: v for k, v in asdict(rec).items() if k != "stage"} for name, rec in self.stages.items()}
+
+    # ---- internals ----
+    def _name(self, stage: str) -> str:
+        parent = self.current_stage
+        return f"{parent}.{stage}" if parent and not stage.startswith(parent + ".") else stage
+
+    def _finish(self, rec: StageRecord, since: float, span: Tuple[int, int | None]) -> None:
+        rec.seconds = round(time.perf_counter() - since, 4)
+        token, rss_start = span
+        peak = PEAKS.finish(token)
+        if peak is not None and rss_start is not None:
+            rec.peak_rss_delta_bytes = max(peak - rss_start, 0)
+        logger.info(json.dumps({"event": "etl_stage", "file": self.file_name, **asdict(rec)}))
+        _accumulate(self.stages.setdefault(rec.stage, StageRecord(rec.stage)), rec)
+
+
+def _accumulate(into: StageRecord, rec: StageRecord) -> None:
+    into.seconds = round(into.seconds + rec.seconds, 4)
+    for field in ("rows_in", "rows_out", "bytes_written"):
+        value = getattr(rec, field)
+        if value is not None:
+            setattr(into, field, (getattr(into, field) or 0) + value)
+    for field in ("peak_rss_delta_bytes", "frame_bytes"):
+        value = getattr(rec, field)
+        if value is not None:
+            setattr(into, field, max(getattr(into, field) or 0, value))
+
+
+@contextmanager
+def timed(stage: str, rows_in: int | None = None) -> Iterator[StageRecord]:
+    """Time a sub-stage into the active recorder; a no-op record when there is none."""
+    recorder = StageRecorder.active()
+    if recorder is None:
+        yield StageRecord(stage)
+        return
+    with recorder.stage(stage, rows_in) as rec:
+        yield rec
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add to a counter of the active recorder; ignored when there is none."""
+    recorder = StageRecorder.active()
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+# =========================
+# Prometheus-style metrics
+# =========================
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.n += 1
+
+
+class Metrics:
+    """Stage histograms and counters, labelled by stage name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, Histogram] = {}
+        self.rss: Dict[str, Histogram] = {}
+        self.frames: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self.files: Dict[str, int] = {}
+        self.events: Dict[str, int] = {}
+
+    def observe_result(self, result: Dict[str, Any]) -> None:
+        """Record the stages, counters and outcome of one process_single_file result."""
+        if not result.get("success"):
+            status = "failed"
+        else:
+            status = "skipped" if result.get("skipped") else "succeeded"
+        with self._lock:
+            self.files[status] = self.files.get(status, 0) + 1
+            for name, n in (result.get("counters") or {}).items():
+                self.events[name] = self.events.get(name, 0) + n
+            for stage, values in (result.get("stages") or {}).items():
+                self.seconds.setdefault(stage, Histogram(SECONDS_BUCKETS)).observe(values.get("seconds") or 0.0)
+                if values.get("peak_rss_delta_bytes") is not None:
+                    self.rss.setdefault(stage, Histogram(BYTES_BUCKETS)).observe(values["peak_rss_delta_bytes"])
+                if values.get("frame_bytes") is not None:
+                    self.frames.setdefault(stage, Histogram(BYTES_BUCKETS)).observe(values["frame_bytes"])
+                for field in ("rows_in", "rows_out", "bytes_written"):
+                    if values.get(field) is not None:
+                        key = (field, stage)
+                        self.counters[key] = self.counters.get(key, 0) + values[field]
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            lines += ["# HELP etl_files_total Workbooks processed, by outcome.", "# TYPE etl_files_total counter"]
+            lines += [f'etl_files_total{{status="{s}"}} {n}' for s, n in sorted(self.files.items())]
+            _render_histograms(lines, "etl_stage_duration_seconds", "Wall time per pipeline stage.", self.seconds)
+            _render_histograms(
+                lines,
+                "etl_stage_peak_rss_delta_bytes",
+                "Peak resident memory during a stage above its level at the start.",
+                self.rss,
+            )
+            _render_histograms(
+                lines, "etl_stage_frame_bytes", "Deep size of the frames a stage produced.", self.frames
+            )
+            for field, help_text in (
+                ("rows_in", "Rows entering each stage."),
+                ("rows_out", "Rows leaving each stage."),
+                ("bytes_written", "Bytes written by each stage."),
+            ):
+                name = f"etl_stage_{field}_total"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [
+                    f'{name}{{stage="{stage}"}} {_fmt(v)}'
+                    for (f, stage), v in sorted(self.counters.items())
+                    if f == field
+                ]
+            for name, n in sorted(self.events.items()):
+                help_text = name.replace("_", " ").capitalize()
+                lines += [
+                    f"# HELP etl_{name}_total {help_text}.",
+                    f"# TYPE etl_{name}_total counter",
+                    f"etl_{name}_total {n}",
+                ]
+        return "\n".join(lines) + "\n"
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _render_histograms(lines: List[str], name: str, help_text: str, hists: Dict[str, Histogram]) -> None:
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for stage, h in sorted(hists.items()):
+        for bound, count in zip(h.buckets, h.counts):
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{_fmt(bound)}"}} {count}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.n}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {_fmt(round(h.total, 6))}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {h.n}')
+
+
+METRICS = Metrics()
@@ -0,0 +1,284 @@
+# job_queue.py
+"""
+SQLite-backed background job queue.
+
+Jobs live in the etl_jobs table, so nothing is lost when the API restarts: jobs
+still queued are picked up again. Every queue has a worker id and holds a lease on
+the jobs it runs, renewed by a heartbeat thread; a running job is only put back in
+the queue once its lease has expired, so a second API process on the same database
+never steals live work. A job that has already been started `max_attempts` times
+(its worker keeps dying under it) is marked failed instead of being requeued.
+Input files are claimed the same way in etl_file_claims.
+A fixed number of worker threads caps how many jobs run at once.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict
+
+from logger import get_logger
+
+logger = get_logger()
+
+# handler(job_id, params, report_progress) -> result (JSON-serialisable)
+JobHandler = Callable[[str, Dict[str, Any], Callable[[Dict[str, Any]], None]], Any]
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JobQueue:
+    def __init__(
+        self,
+        db_path: str,
+        handler: JobHandler,
+        workers: int = 1,
+        poll_interval: float = 2.0,
+        lease: float = 60.0,
+        max_attempts: int = 3,
+    ):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max(1, max_attempts)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._heartbeat: threading.Thread | None = None
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_guard = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def ensure_table(self) -> None:
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS etl_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL CHECK (status IN ('queued','running','succeeded','failed')),
+                    params TEXT NOT NULL,
+                    submitted_by TEXT,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            cols = {row["name"] for row in conn.execute("PRAGMA table_info(etl_jobs)")}
+            for col in ("worker_id", "heartbeat_at"):
+                if col not in cols:
+                    conn.execute(f"ALTER TABLE etl_jobs ADD COLUMN {col} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_etl_jobs_status ON etl_jobs (status, created_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS etl_file_claims (
+                    path TEXT PRIMARY KEY,
+                    worker_id TEXT NOT NULL,
+                    heartbeat_at TEXT NOT NULL
+                )
+            """)
+        self._ready = True
+
+    # ---- leases ----
+    def _expiry(self) -> str:
+        return (datetime.now() - timedelta(seconds=self.lease)).isoformat(timespec="seconds")
+
+    def requeue_expired(self) -> int:
+        """
+        Put running jobs whose owner stopped sending heartbeats back in the queue,
+        or mark them failed once they have used up max_attempts. Returns the number requeued.
+        """
+        expired, cutoff = "status='running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)", self._expiry()
+        with self._connect() as conn:
+            failed = conn.execute(
+                f"UPDATE etl_jobs SET status='failed', worker_id=NULL, finished_at=?, "
+                f"error='worker lease expired on attempt ' || attempts || ' of ' || ? "
+                f"WHERE {expired} AND attempts >= ?",
+                (_now(), self.max_attempts, cutoff, self.max_attempts),
+            ).rowcount
+            requeued = conn.execute(
+                f"UPDATE etl_jobs SET status='queued', worker_id=NULL WHERE {expired}", (cutoff,)
+            ).rowcount
+        if failed:
+            logger.error(f"Marked {failed} job(s) failed after {self.max_attempts} expired lease(s)")
+        return requeued
+
+    def _beat(self) -> None:
+        now = _now()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE etl_jobs SET heartbeat_at=? WHERE status='running' AND worker_id=?", (now, self.worker_id)
+            )
+            conn.execute("UPDATE etl_file_claims SET heartbeat_at=? WHERE worker_id=?", (now, self.worker_id))
+        n = self.requeue_expired()
+        if n:
+            logger.warning(f"Requeued {n} job(s) whose worker lease expired")
+
+    def _heartbeat_loop(self) -> None:
+        while not self._heartbeat_stop.wait(self.lease / 3):
+            try:
+                self._beat()
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue heartbeat failed: {e}")
+
+    def _start_heartbeat(self) -> None:
+        with self._heartbeat_guard:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat_stop.clear()
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="etl-job-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    # ---- input file claims ----
+    def claim_files(self, paths: list[str]) -> list[str]:
+        """Claim the paths no live worker holds yet and return them."""
+        if not self._ready:
+            self.ensure_table()
+        self._start_heartbeat()
+        now = _now()
+        claimed = []
+        with self._connect() as conn:
+            conn.execute("DELETE FROM etl_file_claims WHERE heartbeat_at < ?", (self._expiry(),))
+            for path in paths:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO etl_file_claims (path, worker_id, heartbeat_at) VALUES (?, ?, ?)",
+                    (path, self.worker_id, now),
+                )
+                if cur.rowcount:
+                    claimed.append(path)
+        return claimed
+
+    def release_files(self, paths: list[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM etl_file_claims WHERE path=? AND worker_id=?", [(p, self.worker_id) for p in paths]
+            )
+
+    # ---- producer side ----
+    def submit(self, params: Dict[str, Any] | None = None, submitted_by: str | None = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO etl_jobs (id, status, params, submitted_by, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(params or {}), submitted_by, _now()),
+            )
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM etl_jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("params", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    # ---- worker side ----
+    def _claim(self) -> tuple[str, Dict[str, Any]] | None:
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, params FROM etl_jobs WHERE status='queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = _now()
+            conn.execute(
+                "UPDATE etl_jobs SET status='running', worker_id=?, started_at=?, heartbeat_at=?, "
+                "attempts=attempts+1 WHERE id=?",
+                (self.worker_id, now, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+            return row["id"], json.loads(row["params"])
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _update(self, job_id: str, **fields) -> None:
+        # only the lease holder writes, so a job requeued under us is left to its new owner
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE etl_jobs SET {cols} WHERE id=? AND worker_id=?", (*fields.values(), job_id, self.worker_id)
+            )
+
+    def report_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        try:
+            self._update(job_id, progress=json.dumps(progress, default=str))
+        except sqlite3.Error as e:
+            # progress is best effort; never fail a job because the DB was busy
+            logger.warning(f"Could not record progress for job {job_id}: {e}")
+
+    def _run(self, job_id: str, params: Dict[str, Any]) -> None:
+        logger.info(f"Job {job_id} started")
+        try:
+            result = self.handler(job_id, params, lambda p: self.report_progress(job_id, p))
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished_at=_now())
+            return
+        self._update(job_id, status="succeeded", result=json.dumps(result, default=str), finished_at=_now())
+        logger.info(f"Job {job_id} finished")
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue poll failed: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._run(*job)
+
+    def start(self) -> None:
+        """Create the tables, requeue jobs whose lease expired and start the workers and heartbeat."""
+        if self._threads:
+            return
+        self.ensure_table()
+        n = self.requeue_expired()
+        if n:
+            logger.warning(f"Requeued {n} job(s) interrupted by a restart")
+
+        self._start_heartbeat()
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"etl-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._heartbeat_stop.set()
+        with self._heartbeat_guard:
+            if self._heartbeat is not None:
+                self._heartbeat.join(timeout)
+                self._heartbeat = None
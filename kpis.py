@@ -0,0 +1,193 @@
+# kpis.py
+"""
+Columnar KPI engine.
+
+Every KPI is a row in KPI_DEFINITIONS: the output column, the input columns it
+needs and a function that computes it from a KPIContext. The context coerces each
+amount column once and memoises intermediates shared by several KPIs (the
+collectible amount, paid/collectible, ...), so nothing is computed twice and no
+KPI falls back to a per-row Python loop.
+
+Each KPI also carries the same computation as a SQLite expression, used by the
+out-of-core mode (see out_of_core.py) where the merged rows only exist as a
+table. Frame-wide KPIs there become scalar subqueries over that table.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+AMOUNT_COLUMNS = ["Paid Amount", "Billed Amount", "Adjustment Amount", "AR Balance"]
+
+
+def match_values(series: pd.Series, predicate: Callable[[str], bool]) -> np.ndarray:
+    """
+    Boolean mask of predicate(str(value)) over a column, evaluated once per
+    distinct value instead of once per row. Missing values never match.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    hits = np.fromiter((predicate(str(u)) for u in uniques), dtype=bool, count=len(uniques))
+    mask = np.zeros(len(codes), dtype=bool)
+    valid = codes >= 0
+    mask[valid] = hits[codes[valid]]
+    return mask
+
+
+class KPIContext:
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._shared: Dict[str, Any] = {}
+
+    def shared(self, name: str, fn: Callable[["KPIContext"], Any]) -> Any:
+        if name not in self._shared:
+            self._shared[name] = fn(self)
+        return self._shared[name]
+
+    def col(self, name: str) -> pd.Series:
+        return self.df[name]
+
+
+class SQLContext:
+    """Column references for the SQL form of the KPIs; amounts are already coerced to REAL (missing -> 0)."""
+
+    def __init__(self, table: str, columns: Dict[str, str]):
+        self.table = table
+        self.columns = columns  # KPI input name -> quoted column in `table`
+
+    def col(self, name: str) -> str:
+        return self.columns[name]
+
+
+@dataclass(frozen=True)
+class KPI:
+    name: str
+    inputs: Tuple[str, ...]
+    compute: Callable[[KPIContext], Any]
+    sql: Callable[[SQLContext], str] | None = None
+    # frame-wide KPIs: the whole-frame figure every row's value depends on
+    basis: Callable[[KPIContext], Any] | None = None
+
+
+def _ratio_pct(num: pd.Series, den: pd.Series) -> pd.Series:
+    # x / 0 counts as "no ratio" (0), like the original pd.NA-based expression
+    return (num / den.where(den != 0)).mul(100).fillna(0).round(2)
+
+
+def _collectible(ctx: KPIContext) -> pd.Series:
+    return ctx.col("Billed Amount") - ctx.col("Adjustment Amount")
+
+
+def _paid_over_collectible(ctx: KPIContext) -> pd.Series:
+    return _ratio_pct(ctx.col("Paid Amount"), ctx.shared("collectible", _collectible))
+
+
+def _avg_daily_charges(ctx: KPIContext) -> float | None:
+    billed_sum = ctx.col("Billed Amount").sum()
+    return float(billed_sum / 30) if billed_sum else None
+
+
+def _ar_days(ctx: KPIContext) -> Any:
+    avg_daily_charges = ctx.shared("avg_daily_charges", _avg_daily_charges)
+    return (ctx.col("AR Balance") / avg_daily_charges).round(1) if avg_daily_charges else None
+
+
+def _ar_90_plus(ctx: KPIContext) -> pd.Series:
+    over_90 = match_values(ctx.col("Aging Range"), lambda v: "90" in v)
+    return ctx.col("AR Balance").where(over_90, 0)
+
+
+def _denial_rate(ctx: KPIContext) -> Any:
+    total_claims = len(ctx.df)
+    if not total_claims:
+        return None
+    denied = match_values(ctx.col("Financial Status"), lambda v: "denied" in v.lower()).sum()
+    return round(denied / total_claims * 100, 2)
+
+
+# ---- SQL forms ----
+def sql_amount(column: str) -> str:
+    """SQL counterpart of the amount coercion in calculate_kpis (non-numbers and missing -> 0)."""
+    return f"COALESCE(CAST({column} AS REAL), 0.0)"
+
+
+def _sql_days(later: str, earlier: str) -> str:
+    # Timedelta.days floors, CAST truncates towards zero
+    diff = f"(julianday({later}) - julianday({earlier}))"
+    return f"(CAST({diff} AS INTEGER) - ({diff} < CAST({diff} AS INTEGER)))"
+
+
+def _sql_ratio_pct(num: str, den: str) -> str:
+    return f"COALESCE(ROUND({num} / NULLIF({den}, 0) * 100, 2), 0.0)"
+
+
+def _sql_ar_days(ctx: SQLContext) -> str:
+    avg_daily = f"(SELECT NULLIF(SUM({ctx.col('Billed Amount')}), 0) / 30 FROM {ctx.table})"
+    return f"ROUND({ctx.col('AR Balance')} / {avg_daily}, 1)"
+
+
+def _sql_ar_90_plus(ctx: SQLContext) -> str:
+    over_90 = f"instr(CAST({ctx.col('Aging Range')} AS TEXT), '90') > 0"
+    return f"CASE WHEN {over_90} THEN {ctx.col('AR Balance')} ELSE 0.0 END"
+
+
+def _sql_denial_rate(ctx: SQLContext) -> str:
+    denied = f"TOTAL(instr(lower(CAST({ctx.col('Financial Status')} AS TEXT)), 'denied') > 0)"
+    return f"(SELECT ROUND({denied} * 100.0 / NULLIF(COUNT(*), 0), 2) FROM {ctx.table})"
+
+
+def _sql_paid_over_collectible(ctx: SQLContext) -> str:
+    collectible = f"({ctx.col('Billed Amount')} - {ctx.col('Adjustment Amount')})"
+    return _sql_ratio_pct(ctx.col("Paid Amount"), collectible)
+
+
+KPI_DEFINITIONS = [
+    KPI("Charge Lag (days)", ("DOS", "Charge Entry Date"),
+        lambda ctx: (ctx.col("Charge Entry Date") - ctx.col("DOS")).dt.days,
+        lambda ctx: _sql_days(ctx.col("Charge Entry Date"), ctx.col("DOS"))),
+    KPI("Billing Lag (days)", ("Charge Entry Date", "Payment Entry Date"),
+        lambda ctx: (ctx.col("Payment Entry Date") - ctx.col("Charge Entry Date")).dt.days,
+        lambda ctx: _sql_days(ctx.col("Payment Entry Date"), ctx.col("Charge Entry Date"))),
+    KPI("GCR (%)", ("Paid Amount", "Billed Amount"),
+        lambda ctx: _ratio_pct(ctx.col("Paid Amount"), ctx.col("Billed Amount")),
+        lambda ctx: _sql_ratio_pct(ctx.col("Paid Amount"), ctx.col("Billed Amount"))),
+    KPI("NCR (%)", ("Paid Amount", "Billed Amount", "Adjustment Amount"),
+        lambda ctx: ctx.shared("paid_over_collectible", _paid_over_collectible),
+        _sql_paid_over_collectible),
+    KPI("CCR (%)", ("Paid Amount", "Billed Amount", "Adjustment Amount"),
+        lambda ctx: ctx.shared("paid_over_collectible", _paid_over_collectible),
+        _sql_paid_over_collectible),
+    KPI("AR Days", ("AR Balance", "Billed Amount"), _ar_days, _sql_ar_days,
+        lambda ctx: ctx.shared("avg_daily_charges", _avg_daily_charges)),
+    KPI("90+ AR Days (%)", ("Aging Range", "AR Balance"), _ar_90_plus, _sql_ar_90_plus),
+    KPI("Denial Rate (%)", ("Financial Status",), _denial_rate, _sql_denial_rate, _denial_rate),
+]
+
+
+def calculate_kpis(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Coerce the amount columns to numbers (missing -> 0) in place, then add every
+    KPI whose inputs are present.
+    """
+    for col in AMOUNT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+
+    ctx = KPIContext(df)
+    for kpi in KPI_DEFINITIONS:
+        if set(kpi.inputs).issubset(df.columns):
+            df[kpi.name] = kpi.compute(ctx)
+    return df
+
+
+def frame_basis(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    The whole-frame figures behind the frame-wide KPIs of an already calculated
+    frame, by KPI name. Rows computed from equal bases are comparable.
+    """
+    ctx = KPIContext(df)
+    return {
+        kpi.name: kpi.basis(ctx)
+        for kpi in KPI_DEFINITIONS
+        if kpi.basis is not None and set(kpi.inputs).issubset(df.columns)
+    }
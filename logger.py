@@ -7,12 +7,18 @@ import os
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
+def log_dir():
+    """Directory of etl.log: ETL_LOG_DIR when set (e.g. by the tests), else LOG_DIR."""
+    path = os.environ.get("ETL_LOG_DIR") or LOG_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
 def get_logger(name="ETL", level=logging.INFO):
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    log_path = os.path.join(LOG_DIR, "etl.log")
-    handler = RotatingFileHandler(log_path, maxBytes=2*1024*1024, backupCount=5)
+    log_path = os.path.join(log_dir(), "etl.log")
+    handler = RotatingFileHandler(log_path, maxBytes=2*1024*1024, backupCount=5, delay=True)
 
     formatter = logging.Formatter(
         '%(asctime)s - %(levelname)s - %(message)s',
@@ -0,0 +1,369 @@
+# out_of_core.py
+"""
+Out-of-core merge and KPIs, with SQLite as the join engine.
+
+The in-memory pipeline holds every sheet and the fanned-out merged frame at
+once, so the largest workbook it can process is bounded by RAM. In this mode
+the sheets are streamed chunk by chunk into staging tables of a scratch
+database (one per workbook, deleted afterwards) and everything after that runs
+as set-based SQL inside SQLite, which spills to disk instead of growing:
+
+  * stage_sheet() appends each normalized chunk to an untyped staging table
+    and indexes the claim key;
+  * aggregate_claims() collapses a staging table to one row per claim
+    (JOIN_MODE "claim"), join_tables() left-joins the sheets in the same order
+    and with the same duplicate-column rule as safe_merge;
+  * kpi_view() adds the KPIs from their SQL forms in kpis.py on top of the
+    joined table, with the output column names;
+  * iter_frames() reads that view back in fixed-size chunks for the output
+    writers; the KPI database is attached to the scratch connection so the
+    rows reach it with one INSERT ... SELECT (fact_table.load_select, or
+    load_into for a per-run table).
+
+Staging tables have no declared column types, so every value is stored as it
+came. The type of each column is tracked instead while the chunks go in (see
+kind_of) and decides how the chunks read back are typed, so every chunk of an
+output has the same schema.
+"""
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+import sqlite_loader
+from kpis import AMOUNT_COLUMNS, KPI_DEFINITIONS, SQLContext, sql_amount
+from sqlite_loader import quote_ident
+
+# Page cache of the scratch connection; SQLite spills sorts and temp B-trees to
+# files beyond it, which is what keeps memory flat
+SCRATCH_CACHE_KIB = 64 * 1024
+
+# Column kinds: "integer", "real", "datetime" or "text" (see widen_kind)
+_SQL_TYPES = {"integer": "INTEGER", "real": "REAL", "datetime": "TIMESTAMP", "text": "TEXT"}
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@contextmanager
+def scratch_db(directory: str) -> Iterator[sqlite3.Connection]:
+    """A connection to a new scratch database file in `directory`, removed on exit."""
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="etl-scratch-", suffix=".db", dir=directory)
+    os.close(fd)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    try:
+        # nothing here outlives the run, so there is nothing to journal or fsync
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(f"PRAGMA cache_size=-{SCRATCH_CACHE_KIB}")
+        conn.execute("PRAGMA temp_store=FILE")
+        yield conn
+    finally:
+        conn.close()
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def kind_of(series: pd.Series) -> str | None:
+    """The kind of a chunk's column, or None when the chunk has no value in it."""
+    if not series.notna().any():
+        return None
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "integer"
+    if pd.api.types.is_float_dtype(dtype):
+        return "real"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "text"
+
+
+def widen_kind(a: str | None, b: str | None) -> str | None:
+    """A column seen as integer in one chunk and real in another is real; any other mix is text."""
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if {a, b} == {"integer", "real"}:
+        return "real"
+    return "text"
+
+
+def stage_sheet(
+    conn, table: str, chunks: Iterable[pd.DataFrame], key: str
+) -> Tuple[List[str], Dict[str, str], int]:
+    """
+    Append every chunk to a new staging table and index `key`. Returns the
+    columns, their kinds (text for columns that never had a value) and the row count.
+    """
+    conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+    columns: List[str] | None = None
+    kinds: Dict[str, str | None] = {}
+    rows = 0
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            if key not in columns:
+                raise ValueError(f"Sheet for {table} has no {key!r} column")
+            conn.execute(f"CREATE TABLE {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)})")
+        conn.execute("BEGIN")
+        sqlite_loader.load_rows(conn, chunk, table, if_exists="append")
+        conn.execute("COMMIT")
+        for col in chunk.columns:
+            kinds[col] = widen_kind(kinds.get(col), kind_of(chunk[col]))
+        rows += len(chunk)
+    if columns is None:
+        raise ValueError(f"Sheet for {table} is empty")
+    sqlite_loader.create_indexes(conn, table, [key])
+    return columns, {col: kinds.get(col) or "text" for col in columns}, rows
+
+
+def aggregate_claims(
+    conn,
+    source: str,
+    table: str,
+    columns: List[str],
+    kinds: Dict[str, str],
+    key: str,
+    amount_col: str,
+    date_col: str,
+    count_col: str,
+) -> Tuple[List[str], Dict[str, str]]:
+    """
+    SQL form of ETL.aggregate_by_claim: one row per claim (missing keys form one
+    group) in order of first appearance. The amount is summed, the date spans
+    min/"Last" max, `count_col` counts the lines and every other column keeps
+    its first non-null value in row order.
+    """
+    src, k = quote_ident(source), quote_ident(key)
+    select, out_cols, out_kinds = [f"g.{k}"], [key], {key: kinds[key]}
+    for col in columns:
+        if col == key:
+            continue
+        q = quote_ident(col)
+        if col == amount_col:
+            select.append(f"g.{quote_ident('sum:' + col)}")
+            out_kinds[col] = "real"
+        elif col == date_col:
+            select.append(f"g.{quote_ident('min:' + col)}")
+            out_kinds[col] = kinds[col]
+        else:
+            select.append(
+                f"(SELECT s.{q} FROM {src} AS s WHERE s.{k} IS g.{k} AND s.{q} IS NOT NULL "
+                f"ORDER BY s.rowid LIMIT 1)"
+            )
+            out_kinds[col] = kinds[col]
+        out_cols.append(col)
+
+    groups = [k, "MIN(rowid) AS first_row", f"COUNT(*) AS {quote_ident('count')}"]
+    if amount_col in columns:
+        groups.append(f"TOTAL({sql_amount(quote_ident(amount_col))}) AS {quote_ident('sum:' + amount_col)}")
+    if date_col in columns:
+        q = quote_ident(date_col)
+        groups.append(f"MIN({q}) AS {quote_ident('min:' + date_col)}")
+        groups.append(f"MAX({q}) AS {quote_ident('max:' + date_col)}")
+        select.append(f"g.{quote_ident('max:' + date_col)}")
+        out_cols.append(f"Last {date_col}")
+        out_kinds[f"Last {date_col}"] = kinds[date_col]
+    select.append(f"g.{quote_ident('count')}")
+    out_cols.append(count_col)
+    out_kinds[count_col] = "integer"
+
+    names = ", ".join(f"{expr} AS {quote_ident(name)}" for expr, name in zip(select, out_cols))
+    conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+    conn.execute(f"""
+        CREATE TABLE {quote_ident(table)} AS
+        SELECT {names}
+        FROM (SELECT {', '.join(groups)} FROM {src} GROUP BY {k}) AS g
+        ORDER BY g.first_row
+    """)
+    sqlite_loader.create_indexes(conn, table, [key])
+    return out_cols, out_kinds
+
+
+def join_tables(
+    conn, tables: List[Tuple[str, List[str], Dict[str, str]]], key: str, target: str
+) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Left-join (table, columns, kinds) in order on `key` into `target`, like a
+    chain of safe_merge calls: a column already present is not taken again,
+    missing keys match each other as they do in pandas, and rows come out in
+    left-table order with each table's matches in their own order.
+    """
+    k = quote_ident(key)
+    select, out_cols, out_kinds, joins, order = [], [], {}, [], []
+    for i, (table, columns, kinds) in enumerate(tables):
+        alias = f"t{i}"
+        for col in columns:
+            if col in out_kinds:
+                continue
+            select.append(f"{alias}.{quote_ident(col)}")
+            out_cols.append(col)
+            out_kinds[col] = kinds[col]
+        if i:
+            joins.append(f"LEFT JOIN {quote_ident(table)} AS {alias} ON {alias}.{k} IS t0.{k}")
+        order.append(f"{alias}.rowid")
+
+    conn.execute(f"DROP TABLE IF EXISTS {quote_ident(target)}")
+    conn.execute(f"""
+        CREATE TABLE {quote_ident(target)} AS
+        SELECT {', '.join(select)}
+        FROM {quote_ident(tables[0][0])} AS t0 {' '.join(joins)}
+        ORDER BY {', '.join(order)}
+    """)
+    return out_cols, out_kinds
+
+
+def kpi_view(
+    conn,
+    source: str,
+    view: str,
+    columns: List[str],
+    kinds: Dict[str, str],
+    output_names: Callable[[List[str]], List[str]],
+) -> Tuple[List[str], Dict[str, str], Dict[str, str]]:
+    """
+    Create `view` over `source`: the amount columns coerced like calculate_kpis
+    does, plus every KPI whose inputs are present, named by `output_names`
+    (original names -> output names, in order). `view` keeps the row order of
+    `source`; "<view>_unordered" holds the same rows for aggregates, which
+    SQLite would otherwise run over a materialised copy of the ordered view.
+
+    Returns the output columns, their kinds, and the output column of every
+    original name (for rollups).
+    """
+    amounts = [col for col in AMOUNT_COLUMNS if col in columns]
+    coerced = f"{view}_coerced"
+    select = [
+        f"{sql_amount(quote_ident(col))} AS {quote_ident(col)}" if col in amounts else quote_ident(col)
+        for col in columns
+    ]
+    for name in (view, f"{view}_unordered", coerced):
+        conn.execute(f"DROP VIEW IF EXISTS {quote_ident(name)}")
+    conn.execute(f"""
+        CREATE VIEW {quote_ident(coerced)} AS
+        SELECT rowid AS _row, {', '.join(select)} FROM {quote_ident(source)}
+    """)
+
+    ctx = SQLContext(quote_ident(coerced), {col: quote_ident(col) for col in columns})
+    names, exprs = list(columns), [quote_ident(col) for col in columns]
+    kinds = {col: "real" if col in amounts else kinds[col] for col in columns}
+    for kpi in KPI_DEFINITIONS:
+        if kpi.sql is not None and set(kpi.inputs).issubset(columns):
+            names.append(kpi.name)
+            exprs.append(kpi.sql(ctx))
+            kinds[kpi.name] = "integer" if kpi.name.endswith("(days)") else "real"
+
+    final = output_names(names)
+    body = f"""
+        SELECT {', '.join(f'{expr} AS {quote_ident(name)}' for expr, name in zip(exprs, final))}
+        FROM {quote_ident(coerced)}
+    """
+    conn.execute(f"CREATE VIEW {quote_ident(view)} AS {body} ORDER BY _row")
+    conn.execute(f"CREATE VIEW {quote_ident(view + '_unordered')} AS {body}")
+    return final, {out: kinds[name] for name, out in zip(names, final)}, dict(zip(names, final))
+
+
+def typed_frame(rows: list, columns: List[str], kinds: Dict[str, str]) -> pd.DataFrame:
+    """A chunk read back from SQLite, with the dtypes of its columns' kinds."""
+    df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=False)
+    for i, col in enumerate(columns):
+        values = df.iloc[:, i]
+        kind = kinds[col]
+        if kind == "integer":
+            new = pd.to_numeric(values, errors="coerce").astype("Int64")
+        elif kind == "real":
+            new = pd.to_numeric(values, errors="coerce").astype("float64")
+        elif kind == "datetime":
+            new = pd.to_datetime(values, format=_TIMESTAMP_FORMAT, errors="coerce").astype("datetime64[ns]")
+        elif pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+            continue
+        else:
+            values = values.astype(object)
+            new = values.where(values.isna(), values.astype(str))
+        df.isetitem(i, new)
+    return df
+
+
+def arrow_schema(columns: List[str], kinds: Dict[str, str]):
+    """The pyarrow schema of the frames typed_frame() builds."""
+    import pyarrow as pa
+
+    types = {"integer": pa.int64(), "real": pa.float64(), "datetime": pa.timestamp("ns"), "text": pa.string()}
+    return pa.schema([(col, types[kinds[col]]) for col in columns])
+
+
+def iter_frames(
+    conn, view: str, columns: List[str], kinds: Dict[str, str], chunk_rows: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream `view` as typed DataFrames of at most `chunk_rows` rows; an empty view
+    yields one empty frame so writers still see the columns.
+    """
+    cursor = conn.execute(f"SELECT * FROM {quote_ident(view)}")
+    try:
+        emitted = False
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows and emitted:
+                break
+            yield typed_frame(rows, columns, kinds)
+            emitted = True
+    finally:
+        cursor.close()
+
+
+@contextmanager
+def attached(conn, db_path: str, schema: str = "dest") -> Iterator[str]:
+    """Attach the database at `db_path` to the scratch connection for the duration; yields its schema name."""
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (db_path,))
+    try:
+        conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+        yield schema
+    finally:
+        conn.execute(f"DETACH DATABASE {schema}")
+
+
+def sql_types(columns: List[str], kinds: Dict[str, str]) -> Dict[str, str]:
+    """Declared SQLite type of every column, as bulk_load would type the frame."""
+    return {col: _SQL_TYPES[kinds[col]] for col in columns}
+
+
+def load_into(
+    conn,
+    schema: str,
+    view: str,
+    table: str,
+    columns: List[str],
+    kinds: Dict[str, str],
+    indexes: Iterable[str] = (),
+) -> int:
+    """
+    Replace `table` in the attached `schema` with the rows of `view`, typed like
+    bulk_load types a frame, in one transaction. Returns the row count.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        target = f"{schema}.{quote_ident(table)}"
+        cols = ", ".join(f"{quote_ident(c)} {t}" for c, t in sql_types(columns, kinds).items())
+        conn.execute(f"DROP TABLE IF EXISTS {target}")
+        conn.execute(f"CREATE TABLE {target} ({cols})")
+        rows = conn.execute(f"INSERT INTO {target} SELECT * FROM {quote_ident(view)}").rowcount
+        for col in indexes:
+            if col in columns:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {schema}.{quote_ident(sqlite_loader.index_name(table, col))} "
+                    f"ON {quote_ident(table)} ({quote_ident(col)})"
+                )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
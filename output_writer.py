@@ -0,0 +1,184 @@
+# output_writer.py
+"""
+Writers for the per-workbook KPI output.
+
+CSV is kept for existing consumers. Parquet (with column statistics) and Feather
+keep the column types, so downstream reads need no date or number parsing and
+can select just the columns they need. With partitioning the frame is written
+as a hive-style dataset: <base>/run_id=<id>/service_month=<YYYY-MM>/...
+
+write_output_chunks() writes the same files from a stream of frames that share
+one schema (the out-of-core mode), holding one chunk at a time.
+"""
+import os
+from typing import Callable, Iterator, List
+
+import pandas as pd
+
+FORMATS = ("csv", "parquet", "feather")
+_EXTENSIONS = {"parquet": "parquet", "feather": "feather"}
+_FEATHER_CODECS = ("lz4", "zstd")
+
+
+def arrow_table(df: pd.DataFrame):
+    """
+    Convert to a pyarrow Table. Object columns mixing types (numbers and text in
+    the same Excel column is common) are written as text instead of failing.
+    """
+    import pyarrow as pa
+
+    frame = df
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowException, TypeError, ValueError):
+            if frame is df:
+                frame = df.copy(deep=False)
+            frame[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def service_months(df: pd.DataFrame, dos_col: str = "dos") -> pd.Series:
+    if dos_col in df.columns and pd.api.types.is_datetime64_any_dtype(df[dos_col]):
+        return df[dos_col].dt.strftime("%Y-%m").fillna("unknown")
+    return pd.Series("unknown", index=df.index)
+
+
+def _file_format(fmt: str, compression: str):
+    import pyarrow.dataset as ds
+
+    if fmt == "parquet":
+        file_format = ds.ParquetFileFormat()
+        return file_format, file_format.make_write_options(compression=compression, write_statistics=True)
+    file_format = ds.IpcFileFormat()
+    codec = compression if compression in _FEATHER_CODECS else None
+    return file_format, file_format.make_write_options(compression=codec)
+
+
+def write_partitioned(df: pd.DataFrame, root: str, run_id: str, fmt: str, compression: str) -> str:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    frame = df.assign(run_id=run_id, service_month=service_months(df))
+    file_format, options = _file_format(fmt, compression)
+    ds.write_dataset(
+        arrow_table(frame),
+        root,
+        format=file_format,
+        file_options=options,
+        partitioning=ds.partitioning(
+            pa.schema([("run_id", pa.string()), ("service_month", pa.string())]), flavor="hive"
+        ),
+        basename_template=f"part-{{i}}.{_EXTENSIONS[fmt]}",
+        existing_data_behavior="delete_matching",
+    )
+    return root
+
+
+def write_outputs(
+    df: pd.DataFrame,
+    out_dir: str,
+    base_name: str,
+    run_id: str,
+    formats: List[str],
+    compression: str = "zstd",
+    partitioned: bool = False,
+) -> List[str]:
+    """Write `df` in every requested format and return the paths written."""
+    paths = []
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+        if fmt == "csv":
+            path = os.path.join(out_dir, f"{base_name}.csv")
+            df.to_csv(path, index=False)
+        elif partitioned:
+            path = write_partitioned(df, os.path.join(out_dir, f"{base_name}.{fmt}.d"), run_id, fmt, compression)
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            path = os.path.join(out_dir, f"{base_name}.parquet")
+            pq.write_table(arrow_table(df), path, compression=compression, write_statistics=True)
+        else:
+            import pyarrow.feather as feather
+
+            path = os.path.join(out_dir, f"{base_name}.feather")
+            codec = compression if compression in _FEATHER_CODECS else "uncompressed"
+            feather.write_feather(arrow_table(df), path, compression=codec)
+        paths.append(path)
+    return paths
+
+
+def write_output_chunks(
+    chunks: Callable[[], Iterator[pd.DataFrame]],
+    schema,
+    out_dir: str,
+    base_name: str,
+    run_id: str,
+    formats: List[str],
+    compression: str = "zstd",
+    partitioned: bool = False,
+) -> List[str]:
+    """
+    write_outputs for a result that does not fit in memory. `chunks()` starts a
+    new pass over the frames (one per format) and yields at least one frame;
+    every frame must match the pyarrow `schema` (only needed for Parquet/Feather).
+    """
+    def batches(schema, partition_columns: bool = False):
+        import pyarrow as pa
+
+        for df in chunks():
+            if partition_columns:
+                df = df.assign(run_id=run_id, service_month=service_months(df))
+            yield from pa.Table.from_pandas(df, schema=schema, preserve_index=False).to_batches()
+
+    paths = []
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+        if fmt == "csv":
+            path = os.path.join(out_dir, f"{base_name}.csv")
+            with open(path, "w", newline="") as fh:
+                for i, df in enumerate(chunks()):
+                    df.to_csv(fh, index=False, header=i == 0)
+        elif partitioned:
+            import pyarrow as pa
+            import pyarrow.dataset as ds
+
+            path = os.path.join(out_dir, f"{base_name}.{fmt}.d")
+            full = schema.append(pa.field("run_id", pa.string())).append(pa.field("service_month", pa.string()))
+            file_format, options = _file_format(fmt, compression)
+            ds.write_dataset(
+                batches(full, partition_columns=True),
+                path,
+                schema=full,
+                format=file_format,
+                file_options=options,
+                partitioning=ds.partitioning(
+                    pa.schema([("run_id", pa.string()), ("service_month", pa.string())]), flavor="hive"
+                ),
+                basename_template=f"part-{{i}}.{_EXTENSIONS[fmt]}",
+                existing_data_behavior="delete_matching",
+            )
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            path = os.path.join(out_dir, f"{base_name}.parquet")
+            with pq.ParquetWriter(path, schema, compression=compression, write_statistics=True) as writer:
+                for batch in batches(schema):
+                    writer.write_batch(batch)
+        else:
+            import pyarrow as pa
+
+            path = os.path.join(out_dir, f"{base_name}.feather")
+            codec = compression if compression in _FEATHER_CODECS else None
+            options = pa.ipc.IpcWriteOptions(compression=codec)
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+                for batch in batches(schema):
+                    writer.write_batch(batch)
+        paths.append(path)
+    return paths
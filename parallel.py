@@ -0,0 +1,98 @@
+# parallel.py
+"""
+Process-pool helpers shared by ETL.py and final_2.py.
+
+Workers parse and transform workbooks independently, but SQLite allows a single
+writer at a time, so every database write goes through db_write_lock(). The
+lock is one multiprocessing lock per process tree: the parent creates it on
+first use and hands the same lock to every pool it opens, so the writes stay
+serialised with several pools open at once (a watcher next to API jobs).
+
+Pools start their workers with forkserver (spawn where that is unavailable),
+never fork: the API process runs threads, and a forked child would inherit
+whatever locks those threads held.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+_db_lock = None
+_db_lock_guard = threading.Lock()
+_in_worker = False
+
+
+def _init_worker(lock) -> None:
+    global _db_lock, _in_worker
+    _db_lock = lock
+    _in_worker = True
+
+
+def in_worker() -> bool:
+    """True inside a pool worker process (nested pools should stay sequential)."""
+    return _in_worker
+
+
+def shared_lock():
+    """The DB write lock of this process tree, created on first use."""
+    global _db_lock
+    with _db_lock_guard:
+        if _db_lock is None:
+            _db_lock = _MP_CONTEXT.Lock()
+        return _db_lock
+
+
+@contextmanager
+def db_write_lock():
+    with shared_lock():
+        yield
+
+
+@contextmanager
+def worker_pool(workers: int) -> Iterator[Executor]:
+    """
+    An executor for submitting work as it arrives: worker processes sharing the
+    DB write lock when workers > 1, otherwise a single background thread.
+    """
+    if workers <= 1:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="etl-worker") as pool:
+            yield pool
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=_MP_CONTEXT, initializer=_init_worker, initargs=(shared_lock(),)
+    ) as pool:
+        yield pool
+
+
+def run_in_pool(
+    func: Callable[..., Any], items: Iterable[Any], workers: int, *args
+) -> Iterator[Tuple[Any, Any, str | None]]:
+    """
+    Call func(item, *args) for every item and yield (item, result, error) as each
+    call finishes. `error` is None on success; an exception raised by func is
+    reported as its message instead of aborting the remaining items.
+    With workers <= 1 everything runs in the current process, in order.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                yield item, func(item, *args), None
+            except Exception as e:
+                yield item, None, str(e)
+        return
+
+    with worker_pool(min(workers, len(items))) as pool:
+        futures = {pool.submit(func, item, *args): item for item in items}
+        for fut in as_completed(futures):
+            item = futures[fut]
+            try:
+                yield item, fut.result(), None
+            except Exception as e:
+                yield item, None, str(e)
@@ -0,0 +1,253 @@
+# reports.py
+"""
+Report table access for the API: table/column validation, keyset pagination and
+streaming serialisers that read straight from the SQLite cursor.
+
+Pages are keyed on rowid, or on ("claim no", rowid) for claim-ordered reads, so
+fetching page N costs the same as page 1 and a full export never holds more than
+one fetchmany() batch in memory.
+
+compile_query() turns the typed filters, group-by list and aggregates of the
+query endpoint into one parameterised statement. Every column it names is
+checked against the table's own columns and quoted, and every value is bound,
+so nothing from the request is pasted into the SQL. The filter columns are the
+ones fact_table indexes at load time.
+"""
+import base64
+import csv
+import io
+import json
+import sqlite3
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from fact_table import DATE_COL, FILTER_COLUMNS, RUN_COL
+from sqlite_loader import quote_ident
+
+# Tables that are never exposed through the report endpoints
+PRIVATE_TABLES = {"users"}
+PRIVATE_PREFIXES = ("sqlite_", "etl_")
+
+CLAIM_KEY = "claim no"
+FETCH_BATCH = 5000
+
+AGGREGATES = {
+    "count": "COUNT({})",
+    "count_distinct": "COUNT(DISTINCT {})",
+    "sum": "TOTAL({})",
+    "avg": "AVG({})",
+    "min": "MIN({})",
+    "max": "MAX({})",
+}
+# group-by key derived from DATE_COL rather than stored
+SERVICE_MONTH = "service_month"
+
+
+def is_report_table(name: str) -> bool:
+    return name not in PRIVATE_TABLES and not name.startswith(PRIVATE_PREFIXES)
+
+
+def list_report_tables(conn) -> List[str]:
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
+    return [r[0] for r in rows if is_report_table(r[0])]
+
+
+def table_columns(conn, table: str) -> List[str]:
+    """Columns of a report table; raises LookupError for unknown or private tables."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    if not exists or not is_report_table(table):
+        raise LookupError(f"Unknown report table: {table}")
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+
+
+def resolve_columns(available: List[str], requested: str | None) -> List[str]:
+    """Parse a comma-separated projection and check it against the table's columns."""
+    if not requested:
+        return available
+    wanted = [c.strip() for c in requested.split(",") if c.strip()]
+    unknown = [c for c in wanted if c not in available]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+    return wanted
+
+
+def encode_cursor(key: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def page_query(
+    table: str, columns: List[str], order: str, after: str | None, limit: int | None
+) -> Tuple[str, list, int]:
+    """
+    Build the keyset query. Returns (sql, params, key_width): the first
+    `key_width` selected values form the cursor, the rest are `columns`.
+    """
+    select = ", ".join(quote_ident(c) for c in columns)
+    claim = quote_ident(CLAIM_KEY)
+    params: list = []
+    where = ""
+    keys, key_width = (f"{claim}, rowid", 2) if order == "claim" else ("rowid", 1)
+    if after:
+        key = decode_cursor(after)
+        if len(key) != key_width:
+            raise ValueError("Cursor does not match the requested order")
+        if order != "claim":
+            where = "WHERE rowid > ?"
+        elif key[0] is None:
+            # NULL claim numbers sort first, and a row-value comparison with NULL is never
+            # true: after a NULL key come the later NULL rows, then every numbered claim
+            where = f"WHERE {claim} IS NOT NULL OR rowid > ?"
+            key = key[1:]
+        else:
+            where = f"WHERE ({claim}, rowid) > (?, ?)"
+        params.extend(key)
+
+    sql = f"SELECT {keys}, {select} FROM {quote_ident(table)} {where} ORDER BY {keys}"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params, key_width
+
+
+def _require(available: List[str], column: str, what: str) -> str:
+    if column not in available:
+        raise ValueError(f"Table has no {column!r} column to {what}")
+    return quote_ident(column)
+
+
+def _filters(
+    available: List[str], filters: Dict[str, List[Any]], date_from: date | None, date_to: date | None
+) -> Tuple[List[str], list]:
+    where: List[str] = []
+    params: list = []
+    if date_from or date_to:
+        col = _require(available, DATE_COL, "filter dates on")
+        # dates are stored as "YYYY-MM-DD HH:MM:SS" text, so ISO bounds compare correctly and use the index
+        if date_from:
+            where.append(f"{col} >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append(f"{col} < ?")
+            params.append((date_to + timedelta(days=1)).isoformat())
+    columns = {RUN_COL: RUN_COL, **FILTER_COLUMNS}
+    for name, values in filters.items():
+        if name not in columns:
+            raise ValueError(f"Unknown filter {name!r}; expected one of {', '.join(columns)}")
+        if not values:
+            continue
+        col = _require(available, columns[name], "filter on")
+        where.append(f"{col} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    return where, params
+
+
+def compile_query(
+    table: str,
+    available: List[str],
+    filters: Dict[str, List[Any]],
+    date_from: date | None = None,
+    date_to: date | None = None,
+    group_by: Sequence[str] = (),
+    aggregates: Sequence[Tuple[str, str | None, str | None]] = (),
+    columns: Sequence[str] = (),
+    after: str | None = None,
+    limit: int = 1000,
+) -> Tuple[str, list, List[str], int]:
+    """
+    Build the query for the report query endpoint. `filters` maps run_id and the
+    FILTER_COLUMNS names to the values to match (any of them); `aggregates` are
+    (function, column or None for COUNT(*), output name or None) triples.
+
+    Without group_by and aggregates the filtered rows of `columns` (default all)
+    are paged on rowid like page_query. Otherwise one row per group is returned,
+    ordered by the group columns; the query asks for limit + 1 rows so the caller
+    can tell the result was cut off. Returns (sql, params, output columns,
+    key_width).
+    """
+    if (group_by or aggregates) and (columns or after):
+        raise ValueError("columns and after only apply to row queries, not to group_by/aggregates")
+    where, params = _filters(available, filters, date_from, date_to)
+    source = quote_ident(table)
+
+    if not group_by and not aggregates:
+        selected = resolve_columns(available, ",".join(columns) if columns else None)
+        if after:
+            key = decode_cursor(after)
+            if len(key) != 1:
+                raise ValueError("Cursor does not match a row query")
+            where.append("rowid > ?")
+            params.extend(key)
+        sql = f"SELECT rowid, {', '.join(quote_ident(c) for c in selected)} FROM {source}"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        params.append(limit)
+        return sql + " ORDER BY rowid LIMIT ?", params, selected, 1
+
+    keys, names = [], []
+    for col in group_by:
+        if col == SERVICE_MONTH and col not in available:
+            date_col = _require(available, DATE_COL, f"derive {SERVICE_MONTH} from")
+            keys.append(f"COALESCE(strftime('%Y-%m', {date_col}), 'unknown')")
+        else:
+            keys.append(_require(available, col, "group by"))
+        names.append(col)
+    exprs = list(keys)
+    for fn, col, alias in aggregates:
+        if fn not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {fn!r}; expected one of {', '.join(AGGREGATES)}")
+        if col is None and fn != "count":
+            raise ValueError(f"Aggregate {fn!r} needs a column")
+        arg = "*" if col is None else _require(available, col, "aggregate")
+        exprs.append(AGGREGATES[fn].format(arg))
+        names.append(alias or (fn if col is None else f"{fn}({col})"))
+    if len(set(names)) != len(names):
+        raise ValueError("Output column names must be unique; use 'as' to rename aggregates")
+
+    sql = f"SELECT {', '.join(exprs)} FROM {source}"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    if keys:
+        positions = ", ".join(str(i) for i in range(1, len(keys) + 1))
+        sql += f" GROUP BY {positions} ORDER BY {positions}"
+    params.append(limit + 1)
+    return sql + " LIMIT ?", params, names, 0
+
+
+def iter_rows(db_path: str, sql: str, params: list) -> Iterator[tuple]:
+    """Yield result rows in FETCH_BATCH batches; the connection lives as long as the generator."""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(FETCH_BATCH)
+            if not batch:
+                break
+            yield from batch
+    finally:
+        conn.close()
+
+
+def ndjson_lines(columns: List[str], rows: Iterator[tuple], key_width: int) -> Iterator[bytes]:
+    for row in rows:
+        yield (json.dumps(dict(zip(columns, row[key_width:])), default=str) + "\n").encode()
+
+
+def csv_lines(columns: List[str], rows: Iterator[tuple], key_width: int) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row[key_width:])
+        if i % 1000 == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
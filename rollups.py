@@ -0,0 +1,186 @@
+# rollups.py
+"""
+Pre-aggregated KPI rollups.
+
+Right after calculate_kpis the claims are summed by payer, provider, facility
+and financial class (each split by service month, plus an "all" total) into the
+kpi_rollups table. The input is always one row per claim (the sheets collapsed
+by aggregate_by_claim and joined), also in line join mode, where the joined rows
+repeat each sheet's amounts once per matching line of the other sheets. Only additive measures are stored; ratios such as
+GCR or the denial rate are derived from the sums at query time so they stay
+correct when months, files or runs are combined. In incremental mode a run's
+rollups cover the claims that run recomputed. "claims" is a distinct count per
+file and month, so summing it across months counts a claim once per month.
+"""
+import time
+from typing import Any, Dict, List
+
+import pandas as pd
+
+import sqlite_loader
+from kpis import match_values
+from output_writer import service_months
+from sqlite_loader import quote_ident
+
+ROLLUP_TABLE = "kpi_rollups"
+
+DIMENSIONS = {
+    "payer": "Payer/Insurance",
+    "provider": "Provider Name",
+    "facility": "Facility Name",
+    "financial_class": "Financial Class",
+    "all": None,
+}
+
+MEASURES = {
+    "billed": "Billed Amount",
+    "paid": "Paid Amount",
+    "adjustment": "Adjustment Amount",
+    "ar_balance": "AR Balance",
+    "ar_90_plus": "90+ AR Days (%)",
+}
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series | None:
+    if name not in df.columns:
+        return None
+    col = df[name]
+    return col.iloc[:, 0] if isinstance(col, pd.DataFrame) else col
+
+
+def build_rollups(df: pd.DataFrame, run_id: str, file_name: str) -> pd.DataFrame:
+    """Sum the KPI measures of a merged frame (original column names) per dimension value and month."""
+    base = pd.DataFrame(index=df.index)
+    for measure, col_name in MEASURES.items():
+        col = _column(df, col_name)
+        base[measure] = 0.0 if col is None else pd.to_numeric(col, errors="coerce").fillna(0)
+    status = _column(df, "Financial Status")
+    base["denied"] = 0 if status is None else match_values(status, lambda v: "denied" in v.lower()).astype(int)
+    base["rows"] = 1
+    claims = _column(df, "Claim No")
+    base["claim"] = claims if claims is not None else pd.Series(range(len(df)), index=df.index)
+    base["service_month"] = service_months(df, "DOS")
+
+    aggs = {m: "sum" for m in [*MEASURES, "denied", "rows"]}
+    aggs["claim"] = "nunique"
+
+    frames = []
+    for dimension, col_name in DIMENSIONS.items():
+        col = _column(df, col_name) if col_name else None
+        if col_name and col is None:
+            continue
+        keys = base["service_month"] if col is None else [col.rename("dimension_value"), base["service_month"]]
+        grouped = base.groupby(keys, dropna=False, observed=True, sort=False).agg(aggs).reset_index()
+        if col is None:
+            grouped.insert(0, "dimension_value", "All")
+        grouped["dimension_value"] = grouped["dimension_value"].astype(object).where(
+            grouped["dimension_value"].notna(), "Unknown"
+        ).astype(str)
+        grouped.insert(0, "dimension", dimension)
+        frames.append(grouped)
+
+    out = pd.concat(frames, ignore_index=True).rename(columns={"claim": "claims"})
+    out.insert(0, "file", file_name)
+    out.insert(0, "run_id", run_id)
+    return out
+
+
+def build_rollups_sql(
+    conn, table: str, columns: Dict[str, str], dos_is_date: bool, run_id: str, file_name: str
+) -> pd.DataFrame:
+    """
+    build_rollups over a SQLite table or view instead of a frame. `columns` gives
+    the table's column for each original column name present; the amounts are
+    expected to be coerced already.
+    """
+    def col(name: str | None) -> str | None:
+        return quote_ident(columns[name]) if name in columns else None
+
+    measures = [
+        f"TOTAL(COALESCE(CAST({col(name)} AS REAL), 0.0))" if col(name) else "0.0"
+        for name in MEASURES.values()
+    ]
+    status = col("Financial Status")
+    denied = f"SUM(COALESCE(instr(lower(CAST({status} AS TEXT)), 'denied') > 0, 0))" if status else "0"
+    claims = f"COUNT(DISTINCT {col('Claim No')})" if col("Claim No") else "COUNT(*)"
+    month = "'unknown'"
+    if dos_is_date and col("DOS"):
+        month = f"COALESCE(strftime('%Y-%m', {col('DOS')}), 'unknown')"
+    aggs = ", ".join([*measures, denied, "COUNT(*)", claims])
+
+    rows = []
+    for dimension, col_name in DIMENSIONS.items():
+        if col_name and not col(col_name):
+            continue
+        value = f"COALESCE(CAST({col(col_name)} AS TEXT), 'Unknown')" if col_name else "'All'"
+        sql = f"""
+            SELECT ?, ?, ?, {value} AS dimension_value, {month} AS service_month, {aggs}
+            FROM {quote_ident(table)}
+            GROUP BY dimension_value, service_month
+        """
+        rows.extend(conn.execute(sql, (run_id, file_name, dimension)).fetchall())
+
+    names = ["run_id", "file", "dimension", "dimension_value", "service_month"]
+    return pd.DataFrame.from_records(rows, columns=[*names, *MEASURES, "denied", "rows", "claims"])
+
+
+def store_rollups(conn, rollups: pd.DataFrame, run_id: str, file_name: str) -> Dict[str, Any]:
+    """Replace this file's rollup rows for `run_id` in one transaction."""
+    start = time.time()
+    sqlite_loader.tune_connection(conn)
+    with sqlite_loader.transaction(conn):
+        if sqlite_loader.table_columns(conn, ROLLUP_TABLE):
+            conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE run_id=? AND file=?", (run_id, file_name))
+        sqlite_loader.load_rows(conn, rollups, ROLLUP_TABLE, if_exists="append")
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{ROLLUP_TABLE}_lookup "
+            f"ON {ROLLUP_TABLE} (dimension, run_id, service_month)"
+        )
+    return sqlite_loader.load_stats(ROLLUP_TABLE, len(rollups), time.time() - start)
+
+
+def latest_run_id(conn) -> str | None:
+    if not sqlite_loader.table_columns(conn, ROLLUP_TABLE):
+        return None
+    row = conn.execute(f"SELECT MAX(run_id) FROM {ROLLUP_TABLE}").fetchone()
+    return row[0] if row else None
+
+
+def summary_query(
+    dimension: str,
+    run_id: str,
+    value: str | None = None,
+    month_from: str | None = None,
+    month_to: str | None = None,
+    by_month: bool = True,
+) -> tuple[str, List[Any]]:
+    """Parameterised SQL that re-aggregates the rollups and derives the ratio KPIs."""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension {dimension!r}; expected one of {', '.join(DIMENSIONS)}")
+
+    where = ["dimension = ?", "run_id = ?"]
+    params: List[Any] = [dimension, run_id]
+    if value is not None:
+        where.append("dimension_value = ?")
+        params.append(value)
+    if month_from:
+        where.append("service_month >= ?")
+        params.append(month_from)
+    if month_to:
+        where.append("service_month <= ?")
+        params.append(month_to)
+
+    group = ["dimension_value"] + (["service_month"] if by_month else [])
+    sums = ", ".join(f"SUM({quote_ident(m)}) AS {m}" for m in [*MEASURES, "denied", "rows", "claims"])
+    sql = f"""
+        SELECT {', '.join(group)}, {sums},
+            ROUND(100.0 * SUM(paid) / NULLIF(SUM(billed), 0), 2) AS gcr_pct,
+            ROUND(100.0 * SUM(paid) / NULLIF(SUM(billed) - SUM(adjustment), 0), 2) AS ncr_pct,
+            ROUND(100.0 * SUM(denied) / NULLIF(SUM(rows), 0), 2) AS denial_rate_pct,
+            ROUND(100.0 * SUM(ar_90_plus) / NULLIF(SUM(ar_balance), 0), 2) AS ar_90_plus_pct
+        FROM {ROLLUP_TABLE}
+        WHERE {' AND '.join(where)}
+        GROUP BY {', '.join(group)}
+        ORDER BY {', '.join(group)}
+    """
+    return sql, params
@@ -0,0 +1,190 @@
+# run_registry.py
+"""
+Run registry.
+
+Every ETL run gets a row in etl_runs and every file it touched a row in
+etl_run_files (status, rows, bytes in/out, per-stage timings, error text). The
+stats and history endpoints read these two indexed tables instead of scanning
+sqlite_master, so they cost the same however many per-run tables exist.
+"""
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+# File statuses; "skipped" is an incremental-mode file that was already loaded
+SUCCEEDED, FAILED, SKIPPED = "succeeded", "failed", "skipped"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def ensure_tables(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_runs (
+            run_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL CHECK (status IN ('running','succeeded','partial','failed')),
+            source TEXT,
+            total_files INTEGER NOT NULL DEFAULT 0,
+            files_processed INTEGER NOT NULL DEFAULT 0,
+            files_failed INTEGER NOT NULL DEFAULT 0,
+            rows INTEGER NOT NULL DEFAULT 0,
+            bytes_in INTEGER NOT NULL DEFAULT 0,
+            bytes_out INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            elapsed REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_run_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('succeeded','failed','skipped')),
+            rows INTEGER NOT NULL DEFAULT 0,
+            bytes_in INTEGER,
+            bytes_out INTEGER,
+            stages TEXT,
+            failed_stage TEXT,
+            error TEXT,
+            elapsed REAL,
+            finished_at TEXT NOT NULL,
+            UNIQUE (run_id, file_name)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_etl_run_files_latest ON etl_run_files (file_name, id, status)")
+    conn.commit()
+
+
+def path_bytes(paths: Iterable[str]) -> int:
+    """Total size of the given files; directories (partitioned datasets) are walked."""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def start_run(conn, run_id: str, total_files: int, source: str | None = None) -> None:
+    """Open a run; calling it again for the same run_id adds `total_files` to it."""
+    ensure_tables(conn)
+    conn.execute(
+        """
+        INSERT INTO etl_runs (run_id, status, source, total_files, started_at) VALUES (?, 'running', ?, ?, ?)
+        ON CONFLICT(run_id) DO UPDATE SET
+            status='running', total_files=total_files + excluded.total_files, finished_at=NULL
+        """,
+        (run_id, source, total_files, _now()),
+    )
+    conn.commit()
+
+
+def record_file(conn, run_id: str, file_name: str, result: Dict[str, Any]) -> None:
+    """Store the outcome of one file (a process_single_file result dict)."""
+    ensure_tables(conn)
+    if not result.get("success"):
+        status = FAILED
+    else:
+        status = SKIPPED if result.get("skipped") else SUCCEEDED
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO etl_run_files
+            (run_id, file_name, status, rows, bytes_in, bytes_out, stages, failed_stage, error, elapsed, finished_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            run_id,
+            file_name,
+            status,
+            result.get("rows") or 0,
+            result.get("bytes_in"),
+            result.get("bytes_out"),
+            json.dumps(result["stages"]) if result.get("stages") else None,
+            result.get("failed_stage"),
+            result.get("error"),
+            result.get("elapsed"),
+            _now(),
+        ),
+    )
+    conn.commit()
+
+
+def finish_run(conn, run_id: str, elapsed: float) -> None:
+    """Close a run, rolling its file rows up into the etl_runs totals."""
+    ensure_tables(conn)
+    conn.execute(
+        """
+        UPDATE etl_runs SET
+            files_processed = t.processed,
+            files_failed = t.failed,
+            rows = t.rows,
+            bytes_in = t.bytes_in,
+            bytes_out = t.bytes_out,
+            status = CASE
+                WHEN t.failed = 0 THEN 'succeeded'
+                WHEN t.processed = 0 THEN 'failed'
+                ELSE 'partial'
+            END,
+            finished_at = ?,
+            elapsed = COALESCE(etl_runs.elapsed, 0) + ?
+        FROM (
+            SELECT
+                COALESCE(SUM(status != 'failed'), 0) AS processed,
+                COALESCE(SUM(status = 'failed'), 0) AS failed,
+                COALESCE(SUM(rows), 0) AS rows,
+                COALESCE(SUM(bytes_in), 0) AS bytes_in,
+                COALESCE(SUM(bytes_out), 0) AS bytes_out
+            FROM etl_run_files WHERE run_id = ?
+        ) AS t
+        WHERE etl_runs.run_id = ?
+        """,
+        (_now(), round(elapsed, 2), run_id, run_id),
+    )
+    conn.commit()
+
+
+def file_totals(conn) -> Dict[str, Any]:
+    """Distinct files whose latest attempt succeeded (or was skipped) / failed, and the last run."""
+    ensure_tables(conn)
+    # bare columns next to MAX(id) come from the latest row of each file
+    processed, failed = conn.execute("""
+        SELECT COALESCE(SUM(status != 'failed'), 0), COALESCE(SUM(status = 'failed'), 0)
+        FROM (SELECT status, MAX(id) FROM etl_run_files GROUP BY file_name)
+    """).fetchone()
+    last = conn.execute("SELECT run_id FROM etl_runs ORDER BY run_id DESC LIMIT 1").fetchone()
+    return {"processed_files": processed, "failed_files": failed, "last_run_id": last[0] if last else None}
+
+
+def _rows(cur) -> List[Dict[str, Any]]:
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def list_runs(conn, limit: int = 50, before: str | None = None) -> List[Dict[str, Any]]:
+    """Newest runs first; pass the last run_id of a page as `before` for the next one."""
+    ensure_tables(conn)
+    if before:
+        cur = conn.execute(
+            "SELECT * FROM etl_runs WHERE run_id < ? ORDER BY run_id DESC LIMIT ?", (before, limit)
+        )
+    else:
+        cur = conn.execute("SELECT * FROM etl_runs ORDER BY run_id DESC LIMIT ?", (limit,))
+    return _rows(cur)
+
+
+def get_run(conn, run_id: str) -> Dict[str, Any] | None:
+    """A run with its per-file rows, or None if the run is unknown."""
+    ensure_tables(conn)
+    runs = _rows(conn.execute("SELECT * FROM etl_runs WHERE run_id = ?", (run_id,)))
+    if not runs:
+        return None
+    run = runs[0]
+    run["files"] = _rows(conn.execute("SELECT * FROM etl_run_files WHERE run_id = ? ORDER BY id", (run_id,)))
+    for f in run["files"]:
+        f["stages"] = json.loads(f["stages"]) if f["stages"] else None
+    return run
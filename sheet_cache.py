@@ -0,0 +1,188 @@
+# sheet_cache.py
+"""
+Content-addressed cache of parsed sheets.
+
+Entries are keyed by the workbook's SHA-256, the sheet name and a digest of the
+header mapping and matcher used to normalise it, and hold the sheet *after* header
+normalisation and date coercion as Parquet. A projected read (only some
+columns parsed) adds its column set to the key. A rerun on an unchanged workbook
+(e.g. after a failed merge or a KPI change) then costs a columnar read instead
+of an Excel parse. pyarrow is optional: without it every call is a miss.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List
+
+import pandas as pd
+
+from logger import get_logger
+
+logger = get_logger()
+
+_COLUMNS_KEY = b"etl_columns"
+
+# Part of every entry key; bump it when parsing changes what an entry holds
+# (2: date columns coerced by dates.coerce_frame, 3: compact dtypes from compact.py,
+# 4: headers assigned one-to-one and matched case-insensitively)
+FORMAT_VERSION = 4
+
+
+def file_digest(file_path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _entry_path(
+    cache_dir: str,
+    digest: str,
+    sheet: str,
+    mapping: Dict[str, str],
+    projection: List[str] | None = None,
+    matcher: str = "",
+) -> str:
+    parts = [FORMAT_VERSION, sheet, sorted(mapping.items()), matcher]
+    if projection is not None:
+        parts.append(projection)
+    key = json.dumps(parts, ensure_ascii=False)
+    return os.path.join(cache_dir, f"{digest}_{hashlib.sha1(key.encode()).hexdigest()[:16]}.parquet")
+
+
+def _index_path(cache_dir: str, digest: str) -> str:
+    return os.path.join(cache_dir, f"{digest}.sheets.json")
+
+
+def _touch(path: str) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def load_sheet_names(cache_dir: str, digest: str) -> List[str] | None:
+    path = _index_path(cache_dir, digest)
+    try:
+        with open(path, encoding="utf-8") as fh:
+            names = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    _touch(path)
+    return names
+
+
+def store_sheet_names(cache_dir: str, digest: str, names: List[str]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _index_path(cache_dir, digest)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(names, fh, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load(
+    cache_dir: str,
+    digest: str,
+    sheet: str,
+    mapping: Dict[str, str],
+    projection: List[str] | None = None,
+    matcher: str = "",
+) -> pd.DataFrame | None:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+
+    path = _entry_path(cache_dir, digest, sheet, mapping, projection, matcher)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pq.read_table(path)
+        df = table.to_pandas()
+        columns = (table.schema.metadata or {}).get(_COLUMNS_KEY)
+        if columns:
+            df.columns = json.loads(columns)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+    _touch(path)
+    return df
+
+
+def store(
+    cache_dir: str,
+    digest: str,
+    sheet: str,
+    mapping: Dict[str, str],
+    df: pd.DataFrame,
+    projection: List[str] | None = None,
+    matcher: str = "",
+) -> bool:
+    """
+    Write one sheet to the cache. Returns False (and caches nothing) when pyarrow
+    is missing or the frame cannot be represented in Parquet, e.g. an object
+    column mixing numbers and text.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return False
+
+    # Parquet needs unique string column names; the originals go in the metadata.
+    original = [str(c) for c in df.columns]
+    frame = df.copy(deep=False)
+    frame.columns = [f"c{i}" for i in range(len(original))]
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowException, ValueError, TypeError) as e:
+        logger.info(f"Not caching sheet {sheet!r}: {e}")
+        return False
+    metadata = dict(table.schema.metadata or {})
+    metadata[_COLUMNS_KEY] = json.dumps(original, ensure_ascii=False).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, digest, sheet, mapping, projection, matcher)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+    return True
+
+
+def evict(cache_dir: str, max_bytes: int, max_age_days: float) -> int:
+    """
+    Drop entries not used for `max_age_days`, then the least recently used ones
+    until the cache fits in `max_bytes`. Returns the number of files removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    cutoff = time.time() - max_age_days * 86400
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    if removed:
+        logger.info(f"Evicted {removed} sheet cache file(s) from {cache_dir}")
+    return removed
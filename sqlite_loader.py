@@ -0,0 +1,192 @@
+# sqlite_loader.py
+"""
+Bulk loader for SQLite.
+
+DataFrame.to_sql creates an untyped-ish table and inserts through SQLAlchemy-style
+row dicts under SQLite's default rollback journal. bulk_load instead creates a
+typed table up front, inserts with chunked executemany inside one transaction
+on a WAL-mode connection and builds indexes only after the rows are in.
+Values are stored the way to_sql stores them (timestamps as
+"YYYY-MM-DD HH:MM:SS" text, missing values as NULL), so readers see no change.
+"""
+import itertools
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List
+
+import pandas as pd
+
+from logger import get_logger
+
+logger = get_logger()
+
+_CACHE_SIZE_KIB = 64 * 1024
+_savepoints = itertools.count()
+
+
+def quote_ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def tune_connection(conn) -> None:
+    """
+    WAL journaling with relaxed fsyncs and a bigger page cache; safe for ETL loads.
+    Skipped inside a transaction the caller opened, where the journal mode can't change.
+    """
+    if conn.in_transaction:
+        return
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{_CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def sqlite_type(series: pd.Series) -> str:
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def column_values(series: pd.Series) -> List[Any]:
+    missing = series.isna().to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy(dtype=object)
+    elif pd.api.types.is_timedelta64_dtype(series.dtype):
+        values = series.astype(str).to_numpy(dtype=object)
+    else:
+        values = series.to_numpy(dtype=object)
+    if missing.any():
+        values = values.copy()
+        values[missing] = None
+    return values.tolist()
+
+
+@contextmanager
+def transaction(conn) -> Iterator[None]:
+    """
+    Make the statements of the block atomic. On its own this is BEGIN IMMEDIATE
+    ... COMMIT. Inside a transaction the caller opened it is a SAVEPOINT: a failure
+    rolls back only the block, and the caller's pending statements are neither
+    committed nor dropped; committing them stays up to the caller.
+    """
+    if conn.in_transaction:
+        name = f"load_{next(_savepoints)}"
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        conn.execute(f"RELEASE {name}")
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def table_columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+
+
+def index_name(table: str, column: str) -> str:
+    return "ix_" + re.sub(r"\W+", "_", f"{table}_{column}").strip("_").lower()
+
+
+def create_indexes(conn, table: str, columns: Iterable[str]) -> None:
+    existing = set(table_columns(conn, table))
+    for col in columns:
+        if col in existing:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote_ident(index_name(table, col))} "
+                f"ON {quote_ident(table)} ({quote_ident(col)})"
+            )
+
+
+def _prepare_table(conn, df: pd.DataFrame, table: str, if_exists: str) -> None:
+    if if_exists == "replace":
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+
+    existing = table_columns(conn, table)
+    if not existing:
+        cols = ", ".join(f"{quote_ident(c)} {sqlite_type(df[c])}" for c in df.columns)
+        conn.execute(f"CREATE TABLE {quote_ident(table)} ({cols})")
+        return
+    if if_exists == "fail":
+        raise ValueError(f"Table {table} already exists")
+
+    # append: widen the table with any new columns (older rows read as NULL)
+    for col in df.columns:
+        if col not in existing:
+            conn.execute(f"ALTER TABLE {quote_ident(table)} ADD COLUMN {quote_ident(col)} {sqlite_type(df[col])}")
+
+
+def load_rows(
+    conn,
+    df: pd.DataFrame,
+    table: str,
+    if_exists: str = "replace",
+    indexes: Iterable[str] = (),
+    chunk_size: int = 50_000,
+) -> None:
+    """
+    Create/extend `table` and insert `df` without any transaction handling, for
+    callers that combine the load with other statements in their own transaction.
+    """
+    if df.columns.has_duplicates:
+        raise ValueError(f"Duplicate column names in frame for {table}")
+
+    columns = list(df.columns)
+    insert_sql = (
+        f"INSERT INTO {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})"
+    )
+    _prepare_table(conn, df, table, if_exists)
+    for lo in range(0, len(df), chunk_size):
+        chunk = df.iloc[lo:lo + chunk_size]
+        conn.executemany(insert_sql, zip(*(column_values(chunk[c]) for c in columns)))
+    create_indexes(conn, table, indexes)
+
+
+def load_stats(table: str, rows: int, elapsed: float) -> Dict[str, Any]:
+    stats = {
+        "table": table,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed) if elapsed > 0 else None,
+    }
+    logger.info(f"Loaded {rows:,} rows into {table} in {elapsed:.2f}s ({stats['rows_per_sec'] or 0:,} rows/s)")
+    return stats
+
+
+def bulk_load(
+    conn,
+    df: pd.DataFrame,
+    table: str,
+    if_exists: str = "replace",
+    indexes: Iterable[str] = (),
+    chunk_size: int = 50_000,
+) -> Dict[str, Any]:
+    """
+    Load `df` into `table` in a single transaction (a savepoint of the caller's
+    open one, see transaction()) and return load statistics.
+    `if_exists` is "replace", "append" or "fail", as in DataFrame.to_sql.
+    Column names must be unique.
+    """
+    start = time.time()
+    tune_connection(conn)
+    with transaction(conn):
+        load_rows(conn, df, table, if_exists, indexes, chunk_size)
+    return load_stats(table, len(df), time.time() - start)
@@ -0,0 +1,314 @@
+# synth_workbook.py
+"""
+Synthetic claims workbooks for benchmarks and local runs.
+
+    python synth_workbook.py input/synthetic.xlsx --rows 100000
+
+Writes the four sheets the pipeline needs (plus a "Visits" sheet it must
+ignore) with:
+  * source headers drawn from spelling variants of the sheet_mappings keys
+    that header resolution is expected to match, optionally mixed with
+    near-misses it is not (--near-miss),
+  * the extra export columns of the practice-management system (see the
+    `text` file) filled with plausible values,
+  * claims fanning out over several charge, payment, adjustment and AR lines,
+  * aging buckets derived from the date of service and a configurable share
+    of denied receivables.
+
+`rows` is the total number of data rows over the four sheets; no sheet may
+exceed Excel's 1,048,575 data rows, which puts the ceiling near 2.5M.
+"""
+import argparse
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+EXCEL_MAX_ROWS = 1_048_575
+
+PAYERS = ["Medicare", "Medicaid", "Aetna", "BCBS", "Cigna", "UnitedHealthcare", "Humana", "Self Pay"]
+PROVIDERS = [f"Dr. {name}" for name in ["Patel", "Nguyen", "Garcia", "Smith", "Khan", "Lee", "Brown", "Rossi"]]
+FACILITIES = ["Main Campus", "North Clinic", "South Clinic", "Surgery Center", "Imaging"]
+FINANCIAL_CLASSES = ["COM", "MCR", "MCD", "SP", "WC"]
+AGING_BUCKETS = [(30, "0-30"), (60, "31-60"), (90, "61-90"), (120, "91-120"), (None, "120+")]
+OPEN_STATUSES = ["Open", "Pending", "Appeal", "In Process"]
+DENIED_STATUSES = ["Denied", "Pending - Denied"]
+
+# Share of the `rows` budget per sheet, and expected lines per claim relative to the charge fan-out
+SHEET_SHARES = {"Charges": 0.4, "Payment": 0.3, "Adjustment": 0.1, "Pending AR": 0.2}
+
+# Spellings of the sheet_mappings keys that fuzzy header matching resolves (score >= 85)
+HEADER_VARIANTS = {
+    "Account Num": ["Account Num", "Account Number", "Account No"],
+    "Svc Date": ["Svc Date", "Svc  Date", "Date Svc", "Svc Dt"],
+    "Batch Date": ["Batch Date", "Batch Dt", "Batch Date "],
+    "Reg Date": ["Reg Date", "Reg Dt", "Date Reg"],
+    "Amount": ["Amount", "Amount "],
+    "Responsible Provider": ["Responsible Provider", "Provider Responsible"],
+    "Insurance": ["Insurance", "Insurance "],
+    "Group": ["Group", "Group "],
+    "FC": ["FC", "FC "],
+    "Description": ["Description", "Description "],
+    "Aging Bucket": ["Aging Bucket", "Aging Buckets", "Aging  Bucket"],
+    "Rcvbl Status": ["Rcvbl Status", "Rcvbl Stat", "Status Rcvbl"],
+}
+
+# Real-world spellings that fall below the fuzzy cutoff (case alone never does:
+# header_match compares casefolded headers)
+NEAR_MISS_VARIANTS = {
+    "Account Num": ["Acct Num", "Acct #", "Patient Account"],
+    "Svc Date": ["Service Date", "Date of Service"],
+    "Amount": ["Amt", "Charge Amt"],
+    "Responsible Provider": ["Resp Provider", "Performing Provider"],
+    "Insurance": ["Insurance Name", "Payer"],
+    "Rcvbl Status": ["Receivable Status"],
+}
+
+# Export columns that do not feed a KPI, per sheet (from the `text` header dump)
+EXTRA_COLUMNS = {
+    "Charges": [
+        "Charge Count", "CPT/Product", "Bill Link", "Bill ID", "Activity Type", "Business Unit",
+        "CPT/Product Description", "Patient MRN", "Posted Date", "Practice Location",
+        "Transaction Date", "Supervising Provider", "Location", "Coverage Type",
+    ],
+    "Payment": [
+        "Bill ID", "Batch Type", "Payment Channel", "Payment Method", "Practice Location",
+        "Posted Date", "Business Unit", "Location", "Supervising Provider", "CPT/Product",
+    ],
+    "Adjustment": [
+        "Bill ID", "CPT/Product", "Financial Category", "Patient MRN", "Patient Name",
+        "Posted Date", "Transaction Date", "Business Unit", "UID",
+    ],
+    "Pending AR": ["Bill ID", "Patient MRN", "Patient Name", "Business Unit", "Coverage Type"],
+}
+
+CPT_CODES = ["99213", "99214", "99203", "93000", "80053", "85025", "71046", "36415", "J3420", "G0439"]
+
+
+def _extra_values(name: str, n: int, dates: pd.Series, rng: np.random.Generator) -> Any:
+    if name.endswith("Date"):
+        return dates + pd.to_timedelta(rng.integers(0, 5, n), unit="D")
+    if name in ("Bill ID", "UID", "Bill Link"):
+        return rng.integers(10_000_000, 99_999_999, n)
+    if name == "Patient MRN":
+        return np.char.add("MRN", rng.integers(100_000, 999_999, n).astype(str))
+    if name == "Patient Name":
+        first = rng.choice(["Ana", "Ben", "Chen", "Dia", "Eli", "Fay", "Gus", "Hana"], n)
+        last = rng.choice(["Adams", "Baker", "Clark", "Diaz", "Evans", "Ford", "Gray", "Hill"], n)
+        return np.char.add(np.char.add(last, ", "), first)
+    if name.startswith("CPT/Product"):
+        codes = rng.choice(CPT_CODES, n)
+        return np.char.add(codes, " - procedure") if name.endswith("Description") else codes
+    if name == "Charge Count":
+        return rng.integers(1, 4, n)
+    if name in ("Supervising Provider",):
+        return rng.choice(PROVIDERS, n)
+    if name in ("Practice Location", "Location"):
+        return rng.choice(FACILITIES, n)
+    choices = {
+        "Batch Type": ["ERA", "Manual", "Lockbox"],
+        "Payment Channel": ["Insurance", "Patient", "Portal"],
+        "Payment Method": ["EFT", "Check", "Card"],
+        "Activity Type": ["Charge", "Void", "Rebill"],
+        "Coverage Type": ["Primary", "Secondary", "Tertiary"],
+        "Financial Category": ["Contractual", "Write-off", "Refund"],
+        "Business Unit": ["Physician", "Hospital", "Lab"],
+    }
+    return rng.choice(choices.get(name, ["A", "B", "C"]), n)
+
+
+def _aging_bucket(days: np.ndarray) -> np.ndarray:
+    out = np.full(days.shape, AGING_BUCKETS[-1][1], dtype=object)
+    for upper, label in reversed(AGING_BUCKETS[:-1]):
+        out[days <= upper] = label
+    return out
+
+
+def claim_frames(
+    rows: int,
+    seed: int = 0,
+    fanout: float = 3.0,
+    denial_rate: float = 0.12,
+    start: str = "2025-05-01",
+    months: int = 3,
+    extra_columns: bool = True,
+) -> Dict[str, pd.DataFrame]:
+    """The four source sheets with the canonical sheet_mappings headers."""
+    rng = np.random.default_rng(seed)
+    claims_n = max(1, int(rows * SHEET_SHARES["Charges"] / fanout))
+    first_dos = pd.Timestamp(start)
+    last_dos = first_dos + pd.DateOffset(months=months) - pd.Timedelta(days=1)
+    as_of = last_dos + pd.Timedelta(days=15)
+
+    claim_no = rng.choice(np.arange(1_000_000, 1_000_000 + claims_n * 10), claims_n, replace=False)
+    claims = pd.DataFrame({
+        "Account Num": claim_no,
+        "Svc Date": first_dos + pd.to_timedelta(rng.integers(0, (last_dos - first_dos).days + 1, claims_n), unit="D"),
+        "Insurance": rng.choice(PAYERS, claims_n, p=[0.25, 0.15, 0.12, 0.14, 0.1, 0.12, 0.07, 0.05]),
+        "Responsible Provider": rng.choice(PROVIDERS, claims_n),
+        "Group": rng.choice(FACILITIES, claims_n),
+        "FC": rng.choice(FINANCIAL_CLASSES, claims_n),
+        "claim_billed": rng.gamma(2.0, 150.0, claims_n),
+        "denied": rng.random(claims_n) < denial_rate,
+    })
+
+    def lines(key: str) -> pd.DataFrame:
+        # lines per claim so that every sheet lands near its share of `rows`
+        mean = fanout * SHEET_SHARES[key] / SHEET_SHARES["Charges"]
+        counts = rng.poisson(mean, claims_n)
+        if key == "Charges":
+            counts = 1 + rng.poisson(max(mean - 1, 0), claims_n)
+        picked = claims.loc[np.repeat(np.arange(claims_n), counts)].reset_index(drop=True)
+        if len(picked) > EXCEL_MAX_ROWS:
+            raise ValueError(f"{key} would have {len(picked):,} rows; Excel allows {EXCEL_MAX_ROWS:,}")
+        return picked
+
+    charges = lines("Charges")
+    n = len(charges)
+    charges["Batch Date"] = charges["Svc Date"] + pd.to_timedelta(rng.integers(0, 10, n), unit="D")
+    charges["Amount"] = (charges["claim_billed"] * rng.uniform(0.2, 0.6, n)).round(2)
+
+    payment = lines("Payment")
+    n = len(payment)
+    paid_share = np.where(payment["denied"], 0.0, rng.uniform(0.2, 0.7, n))
+    payment["Batch Date"] = (
+        payment["Svc Date"] + pd.to_timedelta(rng.integers(14, 90, n), unit="D")
+    ).dt.strftime("%m/%d/%Y")  # payment exports carry text dates
+    payment["Amount"] = (payment["claim_billed"] * paid_share / max(fanout, 1)).round(2)
+
+    adjustment = lines("Adjustment")
+    n = len(adjustment)
+    adjustment["Batch Date"] = adjustment["Svc Date"] + pd.to_timedelta(rng.integers(20, 120, n), unit="D")
+    adjustment["Amount"] = (adjustment["claim_billed"] * rng.uniform(0.05, 0.4, n)).round(2)
+    adjustment["Description"] = rng.choice(["Contractual WO", "Small Balance WO", "Timely Filing", "Refund"], n)
+
+    ar = lines("Pending AR")
+    n = len(ar)
+    ar["Reg Date"] = ar["Svc Date"] + pd.to_timedelta(rng.integers(0, 10, n), unit="D")
+    ar["Amount"] = (ar["claim_billed"] * rng.uniform(0.05, 0.6, n) / max(fanout, 1)).round(2)
+    ar["Aging Bucket"] = _aging_bucket((as_of - ar["Svc Date"]).dt.days.to_numpy())
+    ar["Rcvbl Status"] = np.where(ar["denied"], rng.choice(DENIED_STATUSES, n), rng.choice(OPEN_STATUSES, n))
+    ar = ar.drop(columns=["Svc Date"])
+
+    frames = {"Charges": charges, "Payment": payment, "Adjustment": adjustment, "Pending AR": ar}
+    for key, df in frames.items():
+        df.drop(columns=["claim_billed", "denied"], inplace=True)
+        if extra_columns:
+            dates = df["Reg Date"] if "Reg Date" in df else df["Svc Date"]
+            for name in EXTRA_COLUMNS[key]:
+                if name not in df.columns:
+                    df[name] = _extra_values(name, len(df), dates, rng)
+    return frames
+
+
+def vary_headers(columns: List[str], rng: np.random.Generator, near_miss: float = 0.0) -> List[str]:
+    """Swap canonical headers for spelling variants; `near_miss` is the share that misses the cutoff."""
+    out = []
+    for col in columns:
+        variants = HEADER_VARIANTS.get(col)
+        if variants is None:
+            out.append(col)
+        elif col in NEAR_MISS_VARIANTS and rng.random() < near_miss:
+            out.append(str(rng.choice(NEAR_MISS_VARIANTS[col])))
+        else:
+            out.append(str(rng.choice(variants)))
+    return out
+
+
+def _cells(df: pd.DataFrame):
+    columns = []
+    for _, col in df.items():
+        if pd.api.types.is_datetime64_any_dtype(col):
+            values = [None if pd.isna(v) else v for v in col.dt.to_pydatetime()]
+        else:
+            values = col.astype(object).where(col.notna(), None).tolist()
+        columns.append(values)
+    return zip(*columns)
+
+
+def write_workbook(path: str, sheets: Dict[str, pd.DataFrame]) -> None:
+    """Stream the sheets to .xlsx (xlsxwriter's constant-memory mode when installed, else openpyxl)."""
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        wb = xlsxwriter.Workbook(path, {"constant_memory": True, "default_date_format": "mm/dd/yyyy"})
+        for name, df in sheets.items():
+            ws = wb.add_worksheet(name)
+            ws.write_row(0, 0, list(df.columns))
+            for r, row in enumerate(_cells(df), 1):
+                ws.write_row(r, 0, row)
+        wb.close()
+        return
+
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for name, df in sheets.items():
+        ws = wb.create_sheet(name)
+        ws.append(list(df.columns))
+        for row in _cells(df):
+            ws.append(row)
+    wb.save(path)
+
+
+def generate(
+    path: str,
+    rows: int = 10_000,
+    seed: int = 0,
+    fanout: float = 3.0,
+    denial_rate: float = 0.12,
+    start: str = "2025-05-01",
+    months: int = 3,
+    near_miss: float = 0.0,
+    extra_columns: bool = True,
+) -> Dict[str, Any]:
+    """Write a synthetic workbook to `path` and return a summary of what it holds."""
+    frames = claim_frames(rows, seed, fanout, denial_rate, start, months, extra_columns)
+    rng = np.random.default_rng(seed + 1)
+    label = pd.Timestamp(start).strftime("%b'%y")
+
+    sheets = {"Visits": pd.DataFrame({"Visit ID": np.arange(1, 101), "Status": "Checked Out"})}
+    for key, df in frames.items():
+        sheets[f"{key} {label}"] = df.set_axis(vary_headers(list(df.columns), rng, near_miss), axis=1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_workbook(path, sheets)
+    return {
+        "path": path,
+        "rows": {key: len(df) for key, df in frames.items()},
+        "claims": int(frames["Charges"]["Account Num"].nunique()),
+        "bytes": os.path.getsize(path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic claims workbook")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=10_000, help="data rows over the four sheets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fanout", type=float, default=3.0, help="mean charge lines per claim")
+    parser.add_argument("--denial-rate", type=float, default=0.12)
+    parser.add_argument("--start", default="2025-05-01", help="first date of service")
+    parser.add_argument("--months", type=int, default=3)
+    parser.add_argument("--near-miss", type=float, default=0.0, help="share of headers below the fuzzy cutoff")
+    parser.add_argument("--no-extra-columns", action="store_true")
+    args = parser.parse_args()
+
+    start = datetime.now()
+    summary = generate(
+        args.path, args.rows, args.seed, args.fanout, args.denial_rate,
+        args.start, args.months, args.near_miss, not args.no_extra_columns,
+    )
+    print(f"Wrote {summary['path']} ({summary['bytes'] / 1e6:.1f} MB) in {(datetime.now() - start).total_seconds():.1f}s")
+    for key, n in summary["rows"].items():
+        print(f"  {key:<11} {n:>9,} rows")
+    print(f"  claims      {summary['claims']:>9,}")
+
+
+if __name__ == "__main__":
+    main()
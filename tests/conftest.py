@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """ETL with every output, cache and database path under tmp_path."""
+    import ETL
+
+    for name in ("OUTPUT_DIR", "ARCHIVE_DIR", "CACHE_DIR", "SCRATCH_DIR"):
+        (tmp_path / name).mkdir()
+        monkeypatch.setattr(ETL, name, str(tmp_path / name))
+    monkeypatch.setattr(ETL, "DB_PATH", str(tmp_path / "etl_kpis.db"))
+    monkeypatch.setattr(ETL, "SHEET_CACHE_ENABLED", False)
+    monkeypatch.setattr(ETL, "INCREMENTAL", False)
+    monkeypatch.setattr(ETL, "BUILD_ROLLUPS", True)
+    monkeypatch.setattr(ETL, "OUTPUT_FORMATS", ["csv"])
+    return tmp_path
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _test_logs(tmp_path_factory):
+    """Keep the tests out of the tracked logs/etl.log, here and in worker processes."""
+    import logging
+    from logging.handlers import RotatingFileHandler
+
+    path = str(tmp_path_factory.mktemp("logs"))
+    os.environ["ETL_LOG_DIR"] = path
+    log = logging.getLogger("ETL")
+    for handler in [h for h in log.handlers if isinstance(h, RotatingFileHandler)]:
+        log.removeHandler(handler)
+        handler.close()
+        replacement = logging.FileHandler(os.path.join(path, "etl.log"), delay=True)
+        replacement.setFormatter(handler.formatter)
+        log.addHandler(replacement)
+    yield
+    os.environ.pop("ETL_LOG_DIR", None)
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pandas as pd
+
+import dates
+
+
+def test_chunks_record_one_report_for_the_whole_sheet(tmp_path):
+    path = str(tmp_path / "kpis.db")
+    store = dates.FormatStore(path)
+    chunks = [
+        pd.DataFrame({"Service Date": ["01/02/2024", "01/03/2024", "junk"]}),
+        pd.DataFrame({"Service Date": ["2024-01-04", "01/05/2024"]}),
+    ]
+
+    total = {}
+    for chunk in chunks:
+        dates.merge_reports(total, dates.coerce_frame(chunk, "Charges", store, persist=False))
+        # nothing is written per chunk, but the chain found so far is the next chunk's hint
+        assert not sqlite3.connect(path).execute("SELECT COUNT(*) FROM etl_date_formats").fetchone()[0]
+        assert "%m/%d/%Y" in store.get("Charges", "Service Date")
+    store.record("Charges", total)
+
+    row = sqlite3.connect(path).execute("SELECT formats, last_values, last_failed FROM etl_date_formats").fetchone()
+    assert row == ('["%m/%d/%Y", "%Y-%m-%d"]', 5, 1)
+    assert total["Service Date"]["failure_rate"] == 0.2
+
+
+def test_streaming_records_each_sheet_once(pipeline, monkeypatch):
+    import ETL
+    import excel_reader
+    import synth_workbook
+
+    path = str(pipeline / "wb.xlsx")
+    synth_workbook.generate(path, rows=600, seed=2)
+    monkeypatch.setattr(ETL, "READ_CHUNK_ROWS", 50)
+    monkeypatch.setattr(ETL, "_date_format_stores", {})
+    recorded = []
+    monkeypatch.setattr(dates.FormatStore, "record", lambda self, key, reports: recorded.append((key, reports)))
+
+    with excel_reader.open_workbook(path) as wb:
+        sheet = next(s for s in wb.sheetnames if ETL.match_sheet(s) == "Charges")
+        chunks = list(ETL.iter_sheet_streaming(wb, sheet, ETL.sheet_mappings["Charges"], "Charges"))
+
+    assert len(chunks) > 1
+    assert len(recorded) == 1
+    key, reports = recorded[0]
+    dated = [c for c in chunks[0].columns if dates.is_date_column(c)]
+    assert key == "Charges" and dated
+    for col in dated:
+        assert reports[col]["values"] == sum(int(c[col].notna().sum()) for c in chunks)
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import excel_reader
+
+HEADER = ["Claim No", "Notes", "Billed Amount", None, "Service Date", "Payer"]
+ROWS = [
+    [1, "a", 10.5, None, datetime(2024, 1, 2), "Acme"],
+    [2, None, None, "stray", None, None],  # data only in columns that are dropped
+    None,  # blank row
+    [3, "c", 7, None, "01/05/2024", None, "past the header"],
+    [None, None, None, None, None, "Beta"],
+    [None, "only notes"],
+    [4, "d", 0, None, datetime(2024, 2, 29), "Gamma"],
+]
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "sparse.xlsx")
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Charges"
+    ws.append(HEADER)
+    for row in ROWS:
+        if row is not None:
+            ws.append(row)
+        else:
+            ws.append([])
+    ws.cell(row=20, column=1, value=5)  # rows 10..19 are missing from the XML
+    ws.cell(row=20, column=5, value=datetime(2024, 3, 1))
+    wb.save(path)
+    return path
+
+
+@pytest.mark.parametrize("keep", [[0, 2, 4], [5], [0, 1, 2, 3, 4, 5], [1, 5]])
+def test_row_reader_matches_iter_rows(workbook, keep):
+    with excel_reader.open_workbook(workbook) as wb:
+        ws = wb["Charges"]
+        ws.reset_dimensions()
+        plain = [tuple(row) for row in ws.iter_rows(values_only=True)]
+        reader = excel_reader.RowReader(ws)
+        reader.keep_columns = {i + 1 for i in keep}
+        fast = [tuple(row) for row in reader]
+
+    assert len(fast) == len(plain)
+    for got, want in zip(fast, plain):
+        width = max(len(got), len(want))
+        got, want = got + (None,) * (width - len(got)), want + (None,) * (width - len(want))
+        for i, (g, w) in enumerate(zip(got, want)):
+            if i in keep:
+                assert g == w
+            else:
+                assert g is (None if w is None else excel_reader._DROPPED)
+
+
+@pytest.mark.parametrize("keep", [[0, 2, 4], [5], [1, 5]])
+def test_projected_chunks_match_the_full_read(workbook, keep):
+    with excel_reader.open_workbook(workbook) as wb:
+        full = list(excel_reader.iter_sheet_chunks(wb, "Charges", chunk_rows=2))
+        projected = list(excel_reader.iter_sheet_chunks(wb, "Charges", chunk_rows=2, usecols=lambda columns: keep))
+
+    # rows with data only in dropped columns stay, so the chunks line up with the full read
+    assert [len(chunk) for chunk in projected] == [len(chunk) for chunk in full]
+    for got, chunk in zip(projected, full):
+        pd.testing.assert_frame_equal(got, chunk.iloc[:, keep].infer_objects())
+
+
+def test_unsupported_openpyxl_release_falls_back_to_iter_rows(workbook, monkeypatch):
+    monkeypatch.setattr(excel_reader, "SUPPORTED_OPENPYXL", ("0.0.",))
+    with excel_reader.open_workbook(workbook) as wb:
+        ws = wb["Charges"]
+        ws.reset_dimensions()
+        reader = excel_reader.RowReader(ws)
+        reader.keep_columns = {1}
+        assert [tuple(row) for row in reader] == [tuple(row) for row in ws.iter_rows(values_only=True)]
@@ -0,0 +1,98 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import fact_table
+import run_registry
+
+
+def _load(conn, run_id, file_name, loaded_at, claims):
+    fact_table.load_frame(conn, pd.DataFrame({"claim no": claims, "billed amount": 1.0}), run_id, file_name)
+    conn.execute(
+        f"UPDATE {fact_table.RUNS_TABLE} SET loaded_at = ? WHERE run_id = ? AND file = ?",
+        (loaded_at, run_id, file_name),
+    )
+    conn.commit()
+
+
+def _ago(days):
+    return (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+
+
+def test_age_retention_is_per_file_not_per_run(tmp_path):
+    path = str(tmp_path / "kpis.db")
+    with sqlite3.connect(path) as conn:
+        run_registry.ensure_tables(conn)
+        conn.execute(
+            "INSERT INTO etl_runs (run_id, status, started_at) VALUES ('watch_run', 'succeeded', ?)", (_ago(45),)
+        )
+        conn.commit()
+        _load(conn, "watch_run", "old.xlsx", _ago(40), [1, 2])
+        _load(conn, "watch_run", "new.xlsx", _ago(0), [3, 4])
+
+    result = fact_table.apply_retention(path, max_age_days=30)
+
+    assert result["runs"] == []
+    assert result["files"] == [{"run_id": "watch_run", "file": "old.xlsx"}]
+    with sqlite3.connect(path) as conn:
+        left = conn.execute(f"SELECT file, COUNT(*) FROM {fact_table.FACT_TABLE} GROUP BY file").fetchall()
+    assert left == [("new.xlsx", 2)]
+
+
+def test_keep_runs_ranks_by_latest_load_and_spares_running_runs(tmp_path):
+    path = str(tmp_path / "kpis.db")
+    with sqlite3.connect(path) as conn:
+        run_registry.ensure_tables(conn)
+        conn.executemany(
+            "INSERT INTO etl_runs (run_id, status, started_at) VALUES (?, ?, ?)",
+            [("watch_run", "succeeded", _ago(60)), ("cli_run", "succeeded", _ago(2)), ("busy", "running", _ago(9))],
+        )
+        conn.commit()
+        _load(conn, "watch_run", "a.xlsx", _ago(0), [1])
+        _load(conn, "cli_run", "b.xlsx", _ago(2), [2])
+        _load(conn, "busy", "c.xlsx", _ago(9), [3])
+
+    assert fact_table.apply_retention(path, keep_runs=1)["runs"] == ["cli_run"]
+
+
+def test_statistics_refresh_only_after_the_table_doubles(tmp_path):
+    path = str(tmp_path / "kpis.db")
+    with sqlite3.connect(path) as conn:
+        _load(conn, "r1", "a.xlsx", _ago(0), list(range(100)))
+    assert fact_table.refresh_statistics(path)
+    with sqlite3.connect(path) as conn:
+        _load(conn, "r2", "a.xlsx", _ago(0), list(range(50)))
+    assert not fact_table.refresh_statistics(path)
+    with sqlite3.connect(path) as conn:
+        _load(conn, "r3", "a.xlsx", _ago(0), list(range(100)))
+    assert fact_table.refresh_statistics(path)
+
+
+def test_incremental_vacuum_stops_when_nothing_can_be_released(tmp_path):
+    conn = sqlite3.connect(tmp_path / "kpis.db")  # auto_vacuum stays NONE, so free pages can't be released
+    conn.execute("CREATE TABLE t (x TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?)", [("x" * 500,)] * 200)
+    conn.commit()
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+
+    assert fact_table._incremental_vacuum(conn) == 0
+
+
+def test_only_the_explicit_maintenance_step_switches_to_incremental_vacuum(tmp_path):
+    path = str(tmp_path / "kpis.db")
+
+    def expire_a_run(run_id):
+        with sqlite3.connect(path) as conn:
+            _load(conn, run_id, "a.xlsx", _ago(40), list(range(20_000)))
+        return fact_table.apply_retention(path, max_age_days=30)
+
+    assert expire_a_run("r1")["pages_released"] == 0
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    assert fact_table.enable_incremental_vacuum(path) is True
+    assert fact_table.enable_incremental_vacuum(path) is False
+    assert expire_a_run("r2")["pages_released"] > 0
@@ -0,0 +1,49 @@
+import pytest
+
+import ETL
+import header_match
+
+
+def test_headers_match_regardless_of_case():
+    assigned, settled = header_match.assign(["ACCOUNT NUM", "billed amt"], ["Account Num", "Billed Amt"])
+    assert assigned == {"ACCOUNT NUM": "Account Num", "billed amt": "Billed Amt"}
+    assert settled == {"ACCOUNT NUM", "billed amt"}
+
+
+def test_first_header_equal_up_to_case_wins():
+    assigned, _ = header_match.assign(["account num", "ACCOUNT NUM"], ["Account Num"])
+    assert assigned == {"account num": "Account Num"}
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_header_cache_does_not_change_resolution(tmp_path, monkeypatch, cached):
+    monkeypatch.setattr(ETL, "DB_PATH", str(tmp_path / "etl_kpis.db"))
+    monkeypatch.setattr(ETL, "HEADER_CACHE_ENABLED", cached)
+    mapping = ETL.sheet_mappings["Charges"]
+    columns = [key.upper() for key in mapping] + ["Unrelated Column"]
+    expected = {key.upper(): target for key, target in mapping.items()} | {"Unrelated Column": "Unrelated Column"}
+    for _ in range(2):
+        assert ETL.resolve_headers(columns, mapping, "Charges") == expected
+
+
+def _resolved(variants):
+    """(canonical, variant, what it resolved to) in every sheet mapping that has the canonical key."""
+    return [
+        (canonical, variant, header_match.assign([variant], list(mapping))[0].get(variant))
+        for canonical, spellings in variants.items()
+        for variant in spellings
+        for mapping in ETL.sheet_mappings.values()
+        if canonical in mapping
+    ]
+
+
+def test_synthetic_header_variants_resolve():
+    import synth_workbook
+
+    assert all(got == canonical for canonical, _, got in _resolved(synth_workbook.HEADER_VARIANTS))
+
+
+def test_synthetic_near_misses_stay_below_the_cutoff():
+    import synth_workbook
+
+    assert [(variant, got) for _, variant, got in _resolved(synth_workbook.NEAR_MISS_VARIANTS) if got] == []
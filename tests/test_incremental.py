@@ -0,0 +1,90 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import incremental
+import rollups
+import synth_workbook
+
+
+def _deliver(conn, file_name, claims, run_id):
+    sheets = {"Charges": pd.DataFrame({"Claim No": claims, "Amount": [10.0] * len(claims)})}
+    fingerprints = incremental.claim_fingerprints(sheets)
+    changed, removed = incremental.changed_claims(conn, file_name, fingerprints)
+    delta = incremental.select_claims(sheets["Charges"].rename(columns=str.lower), changed)
+    incremental.upsert_claims(
+        conn, delta, delta["claim no"], fingerprints[fingerprints.index.isin(list(changed))], removed,
+        f"hash-{file_name}-{run_id}", file_name, {}, len(fingerprints), run_id,
+    )
+    return changed, removed
+
+
+def _stored(conn):
+    rows = conn.execute(f'SELECT file, "claim no" FROM {incremental.KPI_TABLE} ORDER BY 1, 2').fetchall()
+    return rows
+
+
+def test_claims_are_keyed_per_workbook_and_removed_on_redelivery(tmp_path):
+    conn = sqlite3.connect(tmp_path / "kpis.db")
+    _deliver(conn, "a.xlsx", [1, 2, 3], "r1")
+    changed, _ = _deliver(conn, "b.xlsx", [2, 3], "r2")
+
+    # b reuses claim numbers from a: they are new for b and leave a's rows alone
+    assert changed == {"2", "3"}
+    assert _stored(conn) == [("a.xlsx", 1), ("a.xlsx", 2), ("a.xlsx", 3), ("b.xlsx", 2), ("b.xlsx", 3)]
+
+    changed, removed = _deliver(conn, "a.xlsx", [1, 3], "r3")
+    assert (changed, removed) == (set(), {"2"})
+    assert _stored(conn) == [("a.xlsx", 1), ("a.xlsx", 3), ("b.xlsx", 2), ("b.xlsx", 3)]
+    fingerprints = conn.execute("SELECT file_name, claim_no FROM etl_claim_fingerprints ORDER BY 1, 2").fetchall()
+    assert fingerprints == [("a.xlsx", "1"), ("a.xlsx", "3"), ("b.xlsx", "2"), ("b.xlsx", "3")]
+
+
+def test_redelivery_keeps_whole_workbook_kpis_rollups_and_output(pipeline, monkeypatch):
+    import ETL
+
+    monkeypatch.setattr(ETL, "INCREMENTAL", True)
+    monkeypatch.setattr(ETL, "JOIN_MODE", "claim")
+    path = str(pipeline / "wb.xlsx")
+    synth_workbook.generate(path, rows=600, seed=5)
+    original = pd.read_excel(path, sheet_name=None)
+    charged = ETL.extract_sheets(path, None)["Charges"]["Claim No"].nunique()
+
+    def deliver(run_id, sheet=None, value=None):
+        """Write the original workbook, with the first amount of the sheet named `sheet...` set to `value`."""
+        with pd.ExcelWriter(path) as writer:
+            for name, df in original.items():
+                if sheet and name.startswith(sheet):
+                    df = df.copy()
+                    df.loc[0, "Amount"] = value
+                df.to_excel(writer, sheet_name=name, index=False)
+        result = ETL.process_single_file(path, run_id)
+        assert result["success"], result.get("error")
+        output = pd.read_csv(os.path.join(ETL.OUTPUT_DIR, "wb_with_kpis.csv"))
+        with sqlite3.connect(ETL.DB_PATH) as conn:
+            stored = pd.read_sql(f"SELECT * FROM {incremental.KPI_TABLE}", conn)
+            rolled = conn.execute(
+                f"SELECT SUM(claims) FROM {rollups.ROLLUP_TABLE} WHERE run_id = ? AND dimension = 'all'", (run_id,)
+            ).fetchone()[0]
+        return result, output, stored, rolled
+
+    result, output, stored, rolled = deliver("r1")
+    claims = result["total_claims"]
+    assert result["changed_claims"] == claims
+    full_rate = output["denial rate (%)"].iloc[0]
+
+    # a payment edit touches one claim and none of the frame-wide bases
+    result, output, stored, rolled = deliver("r2", "Payment", 1.0)
+    assert result["changed_claims"] == 1
+    assert len(output) == len(stored) == charged
+    assert rolled == charged
+    assert stored["denial rate (%)"].unique().tolist() == [full_rate]
+
+    # a billed edit moves the AR Days basis, so every stored row is recomputed
+    result, output, stored, rolled = deliver("r3", "Charges", 123456.0)
+    assert result["changed_claims"] == claims
+    merged = stored.sort_values("claim no").reset_index(drop=True)
+    expected = output.sort_values("claim no").reset_index(drop=True)
+    assert merged["ar days"].tolist() == pytest.approx(expected["ar days"].tolist(), nan_ok=True)
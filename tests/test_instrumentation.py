@@ -0,0 +1,28 @@
+import sys
+
+import pytest
+
+import instrumentation
+
+MiB = 2 ** 20
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self")
+def test_peak_rss_delta_sees_memory_freed_within_the_stage():
+    # raise the lifetime high-water mark first, as an earlier large workbook would
+    spike = b"\x01" * (256 * MiB)
+    del spike
+
+    recorder = instrumentation.StageRecorder("book.xlsx")
+    recorder.mark("merge")
+    with recorder.stage("fanout"):
+        block = b"\x01" * (64 * MiB)
+        del block
+    with recorder.stage("small"):
+        pass
+    recorder.mark(None)
+
+    # the fan-out block is gone by the end of both stages, but still counts as their peak
+    assert recorder.stages["merge.fanout"].peak_rss_delta_bytes >= 48 * MiB
+    assert recorder.stages["merge"].peak_rss_delta_bytes >= 48 * MiB
+    assert recorder.stages["merge.small"].peak_rss_delta_bytes < 16 * MiB
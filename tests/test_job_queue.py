@@ -0,0 +1,60 @@
+from job_queue import JobQueue
+
+
+def _queues(tmp_path):
+    db = str(tmp_path / "jobs.db")
+    a, b = JobQueue(db, lambda *args: None, lease=60), JobQueue(db, lambda *args: None, lease=60)
+    a.ensure_table()
+    return a, b
+
+
+def test_running_job_is_requeued_only_after_its_lease_expires(tmp_path):
+    a, b = _queues(tmp_path)
+    job_id = a.submit()
+    assert a._claim()[0] == job_id
+
+    # a second process starting up leaves the live job alone
+    assert b.requeue_expired() == 0
+    assert b.get(job_id)["status"] == "running"
+    assert b.get(job_id)["worker_id"] == a.worker_id
+
+    with a._connect() as conn:
+        conn.execute("UPDATE etl_jobs SET heartbeat_at='2000-01-01T00:00:00' WHERE id=?", (job_id,))
+    assert b.requeue_expired() == 1
+    assert b._claim()[0] == job_id
+
+    # the old owner lost the lease, so its late result is dropped
+    a._update(job_id, status="succeeded")
+    assert b.get(job_id)["status"] == "running"
+
+
+def test_input_files_are_claimed_across_queues(tmp_path):
+    a, b = _queues(tmp_path)
+    try:
+        assert a.claim_files(["x.xlsx", "y.xlsx"]) == ["x.xlsx", "y.xlsx"]
+        assert b.claim_files(["x.xlsx", "z.xlsx"]) == ["z.xlsx"]
+        a.release_files(["x.xlsx"])
+        assert b.claim_files(["x.xlsx", "y.xlsx"]) == ["x.xlsx"]
+    finally:
+        a.stop(timeout=1)
+        b.stop(timeout=1)
+
+
+def test_job_is_failed_once_its_attempts_are_used_up(tmp_path):
+    db = str(tmp_path / "jobs.db")
+    a = JobQueue(db, lambda *args: None, lease=60, max_attempts=2)
+    a.ensure_table()
+    job_id = a.submit()
+
+    for attempt in (1, 2):
+        assert a._claim()[0] == job_id
+        with a._connect() as conn:
+            conn.execute("UPDATE etl_jobs SET heartbeat_at='2000-01-01T00:00:00' WHERE id=?", (job_id,))
+        assert a.requeue_expired() == (1 if attempt == 1 else 0)
+
+    job = a.get(job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+    assert job["error"] == "worker lease expired on attempt 2 of 2"
+    assert job["finished_at"] is not None
+    assert a._claim() is None
@@ -0,0 +1,18 @@
+import parallel
+
+
+def _try_lock() -> bool:
+    lock = parallel.shared_lock()
+    if lock.acquire(timeout=0.2):
+        lock.release()
+        return True
+    return False
+
+
+def test_pools_open_together_share_the_parent_lock():
+    with parallel.worker_pool(2) as first, parallel.worker_pool(2) as second:
+        with parallel.db_write_lock():
+            assert not first.submit(_try_lock).result()
+            assert not second.submit(_try_lock).result()
+        assert first.submit(_try_lock).result()
+        assert second.submit(_try_lock).result()
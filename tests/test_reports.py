@@ -0,0 +1,26 @@
+import sqlite3
+
+import pytest
+
+import reports
+
+
+@pytest.mark.parametrize("order", ["claim", "rowid"])
+def test_keyset_pages_cover_null_claim_numbers(order):
+    conn = sqlite3.connect(":memory:")
+    conn.execute('CREATE TABLE claims ("claim no" INTEGER, amount REAL)')
+    claims = [5, None, 3, None, None, 3, 1, None, 7]
+    conn.executemany("INSERT INTO claims VALUES (?, ?)", [(c, i) for i, c in enumerate(claims)])
+
+    seen, after = [], None
+    while True:
+        sql, params, key_width = reports.page_query("claims", ["amount"], order, after, 2)
+        page = conn.execute(sql, params).fetchall()
+        seen += [row[key_width] for row in page]
+        if len(page) < 2:
+            break
+        after = reports.encode_cursor(page[-1][:key_width])
+
+    assert sorted(seen) == list(range(len(claims)))
+    if order == "claim":
+        assert seen == [1.0, 3.0, 4.0, 7.0, 6.0, 2.0, 5.0, 0.0, 8.0]
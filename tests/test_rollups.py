@@ -0,0 +1,34 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import ETL
+import rollups
+import synth_workbook
+
+
+@pytest.mark.parametrize("out_of_core", [False, True])
+def test_line_mode_rollups_match_sheet_sums(pipeline, monkeypatch, out_of_core):
+    monkeypatch.setattr(ETL, "JOIN_MODE", "line")
+    monkeypatch.setattr(ETL, "OUT_OF_CORE", out_of_core)
+    path = str(pipeline / "wb.xlsx")
+    synth_workbook.generate(path, rows=2_000, seed=3, fanout=3.0)
+    sheets = ETL.extract_sheets(path, None)
+    expected = {
+        "billed": ("Charges", "Billed Amount"),
+        "paid": ("Payment", "Paid Amount"),
+        "adjustment": ("Adjustment", "Adjustment Amount"),
+        "ar_balance": ("Pending AR", "AR Balance"),
+    }
+
+    result = ETL.process_single_file(path, "r1")
+    assert result["success"], result.get("error")
+
+    with sqlite3.connect(ETL.DB_PATH) as conn:
+        totals = pd.read_sql(
+            f"SELECT * FROM {rollups.ROLLUP_TABLE} WHERE run_id = 'r1' AND dimension = 'all'", conn
+        ).sum(numeric_only=True)
+    for measure, (sheet, column) in expected.items():
+        assert totals[measure] == pytest.approx(pd.to_numeric(sheets[sheet][column]).sum(), rel=1e-9)
+    assert totals["claims"] == sheets["Charges"]["Claim No"].nunique()
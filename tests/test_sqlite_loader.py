@@ -0,0 +1,45 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import sqlite_loader
+
+
+def _conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "load.db")
+    conn.execute("CREATE TABLE audit (note TEXT)")
+    conn.commit()
+    return conn
+
+
+def test_bulk_load_leaves_the_callers_transaction_open(tmp_path):
+    conn = _conn(tmp_path)
+    conn.execute("INSERT INTO audit VALUES ('pending')")
+    sqlite_loader.bulk_load(conn, pd.DataFrame({"a": [1, 2]}), "loaded")
+
+    assert conn.in_transaction
+    conn.rollback()
+    assert conn.execute("SELECT COUNT(*) FROM audit").fetchone()[0] == 0
+    assert sqlite_loader.table_columns(conn, "loaded") == []
+
+
+def test_failed_load_rolls_back_only_its_savepoint(tmp_path):
+    conn = _conn(tmp_path)
+    sqlite_loader.bulk_load(conn, pd.DataFrame({"a": [1]}), "loaded")
+    conn.execute("INSERT INTO audit VALUES ('pending')")
+    with pytest.raises(ValueError):
+        sqlite_loader.bulk_load(conn, pd.DataFrame({"a": [2]}), "loaded", if_exists="fail")
+
+    conn.commit()
+    assert conn.execute("SELECT note FROM audit").fetchall() == [("pending",)]
+    assert conn.execute("SELECT a FROM loaded").fetchall() == [(1,)]
+
+
+def test_bulk_load_commits_on_its_own(tmp_path):
+    conn = _conn(tmp_path)
+    sqlite_loader.bulk_load(conn, pd.DataFrame({"a": [1, 2]}), "loaded")
+
+    assert not conn.in_transaction
+    other = sqlite3.connect(tmp_path / "load.db")
+    assert other.execute("SELECT COUNT(*) FROM loaded").fetchone()[0] == 2
@@ -0,0 +1,46 @@
+import zipfile
+
+from watcher import FolderWatcher
+
+
+def _workbook(path):
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("xl/workbook.xml", "<workbook/>")
+    return str(path)
+
+
+def _poll(w, times=2):
+    for _ in range(times):
+        w._scan()
+        w._settle()
+
+
+def test_declined_file_is_reported_again_after_retry_seconds(tmp_path):
+    path = _workbook(tmp_path / "book.xlsx")
+    seen = []
+    w = FolderWatcher(str(tmp_path), lambda p: seen.append(p) or len(seen) > 1, settle_seconds=0, retry_seconds=0)
+
+    _poll(w)
+    assert seen == [path]
+    _poll(w)
+    assert seen == [path, path]
+
+    # accepted the second time, so it is not reported again while unchanged
+    _poll(w)
+    assert seen == [path, path]
+
+
+def test_failed_file_waits_for_retry_unless_rewritten(tmp_path):
+    path = _workbook(tmp_path / "book.xlsx")
+    seen = []
+    w = FolderWatcher(str(tmp_path), seen.append, settle_seconds=0, retry_seconds=3600)
+
+    _poll(w)
+    w.retry(path)
+    _poll(w)
+    assert seen == [path]
+
+    with zipfile.ZipFile(path, "a") as zf:
+        zf.writestr("xl/styles.xml", "<styles/>")
+    _poll(w)
+    assert seen == [path, path]
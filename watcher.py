@@ -0,0 +1,270 @@
+# watcher.py
+"""
+Watch-folder ingestion.
+
+FolderWatcher notices workbooks landing in a directory (through watchdog's
+inotify/FSEvents/ReadDirectoryChanges observer when the package is installed,
+otherwise by polling the directory) and reports each one once it has finished
+arriving: its size and mtime have not changed for `settle_seconds` and it opens
+as a complete zip archive (an .xlsx is only readable once its central directory,
+at the very end of the file, has been written).
+
+watch() feeds those files to a worker pool one by one, so each workbook starts
+processing seconds after it lands instead of waiting for the next batch sweep.
+A file that is declined or fails to process is reported again `retry_seconds`
+later (sooner if it is rewritten), instead of being forgotten until it changes.
+"""
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+
+import parallel
+from logger import get_logger
+
+logger = get_logger()
+
+WORKBOOK_SUFFIXES = (".xlsx",)
+
+
+def _is_workbook(path: str) -> bool:
+    name = os.path.basename(path)
+    # skip Excel's "~$book.xlsx" lock files and hidden partial uploads
+    return name.lower().endswith(WORKBOOK_SUFFIXES) and not name.startswith(("~$", "."))
+
+
+def is_complete(path: str) -> bool:
+    """True once the workbook's zip central directory is readable."""
+    try:
+        return zipfile.is_zipfile(path)
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    """
+    Call `on_ready(path)` once for every workbook that lands (or already sits)
+    in `directory` after it has stopped changing. A file that is removed and
+    delivered again, or rewritten in place, is reported again. So is a file
+    `on_ready` returns False for (or raises on), and one passed to retry(),
+    after `retry_seconds`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        on_ready: Callable[[str], bool | None],
+        poll_interval: float = 1.0,
+        settle_seconds: float = 1.0,
+        use_events: bool = True,
+        stop_event: threading.Event | None = None,
+        retry_seconds: float = 30.0,
+    ):
+        self.directory = directory
+        self.on_ready = on_ready
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.retry_seconds = retry_seconds
+        self.use_events = use_events
+        # path -> (size, mtime, time the pair was first seen)
+        self._pending: Dict[str, Tuple[int, float, float]] = {}
+        # path -> (size, mtime) when it was handed to on_ready
+        self._reported: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = stop_event or threading.Event()
+        self._observer = None
+
+    # ---- discovery ----
+    def _notice(self, path: str) -> None:
+        if not _is_workbook(path):
+            return
+        with self._lock:
+            if path in self._reported:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    return
+                if (st.st_size, st.st_mtime) == self._reported[path]:
+                    return
+                del self._reported[path]
+            self._pending.setdefault(path, (-1, -1.0, 0.0))
+        self._wake.set()
+
+    def _scan(self) -> None:
+        try:
+            entries = [e.path for e in os.scandir(self.directory) if e.is_file()]
+        except OSError as e:
+            logger.warning(f"Cannot list {self.directory}: {e}")
+            return
+        present = set(entries)
+        with self._lock:
+            # forget files that were moved away so a re-delivery is picked up
+            for path in list(self._reported):
+                if path not in present:
+                    del self._reported[path]
+            for path in list(self._pending):
+                if path not in present:
+                    del self._pending[path]
+        for path in entries:
+            self._notice(path)
+
+    def _start_observer(self) -> bool:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher._notice(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher._notice(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher._notice(event.dest_path)
+
+        self._observer = Observer()
+        self._observer.schedule(_Handler(), self.directory, recursive=False)
+        self._observer.start()
+        return True
+
+    # ---- settling ----
+    def _settle(self) -> float:
+        """Report files that stopped changing; returns how long until the next check is due."""
+        now = time.monotonic()
+        ready, next_check = [], self.poll_interval
+        with self._lock:
+            candidates = list(self._pending.items())
+        for path, (size, mtime, since) in candidates:
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._pending.pop(path, None)
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                with self._lock:
+                    self._pending[path] = (st.st_size, st.st_mtime, now)
+                next_check = min(next_check, self.settle_seconds)
+                continue
+            remaining = self.settle_seconds - (now - since)
+            if remaining > 0:
+                next_check = min(next_check, remaining)
+            elif is_complete(path):
+                ready.append((path, size, mtime))
+            else:
+                # stable but not yet a valid archive: keep waiting for the writer
+                with self._lock:
+                    self._pending[path] = (size, mtime, now)
+
+        for path, size, mtime in ready:
+            with self._lock:
+                self._pending.pop(path, None)
+                self._reported[path] = (size, mtime)
+            try:
+                accepted = self.on_ready(path) is not False
+            except Exception as e:
+                logger.exception(f"Watcher callback failed for {path}: {e}")
+                accepted = False
+            if not accepted:
+                self.retry(path)
+        return max(next_check, 0.05)
+
+    def retry(self, path: str) -> None:
+        """Report a reported `path` again after retry_seconds, or once it changes."""
+        with self._lock:
+            seen = self._reported.pop(path, None)
+            if seen is None:
+                return
+            # back-date the settle clock so the file comes due retry_seconds from now
+            self._pending[path] = (*seen, time.monotonic() + self.retry_seconds - self.settle_seconds)
+        self._wake.set()
+
+    # ---- lifecycle ----
+    def run(self) -> None:
+        """Block until stop() is called (or KeyboardInterrupt)."""
+        events = self.use_events and self._start_observer()
+        logger.info(
+            f"Watching {self.directory} "
+            f"({'filesystem events' if events else f'polling every {self.poll_interval}s'})"
+        )
+        last_scan = 0.0
+        try:
+            while not self._stop.is_set():
+                # with an observer the periodic rescan only catches missed events and removals
+                rescan_every = self.poll_interval * (10 if events else 1)
+                if time.monotonic() - last_scan >= rescan_every:
+                    self._scan()
+                    last_scan = time.monotonic()
+                wait = self._settle()
+                self._wake.wait(wait if self._pending else min(wait, rescan_every))
+                self._wake.clear()
+        finally:
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer.join()
+                self._observer = None
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+
+def watch(
+    directory: str,
+    func: Callable[..., Any],
+    workers: int,
+    *args,
+    on_submit: Callable[[str], bool] | None = None,
+    on_result: Callable[[str, Any, str | None], None] | None = None,
+    poll_interval: float = 1.0,
+    settle_seconds: float = 1.0,
+    retry_seconds: float = 30.0,
+    stop_event: threading.Event | None = None,
+) -> None:
+    """
+    Run func(path, *args) in a worker pool for every workbook that lands in
+    `directory`, until interrupted or `stop_event` is set. `on_submit(path)` may
+    return False to skip a file; `on_result(path, result, error)` is called in
+    the parent as each file finishes (error is None on success). Skipped files,
+    and files whose func raised or returned {"success": False}, are retried
+    `retry_seconds` later.
+    """
+    with parallel.worker_pool(workers) as pool:
+
+        def done(path: str, fut: Future) -> None:
+            try:
+                result, error = fut.result(), None
+            except Exception as e:
+                result, error = None, str(e)
+            try:
+                if on_result:
+                    on_result(path, result, error)
+            finally:
+                if error is not None or (isinstance(result, dict) and result.get("success") is False):
+                    watcher.retry(path)
+
+        def submit(path: str) -> bool:
+            if on_submit and on_submit(path) is False:
+                return False
+            logger.info(f"Picked up {os.path.basename(path)}")
+            pool.submit(func, path, *args).add_done_callback(lambda fut, path=path: done(path, fut))
+            return True
+
+        watcher = FolderWatcher(
+            directory, submit, poll_interval, settle_seconds, stop_event=stop_event, retry_seconds=retry_seconds
+        )
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            logger.info("Watcher interrupted; waiting for files in progress")